@@ -2,6 +2,10 @@
 #Northcliff Environment Monitor Adafruit IO Feed Setup 7.3a - Gen Add Privacy Option to feeds
 import requests
 import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__)))) # Use the monitor's shared HTTP transport
+from Northcliff_Transport import HttpTransport
 
 
 # The aio_feed_prefix dictionary sets up the feed name and key prefixes, as well as the dashboard visibility setting. Customise the dictionary based on the names and keys for each property to be monitored,
@@ -137,7 +141,7 @@ def _post(path, data):
     resp_error = False
     reason = ''
     try:
-        response = requests.post(aio_url + path,
+        response = http_transport.post(aio_url + path,
                              headers={'X-AIO-Key': aio_key,
                                                     'Content-Type': 'application/json'},
                              data=json.dumps(data), timeout=10)
@@ -290,10 +294,12 @@ def create_aio_enviro_blocks():
 # Set up Adafruit IO
 print('Setting up Adafruit IO')
 aio_url = "https://io.adafruit.com/api/v2/" + aio_user_name
+http_transport = HttpTransport(default_timeout=10)
 
 create_aio_enviro_feeds()
 create_aio_enviro_dashboards()
 create_aio_enviro_blocks()
+http_transport.print_stats()
 
 
             
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor AQI Engine Benchmark - Gen
+# Compares the AQI engine with the previous nested loop max_aqi_level_factor, checks that both give the same level and
+# factor for random samples, and times batch evaluation of the air quality levels and standard indices over a year of
+# hourly history. e.g.
+# python3 aqi_engine_benchmark.py --samples 20000
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from Northcliff_AQI import AQIEngine, air_quality_thresholds, us_epa_aqi, eu_caqi
+
+parser = argparse.ArgumentParser(description='Northcliff Environment Monitor AQI Engine Benchmark')
+parser.add_argument('--samples', type=int, default=20000, help='Random samples checked against the previous implementation')
+parser.add_argument('--repeats', type=int, default=5, help='Lookups of each sample, as the display, Adafruit IO and scheduler do')
+args = parser.parse_args()
+
+own_data = {"P1": ["ug/m3", 0, air_quality_thresholds["P1"], 0], "P2.5": ["ug/m3", 0, air_quality_thresholds["P2.5"], 1],
+            "P10": ["ug/m3", 0, air_quality_thresholds["P10"], 2], "Oxi": ["ppm", 0, air_quality_thresholds["Oxi"], 3],
+            "Red": ["ppm", 0, air_quality_thresholds["Red"], 4], "NH3": ["ppm", 0, air_quality_thresholds["NH3"], 5],
+            "Temp": ["C", 0, [10,16,28,35], 6], "Hum": ["%", 0, [20,40,60,90], 7], "Bar": ["hPa", 0, [250,650,1013,1015], 8],
+            "Lux": ["Lux", 1, [-1,-1,30000,100000], 9]}
+air_quality_data = ["P1", "P2.5", "P10", "Oxi", "Red", "NH3"]
+
+
+def previous_max_aqi_level_factor(aqi_data, data):
+    max_aqi_level = 0
+    max_aqi_factor = 'All'
+    max_aqi = [max_aqi_factor, max_aqi_level]
+    for aqi_factor in aqi_data:
+        aqi_factor_level = 0
+        thresholds = data[aqi_factor][2]
+        for level in range(len(thresholds)):
+            if data[aqi_factor][1] > thresholds[level]:
+                aqi_factor_level = level + 1
+        if aqi_factor_level > max_aqi[1]:
+            max_aqi = [aqi_factor, aqi_factor_level]
+    return max_aqi
+
+
+def random_samples(rng, count):
+    # Mostly random readings, with some exactly on a threshold to check the boundaries
+    samples = []
+    for n in range(count):
+        sample = {}
+        for factor in air_quality_data:
+            if rng.random() < 0.1:
+                sample[factor] = rng.choice(own_data[factor][2])
+            else:
+                sample[factor] = round(rng.uniform(0, own_data[factor][2][-1] * 1.3), 2)
+        samples.append(sample)
+    return samples
+
+
+def time_lookups(samples, lookup, data):
+    start = time.perf_counter()
+    for sample in samples:
+        for factor in sample:
+            data[factor][1] = sample[factor]
+        for repeat in range(args.repeats):
+            lookup(data)
+    return (time.perf_counter() - start) / (len(samples) * args.repeats)
+
+
+rng = random.Random(0)
+samples = random_samples(rng, args.samples)
+
+# Same results as the previous implementation
+data = copy.deepcopy(own_data)
+engine = AQIEngine(data)
+mismatches = 0
+for sample in samples:
+    for factor in sample:
+        data[factor][1] = sample[factor]
+    if engine.max_level_factor(air_quality_data) != previous_max_aqi_level_factor(air_quality_data, data):
+        mismatches += 1
+batch = numpy.array([[sample[factor] for factor in air_quality_data] for sample in samples])
+batch_levels, batch_columns = engine.max_levels(batch, air_quality_data)
+batch_mismatches = sum(1 for sample, level in zip(samples, batch_levels) if level != previous_max_aqi_level_factor(
+    air_quality_data, {factor: [None, sample[factor], own_data[factor][2]] for factor in sample})[1])
+print('Samples:', len(samples), 'Mismatches:', mismatches, 'Batch Mismatches:', batch_mismatches)
+
+previous_time = time_lookups(samples, lambda data: previous_max_aqi_level_factor(air_quality_data, data), copy.deepcopy(own_data))
+engine_data = copy.deepcopy(own_data)
+timed_engine = AQIEngine(engine_data)
+engine_time = time_lookups(samples, lambda data: timed_engine.max_level_factor(air_quality_data), engine_data)
+print('Previous Lookup: {:.2f} us Engine Lookup: {:.2f} us ({} lookups per sample) Speed-up: {:.1f}x'.format(
+    previous_time * 1e6, engine_time * 1e6, args.repeats, previous_time / engine_time))
+
+start = time.perf_counter()
+for sample in samples:
+    previous_max_aqi_level_factor(air_quality_data, {factor: [None, sample[factor], own_data[factor][2]] for factor in sample})
+loop_time = time.perf_counter() - start
+start = time.perf_counter()
+engine.max_levels(batch, air_quality_data)
+batch_time = time.perf_counter() - start
+print('Levels of {} Samples. Loop: {:.1f} ms Batch: {:.2f} ms Speed-up: {:.0f}x'.format(len(samples), loop_time * 1000, batch_time * 1000,
+                                                                                      loop_time / batch_time))
+
+# A year of hourly mean history
+hours = 365 * 24
+history = {"P2.5": numpy.random.default_rng(0).gamma(2, 6, hours),
+           "P10": numpy.random.default_rng(1).gamma(2, 10, hours)}
+for index in [us_epa_aqi, eu_caqi]:
+    start = time.perf_counter()
+    for hour in range(hours):
+        index.sample({"P2.5": history["P2.5"][hour], "P10": history["P10"][hour]})
+    sample_time = time.perf_counter() - start
+    start = time.perf_counter()
+    values, pollutants = index.evaluate(history)
+    batch_time = time.perf_counter() - start
+    print('{} over {} Hours. Per Sample: {:.1f} ms Batch: {:.2f} ms Speed-up: {:.0f}x Max: {:.0f} Mean: {:.1f}'.format(
+        index.name, hours, sample_time * 1000, batch_time * 1000, sample_time / batch_time, numpy.nanmax(values), numpy.nanmean(values)))
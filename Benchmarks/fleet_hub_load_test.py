@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Fleet Hub Load Test - Gen
+# Simulates a fleet of monitors publishing mqtt_values payloads to a local broker and measures how many the fleet hub
+# receives and how long its aggregates take to compute. e.g.
+# python3 fleet_hub_load_test.py --broker localhost --devices 500 --interval 1 --duration 30
+# --in-process feeds the hub's on_message directly, without a broker, to measure the hub's own capacity.
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from Northcliff_Fleet_Hub import FleetHub
+
+parser = argparse.ArgumentParser(description='Northcliff Environment Monitor Fleet Hub Load Test')
+parser.add_argument('--broker', default='localhost', help='mqtt broker name')
+parser.add_argument('--port', type=int, default=1883, help='mqtt broker port')
+parser.add_argument('--devices', type=int, default=300, help='Simulated monitors')
+parser.add_argument('--interval', type=float, default=1.0, help='Seconds between each simulated monitor\'s payloads')
+parser.add_argument('--duration', type=float, default=20, help='Seconds of load')
+parser.add_argument('--publishers', type=int, default=4, help='mqtt client connections shared by the simulated monitors')
+parser.add_argument('--topic-prefix', default='northcliff_load_test', help='Simulated monitors publish on <prefix>/<device>')
+parser.add_argument('--in-process', action='store_true', help='Feed the hub directly instead of through a broker')
+args = parser.parse_args()
+
+
+class Message(object): # Stand-in for paho's MQTTMessage
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def device_payload(rng):
+    # Same format as the monitor's mqtt_values
+    pm = max(0, rng.gauss(15, 10))
+    return json.dumps({"P1": round(pm * 0.6, 1), "P2.5": round(pm, 1), "P10": round(pm * 1.4, 1), "Temp": round(rng.uniform(10, 35), 1),
+                       "Hum": [round(rng.uniform(20, 90), 1), "1"], "Bar": [round(rng.uniform(990, 1030), 1), "0"], "Red": round(rng.uniform(0, 10), 2),
+                       "Oxi": round(rng.uniform(0, 1), 2), "NH3": round(rng.uniform(0, 2), 2), "Gas Calibrated": rng.random() > 0.2,
+                       "Lux": round(rng.uniform(0, 2000), 1), "Min Temp": 10.0, "Max Temp": 30.0,
+                       "Forecast": {"Valid": True, "3 Hour Change": 0.4, "Forecast": "Fair"}}).encode('utf-8')
+
+
+def time_aggregates(hub, repeats=50):
+    start = time.perf_counter()
+    for repeat in range(repeats):
+        aggregates = hub.state.aggregate()
+    return (time.perf_counter() - start) / repeats, aggregates
+
+
+def run_in_process():
+    rng = random.Random(0)
+    payloads = [device_payload(rng) for n in range(200)]
+    for devices in [10, 100, args.devices, 1000]:
+        hub = FleetHub([args.topic_prefix + '/+'], args.topic_prefix + '/aggregates')
+        topics = [args.topic_prefix + '/' + str(device) for device in range(devices)]
+        messages = [Message(topics[n % devices], payloads[n % len(payloads)]) for n in range(max(20000, devices))]
+        start = time.perf_counter()
+        for msg in messages:
+            hub.on_message(None, None, msg)
+        update_rate = len(messages) / (time.perf_counter() - start)
+        aggregate_time, aggregates = time_aggregates(hub)
+        print('Devices: {} Updates: {:.0f} per second Aggregate: {:.2f} ms Neighbourhood Level: {} ({})'.format(
+            devices, update_rate, aggregate_time * 1000, aggregates["Air Quality Level"], aggregates["Air Quality Factor"]))
+
+
+def run_with_broker():
+    import paho.mqtt.client as mqtt
+    hub = FleetHub([args.topic_prefix + '/+'], args.topic_prefix + '/aggregates')
+    hub.connect(args.broker, 'Northcliff Fleet Hub Load Test', args.port)
+    time.sleep(1) # Allows the hub to subscribe
+    publishers = []
+    for number in range(args.publishers):
+        publisher = mqtt.Client('Northcliff Fleet Load Test Publisher ' + str(number))
+        publisher.connect(args.broker, args.port, 60)
+        publisher.loop_start()
+        publishers.append(publisher)
+    published = [0] * args.publishers
+
+    def publish(number):
+        # Each publisher sends its share of the devices' payloads, spread evenly over each interval
+        rng = random.Random(number)
+        devices = list(range(number, args.devices, args.publishers))
+        pause = args.interval / max(1, len(devices))
+        next_send = time.monotonic()
+        end = next_send + args.duration
+        while time.monotonic() < end:
+            for device in devices:
+                publishers[number].publish(args.topic_prefix + '/' + str(device), device_payload(rng))
+                published[number] += 1
+                next_send += pause
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    threads = [threading.Thread(target=publish, args=(number,)) for number in range(args.publishers)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    time.sleep(2) # Allows in-flight messages to arrive
+    elapsed = time.monotonic() - start
+    aggregate_time, aggregates = time_aggregates(hub)
+    hub.publish_aggregates()
+    print('Devices:', args.devices, 'Published:', sum(published), 'Received:', hub.state.updates,
+          'Delivered: {:.1f}%'.format(100 * hub.state.updates / max(1, sum(published))))
+    print('Hub Rate: {:.0f} messages per second Aggregate: {:.2f} ms'.format(hub.state.updates / elapsed, aggregate_time * 1000))
+    print('Aggregates:', json.dumps(aggregates))
+    for publisher in publishers:
+        publisher.loop_stop()
+        publisher.disconnect()
+    hub.stop()
+    hub.print_stats()
+
+
+if args.in_process:
+    run_in_process()
+else:
+    run_with_broker()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Graph Render Benchmark - Gen
+# Compares the frame time of the NumPy graph renderer with the previous draw.rectangle renderer and checks that
+# both produce identical pixels. Run from any directory with: python3 graph_render_benchmark.py
+
+import os
+import random
+import sys
+import time
+
+import numpy
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from Northcliff_Graph import render_graph
+
+WIDTH = 160
+HEIGHT = 80
+top_pos = 25
+palette = [(128,128,255), (0,255,0), (255,255,0), (255,165,0), (255,0,0)]
+thresholds = [11,35,53,70] # PM2.5 level thresholds
+frames = 500
+
+
+def legacy_render_graph(values, valid, thresholds, palette, width, height, top_pos): # The renderer replaced by render_graph
+    received_disp_values = (values * valid).tolist()
+    graph_range = [(v - min(received_disp_values)) / (max(received_disp_values) - min(received_disp_values)) if ((max(received_disp_values) - min(received_disp_values)) != 0)
+                   else 0 for v in received_disp_values]
+    img = Image.new('RGB', (width, height), color=(0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, width, height), (255, 255, 255))
+    for i in range(len(values)):
+        if valid[i]:
+            lim = thresholds
+            rgb = palette[0]
+            for j in range(len(lim)):
+                if values[i] > lim[j]:
+                    rgb = palette[j+1]
+        else:
+            rgb = (0,0,0)
+        draw.rectangle((i*2, top_pos, i*2+2, height), rgb)
+        line_y = (height-2) - ((top_pos + 1) + (graph_range[i] * ((height-2) - (top_pos + 1)))) + (top_pos + 1)
+        draw.rectangle((i*2, line_y, i*2+2, line_y+2), (0, 0, 0))
+    return img
+
+
+def vectorised_render_graph(values, valid, thresholds, palette, width, height, top_pos):
+    return Image.fromarray(render_graph(values, valid, thresholds, palette, width, height, top_pos), 'RGB')
+
+
+def histories(count, seed=0):
+    rng = random.Random(seed)
+    capacity = int(WIDTH / 2)
+    histories = []
+    for n in range(count):
+        values = numpy.array([max(0, rng.gauss(40, 25)) for i in range(capacity)])
+        valid = numpy.array([rng.random() > 0.1 for i in range(capacity)])
+        if n % 10 == 0:
+            valid[:] = False # Nothing received yet
+        elif n % 10 == 1:
+            values[:] = 20 # Flat history
+        histories.append((values, valid))
+    return histories
+
+
+def time_renderer(renderer, test_histories):
+    start = time.perf_counter()
+    for values, valid in test_histories:
+        renderer(values, valid, thresholds, palette, WIDTH, HEIGHT, top_pos)
+    return (time.perf_counter() - start) / len(test_histories)
+
+
+test_histories = histories(frames)
+mismatches = 0
+for values, valid in test_histories:
+    if legacy_render_graph(values, valid, thresholds, palette, WIDTH, HEIGHT, top_pos).tobytes() != \
+       vectorised_render_graph(values, valid, thresholds, palette, WIDTH, HEIGHT, top_pos).tobytes():
+        mismatches += 1
+legacy_time = time_renderer(legacy_render_graph, test_histories)
+vectorised_time = time_renderer(vectorised_render_graph, test_histories)
+print('Frames:', frames, 'Pixel Mismatches:', mismatches)
+print('Legacy Renderer: {:.3f} ms per frame'.format(legacy_time * 1000))
+print('Vectorised Renderer: {:.3f} ms per frame'.format(vectorised_time * 1000))
+print('Speedup: {:.1f}x'.format(legacy_time / vectorised_time))
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Benchmark Suite - Gen
+# Measures the latency and memory allocation of the monitor's compute and render paths off-device, using the simulated
+# hardware backend. Results are saved as JSON and can be compared with a baseline, so that each change gets a per-function
+# report and regressions beyond the thresholds are flagged (with a non-zero exit code). e.g.
+# python3 monitor_benchmark_suite.py --save-baseline baseline.json
+# python3 monitor_benchmark_suite.py --baseline baseline.json --time-threshold 0.15 --threshold display_icon_weather_aqi=0.3
+
+import argparse
+import contextlib
+import copy
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy
+
+benchmarks_directory = os.path.dirname(os.path.realpath(__file__))
+repository_directory = os.path.dirname(benchmarks_directory)
+
+parser = argparse.ArgumentParser(description='Northcliff Environment Monitor Benchmark Suite')
+parser.add_argument('--output', default='benchmark_results.json', help='Results file')
+parser.add_argument('--baseline', help='Baseline results file to compare with')
+parser.add_argument('--save-baseline', help='Also save the results as this baseline file')
+parser.add_argument('--time-threshold', type=float, default=0.15, help='Allowed increase in median latency (0.15 is 15%%)')
+parser.add_argument('--alloc-threshold', type=float, default=0.25, help='Allowed increase in peak allocation (0.25 is 25%%)')
+parser.add_argument('--threshold', action='append', default=[], metavar='FUNCTION=FRACTION',
+                    help='Latency threshold for one function, overriding --time-threshold. Can be repeated')
+parser.add_argument('--filter', default='', help='Only run the benchmarks whose names contain this text')
+parser.add_argument('--rounds', type=int, default=7, help='Timing rounds for each benchmark')
+parser.add_argument('--min-round-time', type=float, default=0.1, help='Minimum seconds per timing round')
+args = parser.parse_args()
+output_file = os.path.abspath(args.output)
+baseline_file = os.path.abspath(args.baseline) if args.baseline else None
+save_baseline_file = os.path.abspath(args.save_baseline) if args.save_baseline else None
+
+# Import the monitor with the simulated hardware backend. Importing it doesn't start the monitor or open its data files, and
+# its start-up messages are discarded
+os.environ.setdefault('ENVIRO_MONITOR_CONFIG', os.path.join(benchmarks_directory, 'benchmark_config.json'))
+sys.path.insert(0, repository_directory)
+devnull = open(os.devnull, 'w')
+with contextlib.redirect_stdout(devnull):
+    import Northcliff_AQI_Monitor_Gen as monitor
+
+
+def prepare_monitor_state(seed=0):
+    # Readings and display history as they would be after a few hours of running with warm gas sensors
+    rng = random.Random(seed)
+    readings = {"P1": 8, "P2.5": 14, "P10": 21, "Oxi": 0.6, "Red": 4.2, "NH3": 1.1, "Temp": 23.4, "Hum": 56, "Bar": 1014.2, "Lux": 850}
+    for reading in readings:
+        monitor.own_data[reading][1] = readings[reading]
+        for n in range(monitor.disp_history_length):
+            monitor.own_disp_values[reading].append(readings[reading] * rng.uniform(0.6, 1.4))
+    monitor.mqtt_values.update({"P1": 8, "P2.5": 14, "P10": 21, "Oxi": 0.6, "Red": 4.2, "NH3": 1.1, "Temp": 23.4, "Lux": 850,
+                                "Gas Calibrated": True, "Min Temp": 15.1, "Max Temp": 27.8})
+    monitor.mqtt_values["Hum"] = [56, "1"]
+    monitor.mqtt_values["Bar"] = [1014.2, "0"]
+    monitor.maxi_temp = 27.8
+    monitor.mini_temp = 15.1
+    monitor.barometer_history = [1014.2 - 0.3 * n for n in range(9)]
+
+
+def analyse_barometer_inputs():
+    for barometer in [1000, 1012, 1025]:
+        for barometer_change in [-12, -5, -2, 0, 2, 7, 12]:
+            monitor.analyse_barometer(barometer_change, barometer)
+
+
+def aqi_samples(count):
+    # Random readings of the air quality factors, one row per sample, in air_quality_data's order
+    rng = random.Random(0)
+    return [[round(rng.uniform(0, monitor.own_data[factor][2][-1] * 1.3), 2) for factor in monitor.air_quality_data]
+            for n in range(count)]
+
+
+def max_aqi_level_factor_samples():
+    # Each call looks up a new sample, and there are more samples than the AQI engine's memo holds, so the memo never
+    # answers and the uncached level lookup is timed
+    aqi_data = copy.deepcopy(monitor.own_data)
+    samples = itertools.cycle(aqi_samples(4 * monitor.aqi_engine(aqi_data).memo_size + 1))
+    def max_aqi_level_factor():
+        for factor, value in zip(monitor.air_quality_data, next(samples)):
+            aqi_data[factor][1] = value
+        return monitor.max_aqi_level_factor(True, monitor.air_quality_data, monitor.air_quality_data_no_gas, aqi_data)
+    return max_aqi_level_factor
+
+
+def benchmark_functions():
+    m = monitor
+    aqi_batch = numpy.array(aqi_samples(1440)) # A day of samples taken every minute
+    progress, period, day, local_dt = m.sun_moon_time(m.city_name, m.time_zone)
+    return {"display_graphed_data": lambda: m.display_graphed_data('IN', m.own_disp_values, 'P2.5', m.own_data['P2.5'], m.WIDTH),
+            "display_icon_weather_aqi": lambda: m.display_icon_weather_aqi('IN', m.own_data, '-', 'Fair', m.maxi_temp, m.mini_temp,
+                                                                           m.air_quality_data, m.air_quality_data_no_gas,
+                                                                           m.icon_air_quality_levels, True),
+            "display_all_aq": lambda: m.display_all_aq('IN', m.own_data, m.data_in_display_all_aq),
+            "draw_background": lambda: m.draw_background(progress, period, day, 1),
+            "max_aqi_level_factor": max_aqi_level_factor_samples(),
+            "aqi_engine_levels": lambda: m.aqi_engine(m.own_data).levels(aqi_batch, m.air_quality_data),
+            "read_gas_in_ppm": lambda: m.read_gas_in_ppm(m.gas_calib_temp, m.gas_calib_hum, m.gas_calib_bar, 24.1, 55.0, 1012.0, False),
+            "comp_gas": lambda: m.read_gas_in_ppm(m.gas_calib_temp, m.gas_calib_hum, m.gas_calib_bar, 24.1, 55.0, 1012.0, True),
+            "log_barometer": lambda: m.log_barometer(1014.5, list(m.barometer_history)),
+            "analyse_barometer": analyse_barometer_inputs,
+            "update_aio": lambda: m.update_aio(m.mqtt_values, 'Fair', m.aio_format, m.aio_forecast_text_format, m.aio_forecast_icon_format,
+                                               m.aio_air_quality_level_format, m.aio_air_quality_text_format, m.own_data,
+                                               m.icon_air_quality_levels, 'sunny', m.aio_package, True, m.air_quality_data,
+                                               m.air_quality_data_no_gas, None, None, None, None),
+            "persistent_log_serialization": lambda: m.persistent_snapshot.encode(m.build_persistent_data_log())}
+
+
+def time_function(function):
+    # Calibrates the iterations per round, then returns the median and minimum time per call over the rounds
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(iterations):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= args.min_round_time:
+            break
+        iterations = max(iterations * 2, int(iterations * args.min_round_time / max(elapsed, 1e-9)))
+    round_times = []
+    for round_number in range(args.rounds):
+        start = time.perf_counter()
+        for i in range(iterations):
+            function()
+        round_times.append((time.perf_counter() - start) / iterations)
+    return statistics.median(round_times), min(round_times), iterations
+
+
+def measure_allocation(function, calls=5):
+    # Peak traced memory above the starting point during one call, and the memory still held afterwards (median of calls)
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    try:
+        for call in range(calls):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            function()
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(current - before)
+    finally:
+        tracemalloc.stop()
+    return int(statistics.median(peaks)), int(statistics.median(retained))
+
+
+def run_benchmarks():
+    results = {}
+    prepare_monitor_state()
+    functions = benchmark_functions()
+    for name in functions:
+        if args.filter not in name:
+            continue
+        with contextlib.redirect_stdout(devnull): # The monitor's functions print their progress
+            functions[name]() # Warm up caches (e.g. fonts, icons and text metrics) as they would be on a running monitor
+            median, minimum, iterations = time_function(functions[name])
+            peak, retained = measure_allocation(functions[name])
+        results[name] = {"Median us": round(median * 1e6, 2), "Min us": round(minimum * 1e6, 2), "Iterations": iterations,
+                         "Peak Alloc Bytes": peak, "Retained Bytes": retained}
+        print('{:<30} {:>12.2f} us {:>10.1f} KiB peak'.format(name, median * 1e6, peak / 1024))
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', '-C', repository_directory, 'rev-parse', '--short', 'HEAD'],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"Python": platform.python_version(), "Machine": platform.machine(), "Platform": platform.platform(),
+            "Commit": commit, "Time": time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def function_thresholds():
+    thresholds = {}
+    for setting in args.threshold:
+        name, _, value = setting.partition('=')
+        thresholds[name] = float(value)
+    return thresholds
+
+
+def compare(results, baseline):
+    # A function regresses when its median latency or peak allocation grows by more than its threshold.
+    # Allocation changes of less than 1 KiB are ignored as noise
+    thresholds = function_thresholds()
+    regressions = []
+    print('')
+    print('{:<30} {:>11} {:>11} {:>8} {:>10} {:>10} {:>8}  {}'.format('Function', 'Median us', 'Baseline', 'Change', 'Peak KiB',
+                                                                       'Baseline', 'Change', 'Status'))
+    for name in results:
+        if name not in baseline:
+            print('{:<30} {:>11.2f} {:>11} {:>8}'.format(name, results[name]["Median us"], '-', 'new'))
+            continue
+        time_change = results[name]["Median us"] / baseline[name]["Median us"] - 1
+        base_peak = baseline[name]["Peak Alloc Bytes"]
+        peak = results[name]["Peak Alloc Bytes"]
+        alloc_change = peak / base_peak - 1 if base_peak else 0
+        status = []
+        if time_change > thresholds.get(name, args.time_threshold):
+            status.append('SLOWER')
+        if alloc_change > args.alloc_threshold and peak - base_peak > 1024:
+            status.append('MORE ALLOCATION')
+        if status:
+            regressions.append(name)
+        print('{:<30} {:>11.2f} {:>11.2f} {:>+7.1f}% {:>10.1f} {:>10.1f} {:>+7.1f}%  {}'.format(
+            name, results[name]["Median us"], baseline[name]["Median us"], time_change * 100, peak / 1024, base_peak / 1024,
+            alloc_change * 100, ', '.join(status) if status else 'OK'))
+    return regressions
+
+
+results = run_benchmarks()
+report = {"Environment": environment(), "Results": results}
+with open(output_file, 'w') as f:
+    json.dump(report, f, indent=2)
+print('Results written to', output_file)
+if save_baseline_file:
+    with open(save_baseline_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Baseline written to', save_baseline_file)
+if baseline_file:
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline["Results"])
+    if regressions:
+        print('Regressions:', ', '.join(regressions))
+        sys.exit(1)
+    print('No Regressions')
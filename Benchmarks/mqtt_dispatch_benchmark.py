@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor mqtt Dispatch Benchmark - Gen
+# Measures the sustained rate at which paho's network thread can accept messages from a busy Domoticz broker with the
+# previous on_message (decode and parse every payload, then compare topics) and with the topic dispatch table.
+# Run from any directory with: python3 mqtt_dispatch_benchmark.py
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from Northcliff_MQTT_Dispatch import MQTTDispatcher, MQTTRoute
+
+domoticz_topic = 'domoticz/out'
+outdoor_topic = 'enviro/outdoor'
+temp_hum_sensor_name = 'Outside'
+barometer_sensor_id = 42
+duration = 3 # Seconds of sustained load for each on_message
+dispatch_interval = 0.5 # Matches the monitor's mqtt_dispatch_interval
+
+
+class Message(object): # Stand-in for paho's MQTTMessage
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def domoticz_payload(idx, name, svalue1, svalue2='', svalue=None):
+    payload = {"Battery": 255, "RSSI": 12, "description": "", "dtype": "Temp + Humidity", "hwid": "3", "id": "1%03d" % idx,
+               "idx": idx, "name": name, "nvalue": 0, "stype": "THGN122/123/132, THGR122/228/238/268", "svalue1": svalue1,
+               "svalue2": svalue2, "svalue3": "0", "unit": 1}
+    if svalue is not None:
+        payload["svalue"] = svalue
+    return json.dumps(payload, indent=3).encode('utf-8')
+
+
+def test_messages(count, seed=0):
+    # Mostly traffic from other Domoticz devices and other applications' topics, as on a busy home automation broker
+    rng = random.Random(seed)
+    messages = []
+    for n in range(count):
+        draw = rng.random()
+        if draw < 0.01:
+            messages.append(Message(domoticz_topic, domoticz_payload(7, temp_hum_sensor_name, '%.1f' % rng.uniform(10, 30), '%d' % rng.randint(30, 90))))
+        elif draw < 0.02:
+            messages.append(Message(domoticz_topic, domoticz_payload(barometer_sensor_id, 'Barometer', '1013.2', '0', '1013.2;0')))
+        elif draw < 0.7:
+            idx = rng.randint(100, 400)
+            messages.append(Message(domoticz_topic, domoticz_payload(idx, 'Device %d' % idx, '%.1f' % rng.uniform(0, 100))))
+        else:
+            messages.append(Message('zigbee2mqtt/sensor_%d' % rng.randint(0, 50), json.dumps({"temperature": rng.uniform(10, 30),
+                                                                                              "linkquality": rng.randint(0, 255)}).encode('utf-8')))
+    return messages
+
+
+class ExternalSensors(object):
+    def __init__(self):
+        self.updates = 0
+
+    def capture_temp_humidity(self, parsed_json):
+        self.temperature = parsed_json['svalue1'] + '0'
+        self.humidity = parsed_json['svalue2'] + '.00'
+        self.updates += 1
+
+    def capture_barometer(self, value):
+        self.barometer = value[:-2]
+        self.updates += 1
+
+
+def legacy_on_message(es, msg): # The on_message replaced by the dispatch table
+    decoded_payload = str(msg.payload.decode("utf-8"))
+    parsed_json = json.loads(decoded_payload)
+    if msg.topic == domoticz_topic and parsed_json['name'] == temp_hum_sensor_name:
+        es.capture_temp_humidity(parsed_json)
+    if msg.topic == domoticz_topic and parsed_json['idx'] == barometer_sensor_id:
+        es.capture_barometer(parsed_json['svalue'])
+    if msg.topic == outdoor_topic:
+        pass
+
+
+def build_dispatcher(es):
+    dispatcher = MQTTDispatcher(100)
+    dispatcher.add_route(domoticz_topic, MQTTRoute('External Temp Hum', es.capture_temp_humidity, 'name', temp_hum_sensor_name))
+    dispatcher.add_route(domoticz_topic, MQTTRoute('External Barometer', lambda parsed_json: es.capture_barometer(parsed_json['svalue']),
+                                                   'idx', barometer_sensor_id))
+    dispatcher.add_route(outdoor_topic, MQTTRoute('Outdoor Data', lambda parsed_json: None, policy='drop_oldest'))
+    return dispatcher
+
+
+def sustained_rate(on_message, messages, consumer=None):
+    # Feeds messages to on_message for duration seconds, as paho's network thread would, while the consumer (if any)
+    # dispatches the queued updates every dispatch_interval. Returns messages per second
+    stop = threading.Event()
+    if consumer is not None:
+        def consume():
+            while not stop.wait(dispatch_interval):
+                consumer()
+        consumer_thread = threading.Thread(target=consume)
+        consumer_thread.start()
+    sent = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for msg in messages:
+            on_message(msg)
+        sent += len(messages)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if consumer is not None:
+        consumer_thread.join()
+        consumer()
+    return sent / elapsed
+
+
+messages = test_messages(5000)
+legacy_es = ExternalSensors()
+legacy_rate = sustained_rate(lambda msg: legacy_on_message(legacy_es, msg), messages)
+dispatch_es = ExternalSensors()
+dispatcher = build_dispatcher(dispatch_es)
+dispatch_rate = sustained_rate(lambda msg: dispatcher.on_message(None, None, msg), messages, dispatcher.dispatch)
+print('Test Messages:', len(messages), 'Sustained Load:', duration, 'seconds each')
+print('Legacy on_message: {:.0f} messages per second, {} handler calls'.format(legacy_rate, legacy_es.updates))
+print('Dispatch Table: {:.0f} messages per second, {} handler calls'.format(dispatch_rate, dispatch_es.updates))
+print('Speedup: {:.1f}x'.format(dispatch_rate / legacy_rate))
+dispatcher.print_stats()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor AQI Engine - Gen
+# Air quality levels from the monitor's own_data style thresholds, and the US EPA AQI and EU CAQI standard indices.
+# AQIEngine compiles a data dict's thresholds once, into sorted lists for single samples and a NumPy matrix for batches of
+# samples, and memoises the level and factor of each sample, because the display, Adafruit IO and the sampling scheduler
+# ask for the same sample's level several times. StandardIndex evaluates a piecewise-linear index over whole arrays of
+# concentrations (e.g. rolling means or time series history) at once.
+
+import bisect
+
+import numpy
+
+# Air quality level thresholds of the monitor's own readings, shared by the monitor's own_data and the fleet hub.
+# A reading's level is the number of its thresholds that it exceeds
+air_quality_thresholds = {"P1": [6,17,27,35], "P2.5": [11,35,53,70], "P10": [16,50,75,100], "Oxi": [0.5, 1, 3, 5],
+                          "Red": [5, 30, 50, 75], "NH3": [5, 30, 50, 75]}
+air_quality_levels = ['Great', 'OK', 'Alert', 'Poor', 'Bad']
+
+# Breakpoints of each standard index: [concentration low, concentration high, index low, index high] in ug/m3
+us_epa_breakpoints = {"P2.5": [[0.0, 9.0, 0, 50], [9.1, 35.4, 51, 100], [35.5, 55.4, 101, 150], [55.5, 125.4, 151, 200],
+                               [125.5, 225.4, 201, 300], [225.5, 325.4, 301, 500]], # 24 hour mean, 2024 revision
+                      "P10": [[0, 54, 0, 50], [55, 154, 51, 100], [155, 254, 101, 150], [255, 354, 151, 200], [355, 424, 201, 300],
+                              [425, 604, 301, 500]]} # 24 hour mean
+us_epa_truncation = {"P2.5": 1, "P10": 0} # Decimal places that concentrations are truncated to before the index is calculated
+eu_caqi_breakpoints = {"P2.5": [[0, 15, 0, 25], [15, 30, 25, 50], [30, 55, 50, 75], [55, 110, 75, 100]], # Hourly mean
+                       "P10": [[0, 25, 0, 25], [25, 50, 25, 50], [50, 90, 50, 75], [90, 180, 75, 100]]} # Hourly mean
+
+
+class AQIEngine(object):
+    def __init__(self, data, memo_size=64):
+        self.data = data # e.g. own_data: {factor: [unit, value, thresholds, ...]}. Its thresholds mustn't change
+        self.factors = list(data)
+        self.columns = {factor: column for column, factor in enumerate(self.factors)}
+        self.threshold_lists = {factor: sorted(data[factor][2]) for factor in self.factors}
+        # Rows are padded with inf, so that factors with fewer thresholds can share the matrix
+        width = max(len(self.threshold_lists[factor]) for factor in self.factors)
+        self.thresholds = numpy.full((len(self.factors), width), numpy.inf)
+        for column, factor in enumerate(self.factors):
+            self.thresholds[column, :len(self.threshold_lists[factor])] = self.threshold_lists[factor]
+        self.memo = {} # {(factors, values): (factor, level)}
+        self.memo_size = memo_size
+        self.hits = 0
+        self.misses = 0
+
+    def max_level_factor(self, factors):
+        """Returns [factor, level] for the factor with the highest air quality level (the number of its thresholds that its
+           value exceeds). The first factor wins a tie and "All" is returned when every level is 0."""
+        data = self.data
+        values = tuple([data[factor][1] for factor in factors])
+        key = (tuple(factors), values)
+        result = self.memo.get(key)
+        if result is not None:
+            self.hits += 1
+            return list(result)
+        self.misses += 1
+        max_factor = 'All'
+        max_level = 0
+        threshold_lists = self.threshold_lists
+        # bisect on the sorted lists gives the same levels as searchsorted on the matrix, without NumPy's per-call overhead,
+        # which makes searchsorted slower than a Python loop for a single sample of a few factors
+        for factor, value in zip(factors, values):
+            level = bisect.bisect_left(threshold_lists[factor], value)
+            if level > max_level:
+                max_factor = factor
+                max_level = level
+        if len(self.memo) >= self.memo_size: # Readings rarely return to earlier values, so the memo is just emptied when it's full
+            self.memo.clear()
+        self.memo[key] = (max_factor, max_level)
+        return [max_factor, max_level]
+
+    def levels(self, values, factors):
+        """Levels of a batch of samples. values has one column per factor (e.g. shape (samples, len(factors))).
+           NaN values have level 0."""
+        values = numpy.asarray(values, dtype=float)
+        thresholds = self.thresholds[[self.columns[factor] for factor in factors]]
+        with numpy.errstate(invalid='ignore'):
+            return (values[..., None] > thresholds).sum(axis=-1).astype(numpy.int8)
+
+    def max_levels(self, values, factors):
+        """Returns the highest level of each sample and the column of the factor that sets it (the first on a tie)."""
+        levels = self.levels(values, factors)
+        return levels.max(axis=-1), levels.argmax(axis=-1)
+
+    def print_stats(self):
+        print('AQI Engine Memo Hits:', self.hits, 'Misses:', self.misses)
+
+
+class StandardIndex(object):
+    def __init__(self, name, breakpoints, truncation=None, cap=None, round_index=True):
+        self.name = name
+        self.pollutants = list(breakpoints)
+        self.breakpoints = {pollutant: numpy.array(breakpoints[pollutant], dtype=float) for pollutant in breakpoints}
+        self.truncation = truncation or {}
+        self.cap = cap # Highest index. None extends the top band's slope to higher concentrations
+        self.round_index = round_index
+
+    def pollutant_index(self, pollutant, concentrations):
+        """The pollutant's index for an array (or a single value) of concentrations. NaN concentrations give NaN."""
+        table = self.breakpoints[pollutant]
+        concentrations = numpy.maximum(numpy.asarray(concentrations, dtype=float), 0)
+        if pollutant in self.truncation:
+            scale = 10 ** self.truncation[pollutant]
+            concentrations = numpy.floor(concentrations * scale + 1e-9) / scale # The margin stops e.g. 0.3 * 10 truncating to 2
+        # Band of each concentration. Concentrations between one band's high and the next band's low (e.g. 9.05 before
+        # truncation) use the lower band, and concentrations above the top band use the top band
+        bands = numpy.clip(numpy.searchsorted(table[:, 0], concentrations, side='right') - 1, 0, len(table) - 1)
+        c_low, c_high, i_low, i_high = table[bands].T
+        index = (i_high - i_low) / (c_high - c_low) * (concentrations - c_low) + i_low
+        if self.cap is not None:
+            index = numpy.minimum(index, self.cap)
+        if self.round_index:
+            index = numpy.round(index)
+        return index
+
+    def evaluate(self, concentrations):
+        """Evaluates a batch. concentrations is {pollutant: array}, with the same shape for each pollutant (missing
+           pollutants are ignored). Returns the index (the highest pollutant index) and the pollutant that sets it for each
+           sample. Samples without any valid concentrations have a NaN index and an empty pollutant."""
+        pollutants = [pollutant for pollutant in self.pollutants if pollutant in concentrations]
+        indices = numpy.stack([self.pollutant_index(pollutant, concentrations[pollutant]) for pollutant in pollutants])
+        valid = ~numpy.isnan(indices)
+        filled = numpy.where(valid, indices, -numpy.inf)
+        dominant = filled.argmax(axis=0)
+        index = numpy.where(valid.any(axis=0), filled.max(axis=0), numpy.nan)
+        names = numpy.where(valid.any(axis=0), numpy.array(pollutants)[dominant], '')
+        return index, names
+
+    def sample(self, concentrations):
+        """Evaluates one sample ({pollutant: concentration}). Returns [index, pollutant], or None without valid concentrations."""
+        concentrations = {pollutant: concentrations[pollutant] for pollutant in self.pollutants
+                          if concentrations.get(pollutant) is not None}
+        if concentrations == {}:
+            return None
+        index, names = self.evaluate(concentrations)
+        if numpy.isnan(index):
+            return None
+        return [int(index) if self.round_index else float(index), str(names)]
+
+
+us_epa_aqi = StandardIndex('US EPA AQI', us_epa_breakpoints, us_epa_truncation, cap=500)
+eu_caqi = StandardIndex('EU CAQI', eu_caqi_breakpoints)
@@ -5,37 +5,40 @@ import paho.mqtt.client as mqtt
 import colorsys
 import math
 import json
+import copy
 import requests
-import ST7735
 import os
 import time
+import signal
 from datetime import datetime, timedelta
 import numpy
 from fonts.ttf import RobotoMedium as UserFont
 import pytz
 from pytz import timezone
-from astral.geocoder import database, lookup, add_locations
-from astral.sun import sun
-try:
-    from smbus2 import SMBus
-except ImportError:
-    from smbus import SMBus
-
-try:
-    # Transitional fix for breaking change in LTR559
-    from ltr559 import LTR559
-    ltr559 = LTR559()
-except ImportError:
-    import ltr559
-from enviroplus import gas
-from bme280 import BME280
-from pms5003 import PMS5003, ReadTimeoutError, ChecksumMismatchError
+from astral.geocoder import database, add_locations
 from subprocess import check_output
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
-try:
-    from smbus2 import SMBus
-except ImportError:
-    from smbus import SMBus
+from Northcliff_Hardware import create_hardware
+from Northcliff_Runtime import MonitorRuntime
+from Northcliff_Ring_Buffer import DisplayRingBuffer
+from Northcliff_Graph import render_graph
+from Northcliff_Assets import AssetCache
+from Northcliff_Ephemeris import EphemerisCache
+from Northcliff_Render_Cache import RenderCache, DeduplicatingDisplay, print_render_stats
+from Northcliff_Outbox import TelemetryOutbox, send_rejected
+from Northcliff_Snapshot import SnapshotStore
+from Northcliff_MQTT_Dispatch import MQTTDispatcher, MQTTRoute
+from Northcliff_MQTT_Delta import DeltaEncoder, DeltaDecoder
+from Northcliff_Metrics import MetricsRegistry, MetricsServer
+from Northcliff_Profiler import StageProfiler
+from Northcliff_Sampling_Scheduler import SamplingScheduler
+from Northcliff_PM_Reader import PMStreamReader
+from Northcliff_Rolling_Stats import RollingStats
+from Northcliff_AQI import AQIEngine, air_quality_thresholds, air_quality_levels, us_epa_aqi, eu_caqi
+from Northcliff_Time_Series import TimeSeriesStore
+from Northcliff_Environment_Log import EnvironmentLogWriter
+from Northcliff_Calibration import RLSCalibrator, save_calibration_state, load_calibration_state
+from Northcliff_Transport import HttpTransport
 import logging
 
 logging.basicConfig(
@@ -53,27 +56,9 @@ logging.info("""Northcliff_Environment_Monitor.py 4.41 - Combined enviro+ sensor
 
 #""")
 
-bus = SMBus(1)
-
-# Create a BME280 instance
-bme280 = BME280(i2c_dev=bus)
-
-# Create an LCD instance
-disp = ST7735.ST7735(
-    port=0,
-    cs=1,
-    dc=9,
-    backlight=12,
-    rotation=270,
-    spi_speed_hz=10000000
-)
-
-# Initialize display
-disp.begin()
-
 def retrieve_config():
     try:
-        with open('<Your config.json file location>', 'r') as f:
+        with open(os.environ.get('ENVIRO_MONITOR_CONFIG', '<Your config.json file location>'), 'r') as f:
             parsed_config_parameters = json.loads(f.read())
             print('Retrieved Config', parsed_config_parameters)
     except IOError:
@@ -107,12 +92,30 @@ def retrieve_config():
     city_name = parsed_config_parameters['city_name']
     time_zone = parsed_config_parameters['time_zone']
     custom_locations = parsed_config_parameters['custom_locations']
+    hardware_backend = parsed_config_parameters.get('hardware_backend', 'Enviro+') # "Enviro+" or "Simulated"
+    simulation_seed = parsed_config_parameters.get('simulation_seed', 0)
+    simulation_pms5003_frame_interval = parsed_config_parameters.get('simulation_pms5003_frame_interval', 1) # 0 doesn't pace the simulated PMS5003 frames
+    enable_time_series_store = parsed_config_parameters.get('enable_time_series_store', False)
+    enable_compensation_calibration = parsed_config_parameters.get('enable_compensation_calibration', False)
+    enable_mqtt_delta_encoding = parsed_config_parameters.get('enable_mqtt_delta_encoding', False)
+    enable_metrics_exporter = parsed_config_parameters.get('enable_metrics_exporter', False)
+    metrics_exporter_port = parsed_config_parameters.get('metrics_exporter_port', 9110)
+    enable_adaptive_sampling = parsed_config_parameters.get('enable_adaptive_sampling', False)
+    fast_sampling_aqi_level = parsed_config_parameters.get('fast_sampling_aqi_level', 2)
+    sampling_schedule = parsed_config_parameters.get('sampling_schedule', {}) # Per sensor intervals. Defaults are in Northcliff_Sampling_Scheduler.py
+    rolling_stats_windows = parsed_config_parameters.get('rolling_stats_windows', None) # None uses the 1 hour and 24 hour windows in Northcliff_Rolling_Stats.py
+    environment_log_flush_records = parsed_config_parameters.get('environment_log_flush_records', 1) # Climate and gas log records buffered before they're written
+    environment_log_flush_seconds = parsed_config_parameters.get('environment_log_flush_seconds', 300) # Maximum time that a log record is buffered
+    environment_log_fsync = parsed_config_parameters.get('environment_log_fsync', True) # Sync each log write to the SD card
     return (temp_offset, altitude, enable_display, enable_adafruit_io, aio_user_name, aio_key, aio_feed_window, aio_feed_sequence,
             aio_household_prefix, aio_location_prefix, aio_package, enable_send_data_to_homemanager,
             enable_receive_data_from_homemanager, enable_indoor_outdoor_functionality,
             mqtt_broker_name, enable_luftdaten, enable_climate_and_gas_logging, enable_particle_sensor,
             incoming_temp_hum_mqtt_topic, incoming_temp_hum_mqtt_sensor_name, incoming_barometer_mqtt_topic, incoming_barometer_sensor_id,
-            indoor_outdoor_function, mqtt_client_name, outdoor_mqtt_topic, indoor_mqtt_topic, city_name, time_zone, custom_locations)
+            indoor_outdoor_function, mqtt_client_name, outdoor_mqtt_topic, indoor_mqtt_topic, city_name, time_zone, custom_locations,
+            hardware_backend, simulation_seed, simulation_pms5003_frame_interval, enable_time_series_store, enable_compensation_calibration, enable_mqtt_delta_encoding,
+            enable_metrics_exporter, metrics_exporter_port, enable_adaptive_sampling, fast_sampling_aqi_level, sampling_schedule,
+            rolling_stats_windows, environment_log_flush_records, environment_log_flush_seconds, environment_log_fsync)
 
 # Config Setup
 (temp_offset, altitude, enable_display, enable_adafruit_io, aio_user_name, aio_key, aio_feed_window, aio_feed_sequence,
@@ -121,55 +124,102 @@ def retrieve_config():
   enable_luftdaten, enable_climate_and_gas_logging,  enable_particle_sensor, incoming_temp_hum_mqtt_topic,
   incoming_temp_hum_mqtt_sensor_name, incoming_barometer_mqtt_topic, incoming_barometer_sensor_id,
   indoor_outdoor_function, mqtt_client_name, outdoor_mqtt_topic, indoor_mqtt_topic,
-  city_name, time_zone, custom_locations) = retrieve_config()
+  city_name, time_zone, custom_locations, hardware_backend, simulation_seed, simulation_pms5003_frame_interval, enable_time_series_store,
+  enable_compensation_calibration, enable_mqtt_delta_encoding, enable_metrics_exporter, metrics_exporter_port,
+  enable_adaptive_sampling, fast_sampling_aqi_level, sampling_schedule, rolling_stats_windows, environment_log_flush_records,
+  environment_log_flush_seconds, environment_log_fsync) = retrieve_config()
+
+# Readings and internal health for the optional Prometheus metrics exporter
+metrics = MetricsRegistry()
+metrics.describe('enviro_reading', 'gauge', 'Current reading')
+metrics.describe('enviro_air_quality_level', 'gauge', 'Air quality level (0 Great to 4 Bad) and the factor that sets it')
+metrics.describe('enviro_gas_sensors_warm', 'gauge', '1 when the gas sensors have warmed up and been calibrated')
+metrics.describe('enviro_gas_r0_ohms', 'gauge', 'Gas sensor clean air resistance (R0)')
+metrics.describe('enviro_gas_calibration_baseline', 'gauge', 'Temperature, humidity and air pressure at the gas sensor calibration')
+metrics.describe('enviro_comms_failure', 'gauge', '1 when Luftdaten and Adafruit IO communications have been lost')
+metrics.describe('enviro_uptime_seconds', 'gauge', 'Time since the monitor started')
+metrics.describe('enviro_uploads_total', 'counter', 'Upload attempts by service and result')
+metrics.describe('enviro_upload_seconds', 'histogram', 'Time taken by each upload function')
+metrics.describe('enviro_display_push_seconds', 'histogram', 'Time taken to push a frame to the display')
+metrics.describe('enviro_task_duration_seconds', 'histogram', 'Time taken by each runtime task')
+metrics.describe('enviro_sampling_interval_seconds', 'gauge', 'Current sampling interval of each sensor')
+metrics.describe('enviro_reading_window', 'gauge', 'Min, max, mean and standard deviation of each reading over the rolling windows')
+metrics.describe('enviro_standard_aqi', 'gauge', 'US EPA AQI and EU CAQI from the rolling mean particle readings')
+# Timing spans around the hot-path stages. A summary is printed every 5 minutes and on kill -USR1 <pid>
+profiler = StageProfiler()
+
+def display_pushed(duration):
+    metrics.observe('enviro_display_push_seconds', duration)
+    profiler.record('Display SPI Push', duration)
+
+def task_completed(name, duration):
+    metrics.observe('enviro_task_duration_seconds', duration, {'task': name})
+    profiler.record('Task ' + name, duration)
+
+# Set up the sensors and display for the selected hardware backend
+hardware = create_hardware(hardware_backend, enable_particle_sensor, simulation_seed, pms5003_frame_interval=simulation_pms5003_frame_interval)
+bme280 = hardware.bme280
+ltr559 = hardware.ltr559
+gas = hardware.gas
+pms5003 = hardware.pms5003
+pm_reader = None
+pm_frame_count = 0 # Frame count of the last particle sample used
+pm_reader_failures = 0
+if enable_particle_sensor: # PMS5003 frames are read continuously on their own thread, once the monitor has started
+    pm_reader = PMStreamReader(pms5003, hardware.pms5003_errors)
+disp = DeduplicatingDisplay(hardware.disp, display_pushed) # Frames that are identical to the last frame aren't pushed to the display
+render_cache = RenderCache()
 
 # Add to city database
 db = database()
 add_locations(custom_locations, db)
+ephemeris = EphemerisCache(db)
 
-if enable_particle_sensor:
-    # Create a PMS5003 instance
-    pms5003 = PMS5003()
-    time.sleep(1)
-            
 def read_pm_values(luft_values, mqtt_values, own_data, own_disp_values):
+    # Uses the particle sensor reader thread's latest sample, so particle reads never wait for the sensor.
+    # Returns True if there's been a new frame since the last read
+    global pm_frame_count, pm_reader_failures
     if enable_particle_sensor:
-        try:
-            pm_values = pms5003.read()
-            #print('PM Values:', pm_values)
-            own_data["P2.5"][1] = pm_values.pm_ug_per_m3(2.5)
-            mqtt_values["P2.5"] = own_data["P2.5"][1]
-            own_disp_values["P2.5"] = own_disp_values["P2.5"][1:] + [[own_data["P2.5"][1], 1]]
-            luft_values["P2"] = str(mqtt_values["P2.5"])
-            own_data["P10"][1] = pm_values.pm_ug_per_m3(10)
-            mqtt_values["P10"] = own_data["P10"][1]
-            own_disp_values["P10"] = own_disp_values["P10"][1:] + [[own_data["P10"][1], 1]]
-            luft_values["P1"] = str(own_data["P10"][1])
-            own_data["P1"][1] = pm_values.pm_ug_per_m3(1.0)
-            mqtt_values["P1"] = own_data["P1"][1]
-            own_disp_values["P1"] = own_disp_values["P1"][1:] + [[own_data["P1"][1], 1]]
-        except (ReadTimeoutError, ChecksumMismatchError):
-            logging.info("Failed to read PMS5003")
-            display_error('Particle Sensor Error')
-            pms5003.reset()
-            pm_values = pms5003.read()
-            own_data["P2.5"][1] = pm_values.pm_ug_per_m3(2.5)
-            mqtt_values["P2.5"] = own_data["P2.5"][1]
-            own_disp_values["P2.5"] = own_disp_values["P2.5"][1:] + [[own_data["P2.5"][1], 1]]
-            luft_values["P2"] = str(mqtt_values["P2.5"])
-            own_data["P10"][1] = pm_values.pm_ug_per_m3(10)
-            mqtt_values["P10"] = own_data["P10"][1]
-            own_disp_values["P10"] = own_disp_values["P10"][1:] + [[own_data["P10"][1], 1]]
-            luft_values["P1"] = str(own_data["P10"][1])
-            own_data["P1"][1] = pm_values.pm_ug_per_m3(1.0)
-            mqtt_values["P1"] = own_data["P1"][1]
-            own_disp_values["P1"] = own_disp_values["P1"][1:] + [[own_data["P1"][1], 1]]
-    return(luft_values, mqtt_values, own_data, own_disp_values)
+        if pm_reader.failures != pm_reader_failures: # The reader resets the sensor and retries on its own
+            pm_reader_failures = pm_reader.failures
+            runtime.submit('Particle Sensor Error', lambda: display_error('Particle Sensor Error'), 'display')
+        pm_values = pm_reader.latest
+        if pm_values is None or pm_values.frame_count == pm_frame_count:
+            return False
+        pm_frame_count = pm_values.frame_count
+        own_data["P2.5"][1] = pm_values.pm_ug_per_m3(2.5)
+        mqtt_values["P2.5"] = own_data["P2.5"][1]
+        own_disp_values["P2.5"].append(own_data["P2.5"][1])
+        luft_values["P2"] = str(mqtt_values["P2.5"])
+        own_data["P10"][1] = pm_values.pm_ug_per_m3(10)
+        mqtt_values["P10"] = own_data["P10"][1]
+        own_disp_values["P10"].append(own_data["P10"][1])
+        luft_values["P1"] = str(own_data["P10"][1])
+        own_data["P1"][1] = pm_values.pm_ug_per_m3(1.0)
+        mqtt_values["P1"] = own_data["P1"][1]
+        own_disp_values["P1"].append(own_data["P1"][1])
+        return True
+    return False
 
 # Read gas and climate values from Home Manager and /or BME280 
-def read_climate_gas_values(luft_values, mqtt_values, own_data, maxi_temp, mini_temp, own_disp_values, gas_sensors_warm, gas_calib_temp, gas_calib_hum, gas_calib_bar, altitude):
-    raw_temp, comp_temp = adjusted_temperature()
-    raw_hum, comp_hum = adjusted_humidity()
+def read_climate_gas_sensors():
+    # Only reads the climate, gas and light sensors, so that it can run on the sensors thread while the readings are applied
+    # to the shared values by read_climate_gas_values on the event loop
+    with profiler.span('BME280 Read'):
+        raw_temp = bme280.get_temperature()
+        raw_hum = bme280.get_humidity()
+        raw_barometer = bme280.get_pressure()
+    with profiler.span('Gas Read'):
+        gas_data = gas.read_all()
+    with profiler.span('LTR559 Read'):
+        proximity = ltr559.get_proximity()
+        lux = ltr559.get_lux() if proximity < 500 else None
+    return raw_temp, raw_hum, raw_barometer, gas_data, proximity, lux
+
+def read_climate_gas_values(luft_values, mqtt_values, own_data, own_disp_values, gas_sensors_warm, gas_calib_temp, gas_calib_hum, gas_calib_bar, altitude, sensor_readings):
+    raw_temp, raw_hum, raw_barometer, gas_data, proximity, lux = sensor_readings
+    raw_temp, comp_temp = adjusted_temperature(raw_temp)
+    raw_hum, comp_hum = adjusted_humidity(raw_hum)
     current_time = time.time()
     use_external_temp_hum = False
     use_external_barometer = False
@@ -187,80 +237,75 @@ def read_climate_gas_values(luft_values, mqtt_values, own_data, maxi_temp, mini_
         own_data["Temp"][1] = float(luft_values["temperature"])
         luft_values["humidity"] = es.humidity
         own_data["Hum"][1] = float(luft_values["humidity"])
-    own_disp_values["Temp"] = own_disp_values["Temp"][1:] + [[own_data["Temp"][1], 1]]
+        if enable_compensation_calibration:
+            calibrate_compensation(raw_temp, raw_hum)
+    own_disp_values["Temp"].append(own_data["Temp"][1])
     mqtt_values["Temp"] = own_data["Temp"][1]
-    own_disp_values["Hum"] = own_disp_values["Hum"][1:] + [[own_data["Hum"][1], 1]]
+    own_disp_values["Hum"].append(own_data["Hum"][1])
     mqtt_values["Hum"][0] = own_data["Hum"][1]
     mqtt_values["Hum"][1] = domoticz_hum_map[describe_humidity(own_data["Hum"][1])]
-    # Determine max and min temps
-    if first_climate_reading_done :
-        if maxi_temp is None:
-            maxi_temp = own_data["Temp"][1]
-        elif own_data["Temp"][1] > maxi_temp:
-            maxi_temp = own_data["Temp"][1]
-        else:
-            pass
-        if mini_temp is None:
-            mini_temp = own_data["Temp"][1]
-        elif own_data["Temp"][1] < mini_temp:
-            mini_temp = own_data["Temp"][1]
-        else:
-            pass
-    mqtt_values["Min Temp"] = mini_temp
-    mqtt_values["Max Temp"] = maxi_temp
-    raw_barometer = bme280.get_pressure()
     if use_external_barometer == False:
         print("Internal Barometer")
         own_data["Bar"][1] = round(raw_barometer * barometer_altitude_comp_factor(altitude, own_data["Temp"][1]), 1)
-        own_disp_values["Bar"] = own_disp_values["Bar"][1:] + [[own_data["Bar"][1], 1]]
+        own_disp_values["Bar"].append(own_data["Bar"][1])
         mqtt_values["Bar"][0] = own_data["Bar"][1]
         luft_values["pressure"] = "{:.2f}".format(raw_barometer * 100) # Send raw air pressure to Lufdaten, since it does its own altitude air pressure compensation
         print("Raw Bar:", round(raw_barometer, 1), "Comp Bar:", own_data["Bar"][1])
     else:
         print("External Barometer")
         own_data["Bar"][1] = round(float(es.barometer), 1)
-        own_disp_values["Bar"] = own_disp_values["Bar"][1:] + [[own_data["Bar"][1], 1]]
+        own_disp_values["Bar"].append(own_data["Bar"][1])
         mqtt_values["Bar"][0] = own_data["Bar"][1]
         # Remove altitude compensation from external barometer because Lufdaten does its own altitude air pressure compensation
         luft_values["pressure"] = "{:.2f}".format(float(es.barometer) / barometer_altitude_comp_factor(altitude, own_data["Temp"][1]) * 100)
         print("Luft Bar:", luft_values["pressure"], "Comp Bar:", own_data["Bar"][1])
-    red_in_ppm, oxi_in_ppm, nh3_in_ppm, comp_red_rs, comp_oxi_rs, comp_nh3_rs, raw_red_rs, raw_oxi_rs, raw_nh3_rs = read_gas_in_ppm(gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_hum, raw_barometer, gas_sensors_warm)
+    red_in_ppm, oxi_in_ppm, nh3_in_ppm, comp_red_rs, comp_oxi_rs, comp_nh3_rs, raw_red_rs, raw_oxi_rs, raw_nh3_rs = read_gas_in_ppm(gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_hum, raw_barometer, gas_sensors_warm, gas_data)
     own_data["Red"][1] = round(red_in_ppm, 2)
-    own_disp_values["Red"] = own_disp_values["Red"][1:] + [[own_data["Red"][1], 1]]
+    own_disp_values["Red"].append(own_data["Red"][1])
     mqtt_values["Red"] = own_data["Red"][1]
     own_data["Oxi"][1] = round(oxi_in_ppm, 2)
-    own_disp_values["Oxi"] = own_disp_values["Oxi"][1:] + [[own_data["Oxi"][1], 1]]
+    own_disp_values["Oxi"].append(own_data["Oxi"][1])
     mqtt_values["Oxi"] = own_data["Oxi"][1]
     own_data["NH3"][1] = round(nh3_in_ppm, 2)
-    own_disp_values["NH3"] = own_disp_values["NH3"][1:] + [[own_data["NH3"][1], 1]]
+    own_disp_values["NH3"].append(own_data["NH3"][1])
     mqtt_values["NH3"] = own_data["NH3"][1]
     mqtt_values["Gas Calibrated"] = gas_sensors_warm
-    proximity = ltr559.get_proximity()
     if proximity < 500:
-        own_data["Lux"][1] = round(ltr559.get_lux(), 1)
+        own_data["Lux"][1] = round(lux, 1)
     else:
         own_data["Lux"][1] = 1
-    own_disp_values["Lux"] = own_disp_values["Lux"][1:] + [[own_data["Lux"][1], 1]]
+    own_disp_values["Lux"].append(own_data["Lux"][1])
     mqtt_values["Lux"] = own_data["Lux"][1]
-    return luft_values, mqtt_values, own_data, maxi_temp, mini_temp, own_disp_values, raw_red_rs, raw_oxi_rs, raw_nh3_rs, raw_temp, comp_temp, comp_hum, raw_hum, use_external_temp_hum, use_external_barometer, raw_barometer
+    return luft_values, mqtt_values, own_data, own_disp_values, raw_red_rs, raw_oxi_rs, raw_nh3_rs, raw_temp, comp_temp, comp_hum, raw_hum, use_external_temp_hum, use_external_barometer, raw_barometer
     
+def calibrate_compensation(raw_temp, raw_hum):
+    # Each external temp/hum reading is used once as a reference for the online calibration of the temp and hum compensation
+    global calibration_reference_time
+    if es.temp_humidity_update_time != calibration_reference_time:
+        calibration_reference_time = es.temp_humidity_update_time
+        temp_accepted = compensation_calibrators["Temp"].update(raw_temp, float(es.temperature))
+        hum_accepted = compensation_calibrators["Hum"].update(raw_hum, float(es.humidity))
+        print('Compensation Calibration Temp Sample', 'Accepted' if temp_accepted else 'Rejected', 'Hum Sample', 'Accepted' if hum_accepted else 'Rejected')
+
 def barometer_altitude_comp_factor(alt, temp):
     comp_factor = math.pow(1 - (0.0065 * altitude/(temp + 0.0065 * alt + 273.15)), -5.257)
     return comp_factor
     
-def read_raw_gas():
-    gas_data = gas.read_all()
+def read_raw_gas(gas_data=None): # Reads the gas sensors if gas_data hasn't already been read
+    if gas_data is None:
+        with profiler.span('Gas Read'):
+            gas_data = gas.read_all()
     raw_red_rs = round(gas_data.reducing, 0)
     raw_oxi_rs = round(gas_data.oxidising, 0)
     raw_nh3_rs = round(gas_data.nh3, 0)
     return raw_red_rs, raw_oxi_rs, raw_nh3_rs
     
-def read_gas_in_ppm(gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_hum, raw_barometer, gas_sensors_warm):
+def read_gas_in_ppm(gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_hum, raw_barometer, gas_sensors_warm, gas_data=None):
     if gas_sensors_warm:
-        comp_red_rs, comp_oxi_rs, comp_nh3_rs, raw_red_rs, raw_oxi_rs, raw_nh3_rs = comp_gas(gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_hum, raw_barometer)
+        comp_red_rs, comp_oxi_rs, comp_nh3_rs, raw_red_rs, raw_oxi_rs, raw_nh3_rs = comp_gas(gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_hum, raw_barometer, gas_data)
         print("Reading Compensated Gas sensors after warmup completed")
     else:
-        raw_red_rs, raw_oxi_rs, raw_nh3_rs = read_raw_gas()
+        raw_red_rs, raw_oxi_rs, raw_nh3_rs = read_raw_gas(gas_data)
         comp_red_rs = raw_red_rs
         comp_oxi_rs = raw_oxi_rs
         comp_nh3_rs = raw_nh3_rs
@@ -283,8 +328,10 @@ def read_gas_in_ppm(gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_
     nh3_in_ppm = math.pow(10, -1.8 * math.log10(nh3_ratio) - 0.163)
     return red_in_ppm, oxi_in_ppm, nh3_in_ppm, comp_red_rs, comp_oxi_rs, comp_nh3_rs, raw_red_rs, raw_oxi_rs, raw_nh3_rs
 
-def comp_gas(gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_hum, raw_barometer):
-    gas_data = gas.read_all()
+def comp_gas(gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_hum, raw_barometer, gas_data=None):
+    if gas_data is None:
+        with profiler.span('Gas Read'):
+            gas_data = gas.read_all()
     gas_temp_diff = raw_temp - gas_calib_temp
     gas_hum_diff = raw_hum - gas_calib_hum
     gas_bar_diff = raw_barometer - gas_calib_bar
@@ -298,16 +345,26 @@ def comp_gas(gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_hum, ra
           "Raw NH3 Rs:", raw_nh3_rs, "Comp NH3 Rs:", comp_nh3_rs)
     return comp_red_rs, comp_oxi_rs, comp_nh3_rs, raw_red_rs, raw_oxi_rs, raw_nh3_rs   
     
-def adjusted_temperature():
-    raw_temp = bme280.get_temperature()
+def adjusted_temperature(raw_temp=None): # Reads the BME280 if raw_temp hasn't already been read
+    if raw_temp is None:
+        with profiler.span('BME280 Read'):
+            raw_temp = bme280.get_temperature()
     #comp_temp = comp_temp_slope * raw_temp + comp_temp_intercept
-    comp_temp = comp_temp_cub_a * math.pow(raw_temp, 3) + comp_temp_cub_b * math.pow(raw_temp, 2) + comp_temp_cub_c * raw_temp + comp_temp_cub_d
+    if enable_compensation_calibration:
+        comp_temp = compensation_calibrators["Temp"].compensate(raw_temp)
+    else:
+        comp_temp = comp_temp_cub_a * math.pow(raw_temp, 3) + comp_temp_cub_b * math.pow(raw_temp, 2) + comp_temp_cub_c * raw_temp + comp_temp_cub_d
     return raw_temp, comp_temp
 
-def adjusted_humidity():
-    raw_hum = bme280.get_humidity()
+def adjusted_humidity(raw_hum=None): # Reads the BME280 if raw_hum hasn't already been read
+    if raw_hum is None:
+        with profiler.span('BME280 Read'):
+            raw_hum = bme280.get_humidity()
     #comp_hum = comp_hum_slope * raw_hum + comp_hum_intercept
-    comp_hum = comp_hum_quad_a * math.pow(raw_hum, 2) + comp_hum_quad_b * raw_hum + comp_hum_quad_c
+    if enable_compensation_calibration:
+        comp_hum = compensation_calibrators["Hum"].compensate(raw_hum)
+    else:
+        comp_hum = comp_hum_quad_a * math.pow(raw_hum, 2) + comp_hum_quad_b * raw_hum + comp_hum_quad_c
     return raw_hum, min(100, comp_hum)
     
 def log_climate_and_gas(run_time, own_data, raw_red_rs, raw_oxi_rs, raw_nh3_rs, raw_temp, comp_temp, comp_hum, raw_hum, use_external_temp_hum, use_external_barometer, raw_barometer): # Used to log climate and gas data to create compensation algorithms
@@ -319,53 +376,39 @@ def log_climate_and_gas(run_time, own_data, raw_red_rs, raw_oxi_rs, raw_nh3_rs,
     raw_red_rs = round(raw_red_rs, 0)
     raw_oxi_rs = round(raw_oxi_rs, 0)
     raw_nh3_rs = round(raw_nh3_rs, 0)
-    if use_external_temp_hum and use_external_barometer:
-        environment_log_data = {'Run Time': run_time, 'Raw Temperature': raw_temp, 'Output Temp': comp_temp,
-                             'Real Temperature': own_data["Temp"][1], 'Raw Humidity': raw_hum,
-                             'Output Humidity': comp_hum, 'Real Humidity': own_data["Hum"][1], 'Real Bar': own_data["Bar"][1], 'Raw Bar': raw_barometer,
-                             'Oxi': own_data["Oxi"][1], 'Red': own_data["Red"][1], 'NH3': own_data["NH3"][1], 'Raw OxiRS': raw_oxi_rs, 'Raw RedRS': raw_red_rs, 'Raw NH3RS': raw_nh3_rs}
-    elif use_external_temp_hum and not(use_external_barometer):
-        environment_log_data = {'Run Time': run_time, 'Raw Temperature': raw_temp, 'Output Temp': comp_temp,
-                             'Real Temperature': own_data["Temp"][1], 'Raw Humidity': raw_hum,
-                             'Output Humidity': comp_hum, 'Real Humidity': own_data["Hum"][1], 'Output Bar': own_data["Bar"][1], 'Raw Bar': raw_barometer,
-                             'Oxi': own_data["Oxi"][1], 'Red': own_data["Red"][1], 'NH3': own_data["NH3"][1], 'Raw OxiRS': raw_oxi_rs, 'Raw RedRS': raw_red_rs, 'Raw NH3RS': raw_nh3_rs}     
-    elif not(use_external_temp_hum) and use_external_barometer:
-        environment_log_data = {'Run Time': run_time, 'Raw Temperature': raw_temp, 'Output Temp': comp_temp,
-                             'Raw Humidity': raw_hum, 'Output Humidity': comp_hum, 'Real Bar': own_data["Bar"][1], 'Raw Bar': raw_barometer,
-                             'Oxi': own_data["Oxi"][1], 'Red': own_data["Red"][1], 'NH3': own_data["NH3"][1], 'Raw OxiRS': raw_oxi_rs, 'Raw RedRS': raw_red_rs, 'Raw NH3RS': raw_nh3_rs}
-    else:
-        environment_log_data = {'Run Time': run_time, 'Raw Temperature': raw_temp, 'Output Temp': comp_temp,
-                             'Raw Humidity': raw_hum, 'Output Humidity': comp_hum, 'Output Bar': own_data["Bar"][1], 'Raw Bar': raw_barometer,
-                             'Oxi': own_data["Oxi"][1], 'Red': own_data["Red"][1], 'NH3': own_data["NH3"][1], 'Raw OxiRS': raw_oxi_rs, 'Raw RedRS': raw_red_rs, 'Raw NH3RS': raw_nh3_rs}
+    # The log has a fixed set of columns. Real readings are only logged when they come from external sensors
+    environment_log_data = {'Run Time': run_time, 'Raw Temperature': raw_temp, 'Output Temp': comp_temp,
+                            'Real Temperature': own_data["Temp"][1] if use_external_temp_hum else None, 'Raw Humidity': raw_hum,
+                            'Output Humidity': comp_hum, 'Real Humidity': own_data["Hum"][1] if use_external_temp_hum else None,
+                            'Real Bar': own_data["Bar"][1] if use_external_barometer else None,
+                            'Output Bar': None if use_external_barometer else own_data["Bar"][1], 'Raw Bar': raw_barometer,
+                            'Oxi': own_data["Oxi"][1], 'Red': own_data["Red"][1], 'NH3': own_data["NH3"][1], 'Raw OxiRS': raw_oxi_rs, 'Raw RedRS': raw_red_rs, 'Raw NH3RS': raw_nh3_rs}
     print('Logging Environment Data.', environment_log_data)
-    with open('<Your environment log file location>', 'a') as f:
-        f.write(',\n' + json.dumps(environment_log_data))
+    environment_log.write(environment_log_data)
 
 # Calculate AQI Level
+aqi_engines = [] # The AQI engine of each data dict (own_data and outdoor_data)
+
+def aqi_engine(data):
+    for engine in aqi_engines:
+        if engine.data is data:
+            return engine
+    engine = AQIEngine(data)
+    aqi_engines.append(engine)
+    return engine
+
 def max_aqi_level_factor(gas_sensors_warm, air_quality_data, air_quality_data_no_gas, data):
-    max_aqi_level = 0
-    max_aqi_factor = 'All'
-    max_aqi = [max_aqi_factor, max_aqi_level]
+    # Each data dict's thresholds are compiled once and the result is memoised for each sample, because the display,
+    # Adafruit IO, metrics and sampling scheduler all ask for the same sample's level
+    engine = aqi_engine(data)
     if gas_sensors_warm:
-        aqi_data = air_quality_data
+        return engine.max_level_factor(air_quality_data)
     else:
-        aqi_data = air_quality_data_no_gas
-    for aqi_factor in aqi_data:
-        aqi_factor_level = 0
-        thresholds = data[aqi_factor][2]
-        for level in range(len(thresholds)):
-            if data[aqi_factor][1] > thresholds[level]:
-                aqi_factor_level = level + 1
-        if aqi_factor_level > max_aqi[1]:
-            max_aqi = [aqi_factor, aqi_factor_level]
-    return max_aqi
+        return engine.max_level_factor(air_quality_data_no_gas)
         
 # Get Raspberry Pi serial number to use as ID
 def get_serial_number():
-    with open('/proc/cpuinfo', 'r') as f:
-        for line in f:
-            if line[0:6] == 'Serial':
-                return line.split(":")[1].strip()
+    return hardware.get_serial_number()
 
 # Check for Wi-Fi connection
 def check_wifi():
@@ -374,6 +417,21 @@ def check_wifi():
     else:
         return False
 
+def check_display_wifi():
+    # Limits the Status display's Wi-Fi checks, so that it isn't re-rendered (and hostname isn't run) on every display update
+    global display_wifi_connected, display_wifi_check_time
+    if time.time() - display_wifi_check_time >= display_wifi_check_interval:
+        display_wifi_connected = check_wifi()
+        display_wifi_check_time = time.time()
+    return display_wifi_connected
+
+# Text size helpers. Metrics are memoised by the asset cache, which also handles Pillow 10's removal of textsize and getsize
+def get_text_size(draw, text, font):
+    return asset_cache.text_size(text, font)
+
+def get_font_size(font, text):
+    return asset_cache.font_size(font, text)
+
 # Display Error Message on LCD
 def display_error(message):
     text_colour = (255, 255, 255)
@@ -381,12 +439,13 @@ def display_error(message):
     error_message = "System Error\n{}".format(message)
     img = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
     draw = ImageDraw.Draw(img)
-    size_x, size_y = draw.textsize(message, mediumfont)
+    size_x, size_y = get_text_size(draw, message, mediumfont)
     x = (WIDTH - size_x) / 2
     y = (HEIGHT / 2) - (size_y / 2)
     draw.rectangle((0, 0, 160, 80), back_colour)
     draw.text((x, y), error_message, font=mediumfont, fill=text_colour)
     disp.display(img)
+    render_cache.invalidate() # Re-render the current display mode on the next display update
 
 # Display the Raspberry Pi serial number on a background colour based on the air quality level
 def disabled_display(gas_sensors_warm, air_quality_data, air_quality_data_no_gas, data, palette):
@@ -397,7 +456,7 @@ def disabled_display(gas_sensors_warm, air_quality_data, air_quality_data_no_gas
     message = "{}".format(id)
     img = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
     draw = ImageDraw.Draw(img)
-    size_x, size_y = draw.textsize(message, mediumfont)
+    size_x, size_y = get_text_size(draw, message, mediumfont)
     x = (WIDTH - size_x) / 2
     y = (HEIGHT / 2) - (size_y / 2)
     draw.rectangle((0, 0, 160, 80), back_colour)
@@ -405,28 +464,31 @@ def disabled_display(gas_sensors_warm, air_quality_data, air_quality_data_no_gas
     disp.display(img)
     
 # Display Raspberry Pi serial and Wi-Fi status on LCD
-def display_status():
-    wifi_status = "connected" if check_wifi() else "disconnected"
+def display_status(wifi_connected):
+    wifi_status = "connected" if wifi_connected else "disconnected"
     text_colour = (255, 255, 255)
-    back_colour = (0, 170, 170) if check_wifi() else (85, 15, 15)
+    back_colour = (0, 170, 170) if wifi_connected else (85, 15, 15)
     id = get_serial_number()
     message = "Northcliff\nEnvironment Monitor\n{}\nWi-Fi: {}".format(id, wifi_status)
     img = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
     draw = ImageDraw.Draw(img)
-    size_x, size_y = draw.textsize(message, mediumfont)
+    size_x, size_y = get_text_size(draw, message, mediumfont)
     x = (WIDTH - size_x) / 2
     y = (HEIGHT / 2) - (size_y / 2)
     draw.rectangle((0, 0, 160, 80), back_colour)
     draw.text((x, y), message, font=mediumfont, fill=text_colour)
     disp.display(img)
     
-def send_data_to_aio(feed_key, data):
-    aio_json = {"value": data}
+def send_data_to_aio(feed_values, created_at=None): # Sends a batch of [feed_key, value] pairs to Adafruit IO in one request
+    # Returns True when the batch is accepted, False when it should be retried and send_rejected when Adafruit IO will never accept it
+    aio_json = {"feeds": [{"key": feed_key, "value": value} for feed_key, value in feed_values]}
+    if created_at is not None: # Keeps the capture time when sending a backlog from the outbox
+        aio_json["created_at"] = datetime.fromtimestamp(created_at, tz=pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
     resp_error = False
     reason = ''
     response = ''
     try:
-        response = requests.post(aio_url + '/feeds/' + feed_key + '/data',
+        response = http_transport.post(aio_url + '/groups/' + aio_group_key + '/data',
                                  headers={'X-AIO-Key': aio_key,
                                           'Content-Type': 'application/json'},
                                  data=json.dumps(aio_json), timeout=5)
@@ -452,10 +514,14 @@ def send_data_to_aio(feed_key, data):
             resp_error = True
             reason = 'Throttling Error'
             print('aio Throttling Error')
-        elif status_code >= 400:
+        elif status_code == 408 or status_code >= 500:
             resp_error = True
             reason = 'Response Error: ' + str(response.status_code)
             print('aio ', reason)
+        elif status_code >= 400: # e.g. an invalid value, a created_at that's too old or a missing feed
+            reason = 'Rejected: ' + str(response.status_code)
+            print('aio ', reason)
+            return send_rejected
     return not resp_error
 
 def send_to_luftdaten(luft_values, id, enable_particle_sensor):
@@ -468,7 +534,7 @@ def send_to_luftdaten(luft_values, id, enable_particle_sensor):
 
     if enable_particle_sensor:
         try:
-            resp_1 = requests.post("https://api.luftdaten.info/v1/push-sensor-data/",
+            resp_1 = http_transport.post("https://api.luftdaten.info/v1/push-sensor-data/",
                      json={
                          "software_version": "enviro-plus 0.0.1",
                          "sensordatavalues": [{"value_type": key, "value": val} for
@@ -493,7 +559,7 @@ def send_to_luftdaten(luft_values, id, enable_particle_sensor):
             print('Luftdaten PM Request Error', e)
 
     try:
-        resp_2 = requests.post("https://api.luftdaten.info/v1/push-sensor-data/",
+        resp_2 = http_transport.post("https://api.luftdaten.info/v1/push-sensor-data/",
                  json={
                      "software_version": "enviro-plus 0.0.1",
                      "sensordatavalues": [{"value_type": key, "value": val} for
@@ -527,22 +593,28 @@ def send_to_luftdaten(luft_values, id, enable_particle_sensor):
     
 def on_connect(client, userdata, flags, rc):
     es.print_update('Northcliff Environment Monitor Connected with result code ' + str(rc))
+    for topic in mqtt_dispatcher.topics(): # Subscribe to the topics for the external temp/hum and barometer data and the outdoor unit's data
+        client.subscribe(topic)
+
+def build_mqtt_dispatcher():
+    # Incoming messages are routed by topic and filtered by sensor before their handlers run on the event loop.
+    # Only the latest external sensor reading matters, but every outdoor reading is kept because it's added to the display history
+    dispatcher = MQTTDispatcher(mqtt_queue_size)
     if enable_receive_data_from_homemanager:
-        client.subscribe(incoming_temp_hum_mqtt_topic) # Subscribe to the topic for the external temp/hum data
-        client.subscribe(incoming_barometer_mqtt_topic) # Subscribe to the topic for the external barometer data
+        dispatcher.add_route(incoming_temp_hum_mqtt_topic, MQTTRoute('External Temp Hum', es.capture_temp_humidity, 'name',
+                                                                     incoming_temp_hum_mqtt_sensor_name)) # Identify external temp/hum sensor
+        dispatcher.add_route(incoming_barometer_mqtt_topic, MQTTRoute('External Barometer', lambda parsed_json: es.capture_barometer(parsed_json['svalue']),
+                                                                      'idx', incoming_barometer_sensor_id)) # Identify external barometer
     if enable_indoor_outdoor_functionality and indoor_outdoor_function == 'Indoor':
-        client.subscribe(outdoor_mqtt_topic)
-
-def on_message(client, userdata, msg):
-    decoded_payload = str(msg.payload.decode("utf-8"))
-    parsed_json = json.loads(decoded_payload)
-    if msg.topic == incoming_temp_hum_mqtt_topic and parsed_json['name'] == incoming_temp_hum_mqtt_sensor_name: # Identify external temp/hum sensor
-        es.capture_temp_humidity(parsed_json)
-    if msg.topic == incoming_barometer_mqtt_topic and parsed_json['idx'] == incoming_barometer_sensor_id: # Identify external barometer
-        es.capture_barometer(parsed_json['svalue'])
-    if enable_indoor_outdoor_functionality and indoor_outdoor_function == 'Indoor' and msg.topic == outdoor_mqtt_topic:
-        capture_outdoor_data(parsed_json)
+        dispatcher.add_route(outdoor_mqtt_topic, MQTTRoute('Outdoor Data', capture_delta_outdoor_data, policy='drop_oldest'))
+    return dispatcher
             
+def capture_delta_outdoor_data(parsed_json):
+    # Outdoor units can send keyframes and deltas. Deltas are discarded after a lost payload until the next keyframe
+    outdoor_values = outdoor_delta_decoder.decode(parsed_json)
+    if outdoor_values is not None:
+        capture_outdoor_data(outdoor_values)
+
 def capture_outdoor_data(parsed_json):
     global outdoor_reading_captured
     global outdoor_reading_captured_time
@@ -556,7 +628,7 @@ def capture_outdoor_data(parsed_json):
             outdoor_data[reading][1] = parsed_json[reading][0]
         else:
             outdoor_data[reading][1] = parsed_json[reading]
-        outdoor_disp_values[reading] = outdoor_disp_values[reading][1:] + [[outdoor_data[reading][1], 1]]
+        outdoor_disp_values[reading].append(outdoor_data[reading][1])
     outdoor_maxi_temp = parsed_json["Max Temp"]
     outdoor_mini_temp = parsed_json["Min Temp"]
     outdoor_gas_sensors_warm = parsed_json["Gas Calibrated"]
@@ -565,10 +637,6 @@ def capture_outdoor_data(parsed_json):
     
 # Displays graphed data and text on the 0.96" LCD
 def display_graphed_data(location, disp_values, variable, data, WIDTH):
-    # Scale the received disp_values for the variable between 0 and 1
-    received_disp_values = [disp_values[variable][v][0]*disp_values[variable][v][1] for v in range(len(disp_values[variable]))]
-    graph_range = [(v - min(received_disp_values)) / (max(received_disp_values) - min(received_disp_values)) if ((max(received_disp_values) - min(received_disp_values)) != 0)
-                   else 0 for v in received_disp_values]           
     # Format the variable name and value
     if variable == "Oxi":
         message = "{} {}: {:.2f} {}".format(location, variable[:4], data[1], data[0])
@@ -579,25 +647,13 @@ def display_graphed_data(location, disp_values, variable, data, WIDTH):
     else:
         message = "{} {}: {:.1f} {}".format(location, variable[:4], data[1], data[0])
     #logging.info(message)
-    draw.rectangle((0, 0, WIDTH, HEIGHT), (255, 255, 255))
-    # Determine the backgound colour for received data, based on level thresholds. Black for data not received.
-    for i in range(len(disp_values[variable])):
-        if disp_values[variable][i][1] == 1:
-            lim = data[2]
-            rgb = palette[0]
-            for j in range(len(lim)):
-                if disp_values[variable][i][0] > lim[j]:
-                    rgb = palette[j+1]
-        else:
-            rgb = (0,0,0)
-        # Draw a 2-pixel wide rectangle of colour based on reading levels relative to level thresholds
-        draw.rectangle((i*2, top_pos, i*2+2, HEIGHT), rgb)
-        # Draw a 2 pixel by 2 pixel line graph in black based on the reading levels
-        line_y = (HEIGHT-2) - ((top_pos + 1) + (graph_range[i] * ((HEIGHT-2) - (top_pos + 1)))) + (top_pos + 1)
-        draw.rectangle((i*2, line_y, i*2+2, line_y+2), (0, 0, 0))
+    # Draw the colour bands (based on the readings relative to level thresholds) and the line graph as one pixel array
+    graph_img = Image.fromarray(render_graph(disp_values[variable].values(), disp_values[variable].valid(), data[2], palette,
+                                             WIDTH, HEIGHT, top_pos), 'RGB')
+    graph_draw = ImageDraw.Draw(graph_img)
     # Write the text at the top in black
-    draw.text((0, 0), message, font=font_ml, fill=(0, 0, 0))
-    disp.display(img)
+    graph_draw.text((0, 0), message, font=font_ml, fill=(0, 0, 0))
+    disp.display(graph_img)
 
 # Displays the weather forecast on the 0.96" LCD
 def display_forecast(valid_barometer_history, forecast, barometer_available_time, barometer, barometer_change):
@@ -615,7 +671,7 @@ def display_forecast(valid_barometer_history, forecast, barometer_available_time
             message = "WEATHER FORECAST\nPreparing Summary\nPlease Wait..."
     img = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
     draw = ImageDraw.Draw(img)
-    size_x, size_y = draw.textsize(message, mediumfont)
+    size_x, size_y = get_text_size(draw, message, mediumfont)
     x = (WIDTH - size_x) / 2
     y = (HEIGHT / 2) - (size_y / 2)
     draw.rectangle((0, 0, 160, 80), back_colour)
@@ -653,7 +709,8 @@ def display_results(start_current_display, current_display_is_own, display_modes
                     gas_sensors_warm, outdoor_gas_sensors_warm, enable_display, palette):
     # Allow for display selection if display is enabled, else only display the serial number on a background colour based on max_aqi
     if enable_display:
-        proximity = ltr559.get_proximity()
+        with profiler.span('LTR559 Read'):
+            proximity = ltr559.get_proximity()
         # If the proximity crosses the threshold, toggle the mode
         if proximity > 1500 and time.time() - last_page > delay:
             mode += 1
@@ -667,40 +724,54 @@ def display_results(start_current_display, current_display_is_own, display_modes
                     start_current_display = time.time()
             else:
                 current_display_is_own = True
+        # Each display mode is only re-rendered when its inputs change
+        if current_display_is_own and indoor_outdoor_function == 'Indoor':
+            location, data, disp_values, location_gas_sensors_warm = 'IN', own_data, own_disp_values, gas_sensors_warm
+            location_maxi_temp, location_mini_temp = maxi_temp, mini_temp
+        elif current_display_is_own and indoor_outdoor_function == 'Outdoor':
+            location, data, disp_values, location_gas_sensors_warm = 'OUT', own_data, own_disp_values, gas_sensors_warm
+            location_maxi_temp, location_mini_temp = maxi_temp, mini_temp
+        else:
+            location, data, disp_values, location_gas_sensors_warm = 'OUT', outdoor_data, outdoor_disp_values, outdoor_gas_sensors_warm
+            location_maxi_temp, location_mini_temp = outdoor_maxi_temp, outdoor_mini_temp
         if selected_display_mode in own_data:
-            if current_display_is_own and indoor_outdoor_function == 'Indoor' or selected_display_mode == "Bar":
-                display_graphed_data('IN', own_disp_values, selected_display_mode, own_data[selected_display_mode], WIDTH)
-            elif current_display_is_own and indoor_outdoor_function == 'Outdoor':
-                display_graphed_data('OUT', own_disp_values, selected_display_mode, own_data[selected_display_mode], WIDTH)
-            else:
-                display_graphed_data('OUT', outdoor_disp_values, selected_display_mode, outdoor_data[selected_display_mode], WIDTH)
+            if selected_display_mode == "Bar":
+                location, data, disp_values = 'IN', own_data, own_disp_values
+            if render_cache.changed((selected_display_mode, location, disp_values is own_disp_values, disp_values[selected_display_mode].appends,
+                                     data[selected_display_mode][1])):
+                with profiler.span('Render Graph'):
+                    display_graphed_data(location, disp_values, selected_display_mode, data[selected_display_mode], WIDTH)
         elif selected_display_mode == "Forecast":
-            display_forecast(valid_barometer_history, forecast, barometer_available_time, own_data["Bar"][1], barometer_change)
+            if valid_barometer_history:
+                forecast_inputs = (forecast, own_data["Bar"][1], barometer_change)
+            else:
+                forecast_inputs = int((barometer_available_time - time.time()) / 60) # The countdown changes every minute
+            if render_cache.changed((selected_display_mode, valid_barometer_history, forecast_inputs)):
+                with profiler.span('Render Forecast'):
+                    display_forecast(valid_barometer_history, forecast, barometer_available_time, own_data["Bar"][1], barometer_change)
         elif selected_display_mode == "Status":
-            display_status()
+            wifi_connected = check_display_wifi()
+            if render_cache.changed((selected_display_mode, wifi_connected)):
+                with profiler.span('Render Status'):
+                    display_status(wifi_connected)
         elif selected_display_mode == "All Air":
             # Display everything on one screen
-            if current_display_is_own and indoor_outdoor_function == 'Indoor':
-                display_all_aq('IN', own_data, data_in_display_all_aq)
-            elif current_display_is_own and indoor_outdoor_function == 'Outdoor':
-                display_all_aq('OUT', own_data, data_in_display_all_aq)
-            else:
-                display_all_aq('OUT', outdoor_data, data_in_display_all_aq)
+            if render_cache.changed((selected_display_mode, location, tuple(data[i][1] for i in data_in_display_all_aq))):
+                with profiler.span('Render All Air'):
+                    display_all_aq(location, data, data_in_display_all_aq)
         elif selected_display_mode == "Icon Weather":
-            # Display icon weather/aqi
-            if current_display_is_own and indoor_outdoor_function == 'Indoor':
-                display_icon_weather_aqi('IN', own_data, barometer_trend, icon_forecast, maxi_temp, mini_temp, air_quality_data,
-                                         air_quality_data_no_gas, icon_air_quality_levels, gas_sensors_warm)
-            elif current_display_is_own and indoor_outdoor_function == 'Outdoor':
-                display_icon_weather_aqi('OUT', own_data, barometer_trend, icon_forecast, maxi_temp, mini_temp, air_quality_data,
-                                         air_quality_data_no_gas, icon_air_quality_levels, gas_sensors_warm)
-            else:
-                display_icon_weather_aqi('OUT', outdoor_data, barometer_trend, icon_forecast, outdoor_maxi_temp, outdoor_mini_temp,
-                                         air_quality_data, air_quality_data_no_gas, icon_air_quality_levels, outdoor_gas_sensors_warm)
+            # Display icon weather/aqi. The clock and sun/moon position change every minute
+            if render_cache.changed((selected_display_mode, location, int(time.time() / 60), tuple(data[v][1] for v in data),
+                                     barometer_trend, icon_forecast, location_maxi_temp, location_mini_temp, location_gas_sensors_warm)):
+                with profiler.span('Render Icon Weather'):
+                    display_icon_weather_aqi(location, data, barometer_trend, icon_forecast, location_maxi_temp, location_mini_temp, air_quality_data,
+                                             air_quality_data_no_gas, icon_air_quality_levels, location_gas_sensors_warm)
         else:
             pass
     else:
-        disabled_display(gas_sensors_warm, air_quality_data, air_quality_data_no_gas, own_data, palette)
+        if render_cache.changed(("Disabled", tuple(own_data[v][1] for v in own_data), gas_sensors_warm)):
+            with profiler.span('Render Disabled Display'):
+                disabled_display(gas_sensors_warm, air_quality_data, air_quality_data_no_gas, own_data, palette)
     last_page = time.time()
     return last_page, mode, start_current_display, current_display_is_own
 
@@ -960,53 +1031,8 @@ def x_from_sun_moon_time(progress, period, x_range):
 
 def sun_moon_time(city_name, time_zone):
     """Calculate the progress through the current sun/moon period (i.e day or
-       night) from the last sunrise or sunset, given a datetime object 't'."""
-
-    city = lookup(city_name, db)
-
-    # Datetime objects for yesterday, today, tomorrow
-    utc = pytz.utc
-    utc_dt = datetime.now(tz=utc)
-    local_dt = utc_dt.astimezone(pytz.timezone(time_zone))
-    today = local_dt.date()
-    yesterday = today - timedelta(1)
-    tomorrow = today + timedelta(1)
-
-    # Sun objects for yesterday, today, tomorrow
-    sun_yesterday = sun(city.observer, date=yesterday)
-    sun_today = sun(city.observer, date=today)
-    sun_tomorrow = sun(city.observer, date=tomorrow)
-
-    # Work out sunset yesterday, sunrise/sunset today, and sunrise tomorrow
-    sunset_yesterday = sun_yesterday["sunset"]
-    sunrise_today = sun_today["sunrise"]
-    sunset_today = sun_today["sunset"]
-    sunrise_tomorrow = sun_tomorrow["sunrise"]
-
-    # Work out lengths of day or night period and progress through period
-    if sunrise_today < local_dt < sunset_today:
-        day = True
-        period = sunset_today - sunrise_today
-        mid = sunrise_today + (period / 2)
-        progress = local_dt - sunrise_today
-
-    elif local_dt > sunset_today:
-        day = False
-        period = sunrise_tomorrow - sunset_today
-        mid = sunset_today + (period / 2)
-        progress = local_dt - sunset_today
-
-    else:
-        day = False
-        period = sunrise_today - sunset_yesterday
-        mid = sunset_yesterday + (period / 2)
-        progress = local_dt - sunset_yesterday
-
-    # Convert time deltas to seconds
-    progress = progress.total_seconds()
-    period = period.total_seconds()
-
-    return (progress, period, day, local_dt)
+       night) from the last sunrise or sunset. Sunrise and sunset times are only recalculated when the local date changes."""
+    return ephemeris.sun_moon_time(city_name, time_zone)
 
 def draw_background(progress, period, day, icon_aqi_level):
     """Given an amount of progress through the day or night, draw the
@@ -1047,7 +1073,7 @@ def draw_background(progress, period, day, icon_aqi_level):
 
 def overlay_text(img, position, text, font, align_right=False, rectangle=False):
     draw = ImageDraw.Draw(img)
-    w, h = font.getsize(text)
+    w, h = get_font_size(font, text)
     if align_right:
         x, y = position
         x -= w
@@ -1094,33 +1120,33 @@ def display_icon_weather_aqi(location, data, barometer_trend, icon_forecast, max
     img = overlay_text(img, (WIDTH - margin, 0 + margin), date_string, font_smm, align_right=True)
     temp_string = f"{data['Temp'][1]:.0f}°C"
     img = overlay_text(img, (68, 18), temp_string, font_smm, align_right=True)
-    spacing = font_smm.getsize(temp_string)[1] + 1
+    spacing = get_font_size(font_smm, temp_string)[1] + 1
     if mini_temp is not None and maxi_temp is not None:
         range_string = f"{mini_temp:.0f}-{maxi_temp:.0f}"
     else:
         range_string = "------"
     img = overlay_text(img, (68, 18 + spacing), range_string, font_sm, align_right=True, rectangle=True)
-    temp_icon = Image.open(path + "/icons/temperature.png")
+    temp_icon = asset_cache.icon("temperature")
     img.paste(temp_icon, (margin, 18), mask=temp_icon)
 
     # Humidity
     corr_humidity = data["Hum"][1]
     humidity_string = f"{corr_humidity:.0f}%"
     img = overlay_text(img, (68, 48), humidity_string, font_smm, align_right=True)
-    spacing = font_smm.getsize(humidity_string)[1] + 1
+    spacing = get_font_size(font_smm, humidity_string)[1] + 1
     humidity_desc = describe_humidity(corr_humidity).upper()
     img = overlay_text(img, (68, 48 + spacing), humidity_desc, font_sm, align_right=True, rectangle=True)
-    humidity_icon = Image.open(path + "/icons/humidity-" + humidity_desc.lower() + ".png")
+    humidity_icon = asset_cache.icon("humidity-" + humidity_desc.lower())
     img.paste(humidity_icon, (margin, 48), mask=humidity_icon)
                 
     # AQI
     aqi_string = f"{max_aqi[1]}: {max_aqi[0]}"
     img = overlay_text(img, (WIDTH - margin, 18), aqi_string, font_smm, align_right=True)
-    spacing = font_smm.getsize(aqi_string)[1] + 1
+    spacing = get_font_size(font_smm, aqi_string)[1] + 1
     aqi_desc = icon_air_quality_levels[max_aqi[1]].upper()
     img = overlay_text(img, (WIDTH - margin - 1, 18 + spacing), aqi_desc, font_sm, align_right=True, rectangle=True)
-    #aqi_icon = Image.open(path + "/icons/aqi-" + icon_air_quality_levels[max_aqi[1]].lower() +  ".png")
-    aqi_icon = Image.open(path + "/icons/aqi.png")
+    #aqi_icon = asset_cache.icon("aqi-" + icon_air_quality_levels[max_aqi[1]].lower())
+    aqi_icon = asset_cache.icon("aqi")
     img.paste(aqi_icon, (80, 18), mask=aqi_icon)
 
     # Pressure
@@ -1128,9 +1154,9 @@ def display_icon_weather_aqi(location, data, barometer_trend, icon_forecast, max
     pressure_string = f"{int(pressure)} {barometer_trend}"
     img = overlay_text(img, (WIDTH - margin, 48), pressure_string, font_smm, align_right=True)
     pressure_desc = icon_forecast.upper()
-    spacing = font_smm.getsize(pressure_string)[1] + 1
+    spacing = get_font_size(font_smm, pressure_string)[1] + 1
     img = overlay_text(img, (WIDTH - margin - 1, 48 + spacing), pressure_desc, font_sm, align_right=True, rectangle=True)
-    pressure_icon = Image.open(path + "/icons/weather-" + pressure_desc.lower() +  ".png")
+    pressure_icon = asset_cache.icon("weather-" + pressure_desc.lower())
     img.paste(pressure_icon, (80, 48), mask=pressure_icon)
 
     # Display image
@@ -1139,66 +1165,53 @@ def display_icon_weather_aqi(location, data, barometer_trend, icon_forecast, max
 def update_aio(mqtt_values, forecast, aio_format, aio_forecast_text_format, aio_forecast_icon_format, aio_air_quality_level_format,
                air_quality_text_format, own_data, icon_air_quality_levels, aio_forecast, aio_package, gas_sensors_warm, air_quality_data,
                air_quality_data_no_gas, previous_aio_air_quality_level, previous_aio_air_quality_text, previous_aio_forecast_text, previous_aio_forecast):
-    aio_resp = False # Set to True when there is at least one successful aio feed response
-    aio_json = {}
-    aio_path = '/feeds/'
+    aio_feed_values = [] # [feed_key, value] pairs to be sent to Adafruit IO in one batch
     if gas_sensors_warm and aio_package == "Premium":
-        print("Sending Premium package feeds to Adafruit IO with Gas Data")
+        print("Queuing Premium package feeds to Adafruit IO with Gas Data")
     elif gas_sensors_warm == False and aio_package == "Premium":
-        print("Sending Premium package feeds to Adafruit IO without Gas Data")
+        print("Queuing Premium package feeds to Adafruit IO without Gas Data")
     else:
-        print("Sending", aio_package, "package feeds to Adafruit IO")
+        print("Queuing", aio_package, "package feeds to Adafruit IO")
     # Analyse air quality levels and combine into an overall air quality level based on own_data thesholds
-    max_aqi = max_aqi_level_factor(gas_sensors_warm, air_quality_data, air_quality_data_no_gas, own_data)
+    with profiler.span('AIO Air Quality Level'):
+        max_aqi = max_aqi_level_factor(gas_sensors_warm, air_quality_data, air_quality_data_no_gas, own_data)
     combined_air_quality_level_factor = max_aqi[0]
     combined_air_quality_level = max_aqi[1]
     combined_air_quality_text = icon_air_quality_levels[combined_air_quality_level] + ": " + combined_air_quality_level_factor
     if combined_air_quality_level != previous_aio_air_quality_level: # Only update if it's changed
-        print('Sending Air Quality Level Feed')
-        aio_json['value'] = combined_air_quality_level
-        feed_resp = send_data_to_aio(aio_air_quality_level_format, combined_air_quality_level)  # Used by all aio packages
-        if feed_resp:
-            aio_resp = True
+        print('Adding Air Quality Level Feed')
+        aio_feed_values.append([aio_air_quality_level_format, combined_air_quality_level])  # Used by all aio packages
         previous_aio_air_quality_level = combined_air_quality_level
     if (aio_package == 'Premium' or aio_package == 'Basic Air') and combined_air_quality_text != previous_aio_air_quality_text: # Only update if it's changed
-        print('Sending Air Quality Text Feed')
-        feed_resp = send_data_to_aio(aio_air_quality_text_format, combined_air_quality_text)
-        if feed_resp:
-            aio_resp = True
+        print('Adding Air Quality Text Feed')
+        aio_feed_values.append([aio_air_quality_text_format, combined_air_quality_text])
         previous_aio_air_quality_text = combined_air_quality_text
     if enable_indoor_outdoor_functionality == False or enable_indoor_outdoor_functionality and indoor_outdoor_function == "Outdoor":
         # If indoor_outdoor_functionality is enabled, only send the forecast from the outdoor unit and only if it's been updated
         aio_forecast_text = forecast.replace("\n", " ")
         if aio_package == 'Premium' and aio_forecast_text != previous_aio_forecast_text:
-            print('Sending Weather Forecast Text Feed')
-            feed_resp = send_data_to_aio(aio_forecast_text_format, aio_forecast_text)
-            if feed_resp:
-                aio_resp = True
+            print('Adding Weather Forecast Text Feed')
+            aio_feed_values.append([aio_forecast_text_format, aio_forecast_text])
             previous_aio_forecast_text = aio_forecast_text
         if (aio_package == 'Premium' or aio_package == 'Basic Combo') and aio_forecast != previous_aio_forecast:
-            print('Sending Weather Forecast Icon Feed')
-            feed_resp = send_data_to_aio(aio_forecast_icon_format, aio_forecast)
-            if feed_resp:
-                aio_resp = True
+            print('Adding Weather Forecast Icon Feed')
+            aio_feed_values.append([aio_forecast_icon_format, aio_forecast])
             previous_aio_forecast = aio_forecast
     # Send other feeds
-    for feed in aio_format: # aio_format varies, based on the relevant aio_package
-        if aio_format[feed][1]: # Send the first value of the list if sending humidity or barometer data
-            if (feed == "Hum" or
-                feed == "Bar" and enable_indoor_outdoor_functionality == False or
-                feed == "Bar" and enable_indoor_outdoor_functionality and indoor_outdoor_function == "Outdoor"):
-                # If indoor_outdoor_functionality is enabled, only send outdoor barometer feed
-                print('Sending', feed, 'Feed')
-                feed_resp = send_data_to_aio(aio_format[feed][0], mqtt_values[feed][0])
-                if feed_resp:
-                    aio_resp = True
-        else: # Send the value if sending data other than humidity or barometer
-            if (feed != "Red" and feed != "Oxi" and feed != "NH3") or mqtt_values['Gas Calibrated']: # Only send gas data if the gas sensors are warm and calibrated
-                print('Sending', feed, 'Feed')
-                feed_resp = send_data_to_aio(aio_format[feed][0], mqtt_values[feed])
-                if feed_resp:
-                    aio_resp = True
-    return previous_aio_air_quality_level, previous_aio_air_quality_text, previous_aio_forecast_text, previous_aio_forecast, aio_resp
+    with profiler.span('AIO Feed Values'):
+        for feed in aio_format: # aio_format varies, based on the relevant aio_package
+            if aio_format[feed][1]: # Send the first value of the list if sending humidity or barometer data
+                if (feed == "Hum" or
+                    feed == "Bar" and enable_indoor_outdoor_functionality == False or
+                    feed == "Bar" and enable_indoor_outdoor_functionality and indoor_outdoor_function == "Outdoor"):
+                    # If indoor_outdoor_functionality is enabled, only send outdoor barometer feed
+                    print('Adding', feed, 'Feed')
+                    aio_feed_values.append([aio_format[feed][0], mqtt_values[feed][0]])
+            else: # Send the value if sending data other than humidity or barometer
+                if (feed != "Red" and feed != "Oxi" and feed != "NH3") or mqtt_values['Gas Calibrated']: # Only send gas data if the gas sensors are warm and calibrated
+                    print('Adding', feed, 'Feed')
+                    aio_feed_values.append([aio_format[feed][0], mqtt_values[feed]])
+    return previous_aio_air_quality_level, previous_aio_air_quality_text, previous_aio_forecast_text, previous_aio_forecast, aio_feed_values
      
 # Compensation factors for temperature, humidity and air pressure
 if enable_display: # Set temp and hum compensation when display is enabled (no weather protection cover in place)
@@ -1223,6 +1236,16 @@ else: # Set temp and hum compensation when display is disabled (weather protecti
     comp_hum_quad_a = -0.0098
     comp_hum_quad_b = 2.0705
     comp_hum_quad_c = -1.2795
+# Online calibration of the temp and hum compensation polynomials against external reference sensors, starting from the coefficients above
+compensation_calibration_file = '<Your Compensation Calibration File Name Here>'
+if enable_compensation_calibration:
+    compensation_calibrators = {"Temp": RLSCalibrator("Temp", [comp_temp_cub_a, comp_temp_cub_b, comp_temp_cub_c, comp_temp_cub_d], centre=25, scale=10,
+                                                      x_range=(0, 55), y_range=(-20, 50), max_residual=5, max_adjustment=3),
+                                "Hum": RLSCalibrator("Hum", [comp_hum_quad_a, comp_hum_quad_b, comp_hum_quad_c], centre=50, scale=25,
+                                                     x_range=(0, 100), y_range=(0, 100), max_residual=15, max_adjustment=10)}
+else:
+    compensation_calibrators = {}
+calibration_reference_time = 0 # Update time of the last external reading used for calibration
 # Gas Comp Factors: Change in Rs per raw temp degree C, raw percent humidity or hPa of raw air pressure relative to baselines
 red_temp_comp_factor = -5522
 red_hum_comp_factor = -3128
@@ -1268,7 +1291,7 @@ message = ""
 
 # Set up icon display
 # Set up air quality levels for icon display
-icon_air_quality_levels = ['Great', 'OK', 'Alert', 'Poor', 'Bad']
+icon_air_quality_levels = air_quality_levels
 # Values that alter the look of the background
 blur = 5
 opacity = 255
@@ -1279,8 +1302,9 @@ margin = 3
 
 # Create own_data dict to store the data to be displayed in Display Everything
 # Format: {Display Item: [Units, Current Value, [Level Thresholds], display_all_aq position]}
-own_data = {"P1": ["ug/m3", 0, [6,17,27,35], 0], "P2.5": ["ug/m3", 0, [11,35,53,70], 1], "P10": ["ug/m3", 0, [16,50,75,100], 2],
-            "Oxi": ["ppm", 0, [0.5, 1, 3, 5], 3], "Red": ["ppm", 0, [5, 30, 50, 75], 4], "NH3": ["ppm", 0, [5, 30, 50, 75], 5],
+own_data = {"P1": ["ug/m3", 0, air_quality_thresholds["P1"], 0], "P2.5": ["ug/m3", 0, air_quality_thresholds["P2.5"], 1],
+            "P10": ["ug/m3", 0, air_quality_thresholds["P10"], 2], "Oxi": ["ppm", 0, air_quality_thresholds["Oxi"], 3],
+            "Red": ["ppm", 0, air_quality_thresholds["Red"], 4], "NH3": ["ppm", 0, air_quality_thresholds["NH3"], 5],
             "Temp": ["C", 0, [10,16,28,35], 6], "Hum": ["%", 0, [20,40,60,90], 7], "Bar": ["hPa", 0, [250,650,1013,1015], 8],
             "Lux": ["Lux", 1, [-1,-1,30000,100000], 9]}
 data_in_display_all_aq =  ["P1", "P2.5", "P10", "Oxi", "Red", "NH3"]
@@ -1289,22 +1313,32 @@ data_in_display_all_aq =  ["P1", "P2.5", "P10", "Oxi", "Red", "NH3"]
 display_modes = ["Icon Weather", "All Air", "P1", "P2.5", "P10", "Oxi", "Red", "NH3", "Forecast", "Temp", "Hum", "Bar", "Lux", "Status"]
 
 # For graphing own display data
+disp_history_length = int(WIDTH/2) # One reading for every 2 pixels of display width
 own_disp_values = {}
 for v in own_data:
-    own_disp_values[v] = [[1, 0]] * int(WIDTH/2)
+    own_disp_values[v] = DisplayRingBuffer(disp_history_length)
+
+# Rolling min, max, mean and standard deviation of each reading over the configured windows
+rolling_stats = RollingStats(own_data, rolling_stats_windows)
+temp_range_window = "24h" # Window of the displayed and published min and max temperatures
+mean_window = "1h" # Window of the published mean readings
+standard_aqi_windows = {"US EPA AQI": "24h", "EU CAQI": "1h"} # The US EPA AQI uses 24 hour means and the EU CAQI uses hourly means
+standard_aqis = {"US EPA AQI": us_epa_aqi, "EU CAQI": eu_caqi}
+standard_aqi_min_coverage = 0.75 # Fraction of the window that must have readings before an index is published (the EPA's 18 of 24 hours)
                    
 if enable_indoor_outdoor_functionality and indoor_outdoor_function == 'Indoor': # Prepare outdoor data, if it's required'             
-    outdoor_data = {"P1": ["ug/m3", 0, [6,17,27,35], 0], "P2.5": ["ug/m3", 0, [11,35,53,70], 1], "P10": ["ug/m3", 0, [16,50,75,100], 2],
-                    "Oxi": ["ppm", 0, [0.5, 1, 3, 5], 3], "Red": ["ppm", 0, [5, 30, 50, 75], 4], "NH3": ["ppm", 0, [10, 50, 100, 150], 5],
+    outdoor_data = {"P1": ["ug/m3", 0, air_quality_thresholds["P1"], 0], "P2.5": ["ug/m3", 0, air_quality_thresholds["P2.5"], 1],
+                    "P10": ["ug/m3", 0, air_quality_thresholds["P10"], 2], "Oxi": ["ppm", 0, air_quality_thresholds["Oxi"], 3],
+                    "Red": ["ppm", 0, air_quality_thresholds["Red"], 4], "NH3": ["ppm", 0, air_quality_thresholds["NH3"], 5],
                     "Temp": ["C", 0, [10,16,28,35], 6], "Hum": ["%", 0, [20,40,60,80], 7], "Bar": ["hPa", 0, [250,650,1013,1015], 8],
                     "Lux": ["Lux", 1, [-1,-1,30000,100000], 9]}
     # For graphing outdoor display data
     outdoor_disp_values = {}
     for v in outdoor_data:
-        outdoor_disp_values[v] = [[1, 0]] * int(WIDTH/2)
+        outdoor_disp_values[v] = DisplayRingBuffer(disp_history_length)
 else:
     outdoor_data = {}
-    outdoor_disp_values = []
+    outdoor_disp_values = {}
 # Used to define aqi components and their priority for the icon display.
 air_quality_data = ["P1", "P2.5", "P10", "Oxi", "Red", "NH3"]
 air_quality_data_no_gas = ["P1", "P2.5", "P10"]
@@ -1336,8 +1370,21 @@ palette = [(128,128,255),   # Very Low
            (255,0,0)]       # Very High
     
 luft_values = {} # To be sent to Luftdaten
+# Shared HTTP transport with persistent connections for Luftdaten and Adafruit IO
+http_transport = HttpTransport(max_connections_per_host=2, dns_ttl=300, default_timeout=5)
+upload_time_budget = 8 # Maximum total time for the requests in one Luftdaten or Adafruit IO upload cycle
+# Outbound Luftdaten, Adafruit IO and mqtt payloads are queued in a crash-safe outbox until they've been accepted
+mqtt_publishing_enabled = (indoor_outdoor_function == 'Indoor' and enable_send_data_to_homemanager or
+                           indoor_outdoor_function == 'Outdoor' and (enable_indoor_outdoor_functionality or enable_send_data_to_homemanager))
+outbox = None # Opened by start_monitor
+# Climate and gas data for regression analysis is logged as JSON Lines ('jsonl') or 'csv' and rotated when the file reaches max_bytes
+environment_log = None # Opened by start_monitor
+outbox_drain_interval = 10 # Time between attempts to send queued payloads
+aio_outbox_batches_per_drain = 2 # Limits the backlog's Adafruit IO request rate to stay within the throttling limit
+luftdaten_outbox_max_age = 600 # Luftdaten uses the time of receipt, so older readings are discarded
+aio_outbox_max_age = 30 * 24 * 3600 # Adafruit IO keeps 30 days of feed data (60 days with IO+), so older readings are discarded
+mqtt_outbox_max_age = 3600 # mqtt messages carry current state, so older messages are discarded
 mqtt_values = {} # To be sent to Home Manager, outdoor to indoor unit communications and used for the Adafruit IO Feeds
-data_sent_to_luftdaten_or_aio = False # Used to flag that the main loop delay is not required when data is sent to Luftdaten of Adafruit IO
 maxi_temp = None
 mini_temp = None
 
@@ -1345,18 +1392,16 @@ mini_temp = None
 # Raspberry Pi ID to send to Luftdaten
 id = "raspi-" + get_serial_number()
 
-# Display Raspberry Pi serial and Wi-Fi status
-logging.info("Raspberry Pi serial: {}".format(get_serial_number()))
-logging.info("Wi-Fi: {}\n".format("connected" if check_wifi() else "disconnected"))
-
 # Set up mqtt if required
+mqtt_dispatch_interval = 0.5 # Time between runs of the handlers for queued incoming mqtt updates
+mqtt_queue_size = 100 # Limit of queued incoming mqtt updates that aren't coalesced
+mqtt_keyframe_interval = 12 # With delta encoding, every 12th mqtt_values payload (i.e. hourly) has every field
+mqtt_delta_encoder = DeltaEncoder(mqtt_keyframe_interval) if enable_mqtt_delta_encoding else None
+outdoor_delta_decoder = DeltaDecoder() # Accepts both full and delta encoded payloads from the outdoor unit
+client = None # Connected by start_monitor
 if enable_send_data_to_homemanager or enable_receive_data_from_homemanager or enable_indoor_outdoor_functionality:
     es = ExternalSensors()
-    client = mqtt.Client(mqtt_client_name)
-    client.on_connect = on_connect
-    client.on_message = on_message
-    client.connect(mqtt_broker_name, 1883, 60)
-    client.loop_start()
+    mqtt_dispatcher = build_mqtt_dispatcher()
   
 if enable_adafruit_io:
     # Set up Adafruit IO. aio_format{'measurement':[feed, is value in list format?]}
@@ -1364,6 +1409,7 @@ if enable_adafruit_io:
     # Three aio_packages: Basic Air (Air Quality Level, Air Quality Text, PM1,  PM2.5, PM10), Basic Combo (Air Quality Level, Weather Forecast Icon, Temp, Hum, Bar Feeds) and Premium (All Feeds)
     print('Setting up', aio_package, 'Adafruit IO')
     aio_url = "https://io.adafruit.com/api/v2/" + aio_user_name
+    aio_group_key = "default" # Feeds are in the default group, so that all of an update's feeds can be sent in one group data request
     aio_feed_prefix = aio_household_prefix + '-' + aio_location_prefix
     aio_format = {}
     aio_forecast_text_format = None
@@ -1399,9 +1445,9 @@ if enable_adafruit_io:
 
 # Set up comms error and failure flags
 luft_resp = True # Set to False when there is a Luftdaten comms error
-aio_resp = True # Set to False when there is an comms error on all Adafruit IO feeds
+aio_resp = True # Set to False when an Adafruit IO feed batch fails
 successful_comms_time = time.time()
-comms_failure_tolerance = 3600 # Adjust this to set the comms failure duration before a reboot via the watchdog is triggered when both Luftdaten and Adafruit IO are enabled
+comms_failure_tolerance = 3600 # Adjust this to set the comms failure duration before a reboot via the watchdog is triggered when both Luftdaten and Adafruit IO are enabled and Wi-Fi is lost
 comms_failure = False # Set to True when there has been a comms failure on both Luftdaten and Adafruit IO
     
 # Take one reading from each climate and gas sensor on start up to stabilise readings
@@ -1447,7 +1493,8 @@ aio_forecast = 'question'
 
 # Set up times
 short_update_time = 0 # Set the short update time baseline (for watchdog alive file and Luftdaten updates)
-short_update_delay = 150 # Time between short updates
+short_update_delay = 150 # Time between Luftdaten updates. Climate and gas sampling intervals are set by the sampling scheduler
+luftdaten_queued_time = 0 # Time that the last Luftdaten update was queued
 previous_aio_update_minute = None # Used to record the last minute that the aio feeds were updated
 long_update_time = 0 # Set the long update time baseline (for all other updates)
 long_update_delay = 300 # Time between long updates
@@ -1459,230 +1506,551 @@ mqtt_values["Bar"] = [gas_calib_bar, domoticz_forecast]
 domoticz_hum_map = {"good": "1", "dry": "2", "wet": "3"}
 mqtt_values["Hum"] = [gas_calib_hum, domoticz_hum_map["good"]]
 path = os.path.dirname(os.path.realpath(__file__))
-# Check for a persistence data log and use it if it exists and was < 10 minutes ago
-persistent_data_log = {}
-    
-try:
-    with open('<Your Persistent Data Log File Name Here>', 'r') as f:
-        persistent_data_log = json.loads(f.read())
-except IOError:
-    print('No Persistent Data Log Available. Using Defaults')
-if "Update Time" in persistent_data_log and "Gas Calib Temp List" in persistent_data_log: # Check that the log has been updated and has a format > 3.87
-    if (start_time - persistent_data_log["Update Time"]) < 1200: # Only update variables if the log was updated < 20 minutes before start-up
-        long_update_time = persistent_data_log["Update Time"]
-        short_update_time = long_update_time
-        barometer_log_time = persistent_data_log["Barometer Log Time"]
-        forecast = persistent_data_log["Forecast"]
-        barometer_available_time = persistent_data_log["Barometer Available Time"]
-        valid_barometer_history = persistent_data_log["Valid Barometer History"]
-        barometer_history = persistent_data_log["Barometer History"]
-        barometer_change = persistent_data_log["Barometer Change"]
-        barometer_trend = persistent_data_log["Barometer Trend"]
-        icon_forecast = persistent_data_log["Icon Forecast"]
-        domoticz_forecast = persistent_data_log["Domoticz Forecast"]
-        aio_forecast = persistent_data_log["AIO Forecast"]
-        gas_sensors_warm = persistent_data_log["Gas Sensors Warm"]
-        gas_calib_temp = persistent_data_log["Gas Temp"]
-        gas_calib_hum = persistent_data_log["Gas Hum"]
-        gas_calib_bar = persistent_data_log["Gas Bar"]
-        gas_calib_temps = persistent_data_log["Gas Calib Temp List"]
-        gas_calib_hums = persistent_data_log["Gas Calib Hum List"]
-        gas_calib_bars = persistent_data_log["Gas Calib Bar List"]
-        red_r0 = persistent_data_log["Red R0"]
-        oxi_r0 = persistent_data_log["Oxi R0"]
-        nh3_r0 = persistent_data_log["NH3 R0"]
-        reds_r0 = persistent_data_log["Red R0 List"]
-        oxis_r0 = persistent_data_log["Oxi R0 List"]
-        nh3s_r0 = persistent_data_log["NH3 R0 List"]
-        own_disp_values = persistent_data_log["Own Disp Values"]
-        outdoor_disp_values = persistent_data_log["Outdoor Disp Values"]
-        maxi_temp = persistent_data_log["Maxi Temp"]
-        mini_temp = persistent_data_log["Mini Temp"]
-        last_page = persistent_data_log["Last Page"]
-        mode = persistent_data_log["Mode"]
-        print('Persistent Data Log retrieved and used')
-        print("Recovered R0. Red R0:", round(red_r0, 0), "Oxi R0:", round(oxi_r0, 0), "NH3 R0:", round(nh3_r0, 0))
-    else:
-        print('Persistent Data Log Too Old. Using Defaults')
-mqtt_values["Forecast"] = {"Valid": valid_barometer_history, "3 Hour Change": round(barometer_change, 1), "Forecast": forecast}
+asset_cache = AssetCache(path + "/icons") # Icons are decoded once here, instead of on every display frame
+def serialize_disp_values(disp_values):
+    return {v: disp_values[v].serialize() for v in disp_values}
+
+def restore_disp_values(disp_values, logged_disp_values):
+    # Accepts both serialized ring buffers and the [value, flag] lists used by earlier persistent data logs
+    if not logged_disp_values:
+        return disp_values
+    return {v: DisplayRingBuffer.from_serialized(logged_disp_values[v], disp_history_length) if v in logged_disp_values else disp_values[v]
+            for v in disp_values}
+
+# The persistent data log is saved as snapshot sections, so that the sections that rarely change aren't rewritten every long update
+persistent_data_sections = ["Scalars", "Barometer History", "Gas Calibration", "Display History", "Rolling Stats"]
+persistent_snapshot = SnapshotStore('<Your Persistent Data Log File Name Here>')
+def restore_persistent_data_log():
+    # Check for a persistence data log and use it if it exists and was < 20 minutes ago
+    global long_update_time, short_update_time, barometer_log_time, forecast, barometer_available_time, valid_barometer_history
+    global barometer_history, barometer_change, barometer_trend, icon_forecast, domoticz_forecast, aio_forecast, gas_sensors_warm
+    global gas_calib_temp, gas_calib_hum, gas_calib_bar, gas_calib_temps, gas_calib_hums, gas_calib_bars, red_r0, oxi_r0, nh3_r0
+    global reds_r0, oxis_r0, nh3s_r0, own_disp_values, outdoor_disp_values, maxi_temp, mini_temp, last_page, mode
+    persistent_data_log = persistent_snapshot.read(persistent_data_sections)
+    if persistent_data_log == {}: # Fall back to a single file log from an earlier version
+        try:
+            with open('<Your Persistent Data Log File Name Here>', 'r') as f:
+                persistent_data_log = json.loads(f.read())
+        except (IOError, ValueError):
+            print('No Persistent Data Log Available. Using Defaults')
+    if "Update Time" in persistent_data_log and "Gas Calib Temp List" in persistent_data_log and "Barometer History" in persistent_data_log: # Check that the log has been updated, has a format > 3.87 and that its sections are intact
+        if (start_time - persistent_data_log["Update Time"]) < 1200: # Only update variables if the log was updated < 20 minutes before start-up
+            long_update_time = persistent_data_log["Update Time"]
+            short_update_time = long_update_time
+            barometer_log_time = persistent_data_log["Barometer Log Time"]
+            forecast = persistent_data_log["Forecast"]
+            barometer_available_time = persistent_data_log["Barometer Available Time"]
+            valid_barometer_history = persistent_data_log["Valid Barometer History"]
+            barometer_history = persistent_data_log["Barometer History"]
+            barometer_change = persistent_data_log["Barometer Change"]
+            barometer_trend = persistent_data_log["Barometer Trend"]
+            icon_forecast = persistent_data_log["Icon Forecast"]
+            domoticz_forecast = persistent_data_log["Domoticz Forecast"]
+            aio_forecast = persistent_data_log["AIO Forecast"]
+            gas_sensors_warm = persistent_data_log["Gas Sensors Warm"]
+            gas_calib_temp = persistent_data_log["Gas Temp"]
+            gas_calib_hum = persistent_data_log["Gas Hum"]
+            gas_calib_bar = persistent_data_log["Gas Bar"]
+            gas_calib_temps = persistent_data_log["Gas Calib Temp List"]
+            gas_calib_hums = persistent_data_log["Gas Calib Hum List"]
+            gas_calib_bars = persistent_data_log["Gas Calib Bar List"]
+            red_r0 = persistent_data_log["Red R0"]
+            oxi_r0 = persistent_data_log["Oxi R0"]
+            nh3_r0 = persistent_data_log["NH3 R0"]
+            reds_r0 = persistent_data_log["Red R0 List"]
+            oxis_r0 = persistent_data_log["Oxi R0 List"]
+            nh3s_r0 = persistent_data_log["NH3 R0 List"]
+            own_disp_values = restore_disp_values(own_disp_values, persistent_data_log.get("Own Disp Values"))
+            outdoor_disp_values = restore_disp_values(outdoor_disp_values, persistent_data_log.get("Outdoor Disp Values"))
+            maxi_temp = persistent_data_log["Maxi Temp"]
+            mini_temp = persistent_data_log["Mini Temp"]
+            last_page = persistent_data_log["Last Page"]
+            mode = persistent_data_log["Mode"]
+            print('Persistent Data Log retrieved and used')
+            print("Recovered R0. Red R0:", round(red_r0, 0), "Oxi R0:", round(oxi_r0, 0), "NH3 R0:", round(nh3_r0, 0))
+        else:
+            print('Persistent Data Log Too Old. Using Defaults')
+    if "Rolling Stats" in persistent_data_log: # Rolling statistics are restored whatever the log's age, because their old readings expire on their own
+        print('Rolling Statistics Windows Restored:', rolling_stats.restore(persistent_data_log["Rolling Stats"], time.time()))
+    mqtt_values["Forecast"] = {"Valid": valid_barometer_history, "3 Hour Change": round(barometer_change, 1), "Forecast": forecast}
                                  
-# Main loop to read data, display, and send to Luftdaten, HomeManager and Adafruit IO
-try:
-    while True:       
-        # Read air particle values on every loop
-        luft_values, mqtt_values, own_data, own_disp_values = read_pm_values(luft_values, mqtt_values, own_data, own_disp_values)
-        
-        # Read climate values, provide external updates and write to watchdog file every 2.5 minutes (set by short_update_time).
-        run_time = round((time.time() - start_time), 0)
-        time_since_short_update = time.time() - short_update_time
-        if time_since_short_update >= short_update_delay:
-            short_update_time = time.time()
-            (luft_values, mqtt_values, own_data, maxi_temp, mini_temp, own_disp_values, raw_red_rs, raw_oxi_rs, raw_nh3_rs,
-             raw_temp, comp_temp, comp_hum, raw_hum, use_external_temp_hum,
-             use_external_barometer, raw_barometer) = read_climate_gas_values(luft_values, mqtt_values, own_data,
-                                                                              maxi_temp, mini_temp, own_disp_values,
-                                                                              gas_sensors_warm,
-                                                                              gas_calib_temp, gas_calib_hum, gas_calib_bar, altitude)
-            first_climate_reading_done = True
-            print('Luftdaten Values', luft_values)
-            print('mqtt Values', mqtt_values)
-            # Write to the watchdog file unless there is a comms failure for >= comms_failure_tolerance when both Luftdaten and Adafruit IO arenabled
-            if comms_failure == False:
-                with open('<Your Watchdog File Name Here>', 'w') as f:
-                    f.write('Enviro Script Alive')
-            if enable_luftdaten: # Send data to Luftdaten if enabled
-                luft_resp = send_to_luftdaten(luft_values, id, enable_particle_sensor)
-                #logging.info("Luftdaten Response: {}\n".format("ok" if luft_resp else "failed"))
-                data_sent_to_luftdaten_or_aio = True
-                if luft_resp:
-                    print("Luftdaten update successful. Waiting for next capture cycle")
-                else:
-                    print("Luftdaten update unsuccessful. Waiting for next capture cycle")
-            else:
-                print('Waiting for next capture cycle')
-                
-        # Read and update the barometer log if the first climate reading has been done and the last update was >= 20 minutes ago
-        if first_climate_reading_done and (time.time() - barometer_log_time) >= 1200:
-            if barometer_log_time == 0: # If this is the first barometer log, record the time that a forecast will be available (3 hours)
-                barometer_available_time = time.time() + 10800
-            barometer_history, barometer_change, valid_barometer_history, barometer_log_time, forecast, barometer_trend, icon_forecast, domoticz_forecast, aio_forecast = log_barometer(own_data['Bar'][1], barometer_history)
-            mqtt_values["Forecast"] = {"Valid": valid_barometer_history, "3 Hour Change": round(barometer_change, 1), "Forecast": forecast.replace("\n", " ")}
-            mqtt_values["Bar"][1] = domoticz_forecast # Add Domoticz Weather Forecast
-            print('Barometer Logged. Waiting for next capture cycle')
-
-        # Update Display on every loop
-        last_page, mode, start_current_display, current_display_is_own = display_results(start_current_display, current_display_is_own, display_modes,
-                                                                                         indoor_outdoor_display_duration, own_data,
-                                                                                         data_in_display_all_aq, outdoor_data,
-                                                                                         outdoor_reading_captured, own_disp_values,
-                                                                                         outdoor_disp_values, delay, last_page, mode,
-                                                                                         luft_values, mqtt_values, WIDTH,
-                                                                                         valid_barometer_history, forecast,
-                                                                                         barometer_available_time, barometer_change,
-                                                                                         barometer_trend, icon_forecast, maxi_temp,
-                                                                                         mini_temp, air_quality_data, air_quality_data_no_gas,
-                                                                                         gas_sensors_warm,
-                                                                                         outdoor_gas_sensors_warm, enable_display, palette)
-
-        # Provide external updates and update persistent data log
-        if run_time > startup_stabilisation_time: # Wait until the gas sensors have stabilised before providing external updates or updating the persistent data log
-            # Send data to Adafruit IO if enabled, set up and the time is now within the configured window and sequence
-            if enable_adafruit_io and aio_format != {}:
-                today=datetime.now()
-                window_minute = int(today.strftime('%M'))
-                window_second = int(today.strftime('%S'))
-                if window_minute % 10 == aio_feed_window and window_second // 15 == aio_feed_sequence and window_minute != previous_aio_update_minute:
-                    previous_aio_air_quality_level, previous_aio_air_quality_text, previous_aio_forecast_text, previous_aio_forecast, aio_resp = update_aio(mqtt_values, forecast, aio_format, aio_forecast_text_format,
-                                                                                                                                                  aio_forecast_icon_format, aio_air_quality_level_format,
-                                                                                                                                                  aio_air_quality_text_format, own_data, icon_air_quality_levels,
-                                                                                                                                                  aio_forecast, aio_package, gas_sensors_warm, air_quality_data,
-                                                                                                                                                  air_quality_data_no_gas, previous_aio_air_quality_level,
-                                                                                                                                                  previous_aio_air_quality_text,previous_aio_forecast_text,
-                                                                                                                                                  previous_aio_forecast)
-                    data_sent_to_luftdaten_or_aio = True
-                    previous_aio_update_minute = window_minute
-                    if aio_resp:
-                        print("At least one Adafruit IO feed successful. Waiting for next capture cycle")
-                    else:
-                        print("No Adafruit IO feeds successful. Waiting for next capture cycle")
-            time_since_long_update = time.time() - long_update_time
-            # Provide other external updates and update persistent data log every 5 minutes (Set by long_update_delay)
-            if time_since_long_update >= long_update_delay:
-                long_update_time = time.time()
-                if (indoor_outdoor_function == 'Indoor' and enable_send_data_to_homemanager):
-                    client.publish(indoor_mqtt_topic, json.dumps(mqtt_values))
-                elif (indoor_outdoor_function == 'Outdoor' and (enable_indoor_outdoor_functionality or enable_send_data_to_homemanager)):
-                    client.publish(outdoor_mqtt_topic, json.dumps(mqtt_values))
-                else:
-                    pass
-                if enable_climate_and_gas_logging:
-                    log_climate_and_gas(run_time, own_data, raw_red_rs, raw_oxi_rs, raw_nh3_rs, raw_temp, comp_temp, comp_hum, raw_hum,
-                                        use_external_temp_hum, use_external_barometer, raw_barometer)
-                # Write to the persistent data log
-                persistent_data_log = {"Update Time": long_update_time, "Barometer Log Time": barometer_log_time, "Forecast": forecast, "Barometer Available Time": barometer_available_time,
-                                       "Valid Barometer History": valid_barometer_history, "Barometer History": barometer_history, "Barometer Change": barometer_change,
-                                       "Barometer Trend": barometer_trend, "Icon Forecast": icon_forecast, "Domoticz Forecast": domoticz_forecast,
-                                       "AIO Forecast": aio_forecast, "Gas Sensors Warm": gas_sensors_warm, "Gas Temp": gas_calib_temp,
-                                       "Gas Hum": gas_calib_hum, "Gas Bar": gas_calib_bar, "Red R0": red_r0, "Oxi R0": oxi_r0, "NH3 R0": nh3_r0,
-                                       "Red R0 List": reds_r0, "Oxi R0 List": oxis_r0, "NH3 R0 List": nh3s_r0, "Gas Calib Temp List": gas_calib_temps,
-                                       "Gas Calib Hum List": gas_calib_hums, "Gas Calib Bar List": gas_calib_bars, "Own Disp Values": own_disp_values,
-                                       "Outdoor Disp Values": outdoor_disp_values, "Maxi Temp": maxi_temp, "Mini Temp": mini_temp, "Last Page": last_page, "Mode": mode}
-                print('Logging Barometer, Forecast, Gas Calibration and Display Data')
-                with open('<Your Persistent Data Log File Name Here>', 'w') as f:
-                    f.write(json.dumps(persistent_data_log))
-                if "Forecast" in mqtt_values:
-                    mqtt_values.pop("Forecast") # Remove Forecast after sending it to home manager so that forecast data is only sent when updated
-                print('Waiting for next capture cycle')
-        # Luftdaten and Adafruit IO Communications Check
-        if aio_resp or luft_resp: # Set time when a successful Luftdaten or Adafruit IO response is received, or if either Luftdaten or Adafruit IO is disabled
-            successful_comms_time = time.time() 
-        if time.time() - successful_comms_time >= comms_failure_tolerance:
-            comms_failure = True
-            print("Both Lufdaten and Adafruit IO communications have been lost for more than " + str(int(comms_failure_tolerance/60)) + " minutes. System will reboot via watchdog")
-        # Outdoor Sensor Comms Check
-        if time.time() - outdoor_reading_captured_time > long_update_delay * 2:
-            outdoor_reading_captured = False # Reset outdoor reading captured flag if comms with the outdoor sensor is lost so that old outdoor data is not displayed
-        # Calibrate gas sensors after warmup
-        if ((time.time() - start_time) > gas_sensors_warmup_time) and gas_sensors_warm == False:
-            gas_calib_temp = raw_temp
-            gas_calib_hum = raw_hum
-            gas_calib_bar = raw_barometer
-            red_r0, oxi_r0, nh3_r0 = read_raw_gas()
-            print("Gas Sensor Calibration after Warmup. Red R0:", red_r0, "Oxi R0:", oxi_r0, "NH3 R0:", nh3_r0)
-            print("Gas Calibration Baseline. Temp:", round(gas_calib_temp, 1), "Hum:", round(gas_calib_hum, 0), "Barometer:", round(gas_calib_bar, 1))
-            reds_r0 = [red_r0] * 7
-            oxis_r0 = [oxi_r0] * 7
-            nh3s_r0 = [nh3_r0] * 7
-            gas_calib_temps = [gas_calib_temp] * 7
-            gas_calib_hums = [gas_calib_hum] * 7
-            gas_calib_bars = [gas_calib_bar] * 7
-            gas_sensors_warm = True
-            
-        # Calibrate gas sensors daily at time set by gas_daily_r0_calibration_hour,
-        # using average of daily readings over a week if not already done in the current day and if warmup calibration is completed
-        # Compensates for gas sensor drift over time
+# Runtime tasks to read data, display, and send to Luftdaten, HomeManager and Adafruit IO
+# Climate and gas sensor reads share the "sensors" executor thread so that driver calls never overlap (PMS5003 frames are read
+# by the particle sensor reader thread) and only return the sensors' readings, display rendering has its own thread and renders
+# copies of its inputs, uploads run on the "network" threads with copies of the values that they send and file writes run on
+# the "storage" thread. All state changes are made on the event loop, so a slow sensor read or network timeout can't stall the
+# other tasks and the threads never see partly updated values.
+runtime = MonitorRuntime(task_completed)
+runtime.add_executor('sensors')
+runtime.add_executor('display')
+runtime.add_executor('network', max_workers=2)
+runtime.add_executor('storage')
+# Particle, climate and gas sampling intervals are set by config.json's sampling_schedule and adapt to changing readings
+# and air quality levels when enable_adaptive_sampling is set. Particle sampling uses the PMS5003 reader thread's latest
+# frames, so it runs on the event loop
+sampling_scheduler = SamplingScheduler(sampling_schedule, enable_adaptive_sampling, fast_sampling_aqi_level)
+sampling_task_names = {"Particle": 'Particle Sensor', "Climate and Gas": 'Climate and Gas Sensors'}
+display_update_interval = 0.5 # Time between display updates
+display_inputs = {} # The display thread's copies of the own and outdoor readings and display history
+metrics_snapshot_interval = 5 # Time between metrics exporter snapshots of the readings
+display_wifi_check_interval = 10 # Time between Wi-Fi checks for the Status display
+display_wifi_check_time = 0
+display_wifi_connected = False
+housekeeping_interval = 1 # Time between checks for barometer logs, external updates, comms failures and gas calibrations
+time_series_sample_interval = 10 # Time between readings recorded in the time series store
+time_series_retention_interval = 3600 # Time between removals of expired time series records
+environment_log_flush_check_interval = 60 # Time between checks for buffered climate and gas log records that are due to be written
+time_series_store = None # Opened by start_monitor
+
+def read_pm_task():
+    return read_pm_values(luft_values, mqtt_values, own_data, own_disp_values)
+
+def pm_values_read(new_sample):
+    if new_sample:
+        update_rolling_stats(["P1", "P2.5", "P10"])
+        observe_sample("Particle", ["P1", "P2.5", "P10"])
+
+def current_readings(readings):
+    # Gas readings aren't meaningful until the gas sensors are warm
+    return {reading: own_data[reading][1] for reading in readings if gas_sensors_warm or reading not in ["Red", "Oxi", "NH3"]}
+
+def standard_aqi_values(now):
+    # Standard indices from the rolling mean particle readings. Returns {index name: [index, dominant pollutant]}
+    # A pollutant's mean is only used once its window has enough readings, so an index isn't given until then
+    values = {}
+    for name in standard_aqis:
+        means = {}
+        for pollutant in standard_aqis[name].pollutants:
+            stats = rolling_stats.stats(pollutant, standard_aqi_windows[name], now)
+            means[pollutant] = None if stats is None or stats["Coverage"] < standard_aqi_min_coverage else stats["Mean"]
+        index = standard_aqis[name].sample(means)
+        if index is not None:
+            values[name] = index
+    return values
+
+def update_rolling_stats(readings):
+    rolling_stats.update(current_readings(readings), time.time())
+
+def observe_sample(sensor, readings):
+    # Adapts the sensor's sampling interval to its latest readings and brings forward the next samples of sensors whose
+    # intervals have been shortened by a high air quality level
+    aqi_level = max_aqi_level_factor(gas_sensors_warm, air_quality_data, air_quality_data_no_gas, own_data)[1]
+    for other_sensor in sampling_scheduler.observe(sensor, current_readings(readings), aqi_level):
+        runtime.run_now(sampling_task_names[other_sensor])
+
+def read_climate_task():
+    return read_climate_gas_sensors()
+
+def climate_values_read(sensor_readings):
+    # Apply the climate and gas sensor readings, write to the watchdog file and send to Luftdaten every 2.5 minutes (set by short_update_delay).
+    global short_update_time, first_climate_reading_done, maxi_temp, mini_temp, raw_red_rs, raw_oxi_rs, raw_nh3_rs, luftdaten_queued_time
+    global raw_temp, comp_temp, comp_hum, raw_hum, use_external_temp_hum, use_external_barometer, raw_barometer
+    (_, _, _, _, raw_red_rs, raw_oxi_rs, raw_nh3_rs, raw_temp, comp_temp, comp_hum, raw_hum,
+     use_external_temp_hum, use_external_barometer, raw_barometer) = read_climate_gas_values(luft_values, mqtt_values, own_data, own_disp_values,
+                                                                                            gas_sensors_warm, gas_calib_temp, gas_calib_hum,
+                                                                                            gas_calib_bar, altitude, sensor_readings)
+    short_update_time = time.time()
+    if first_climate_reading_done: # The first climate reading isn't included in the rolling statistics
+        update_rolling_stats(["Temp", "Hum", "Bar", "Oxi", "Red", "NH3", "Lux"])
+        # The displayed and published temperature range is the rolling 24 hour minimum and maximum
+        temp_range = rolling_stats.stats("Temp", temp_range_window, short_update_time)
+        if temp_range is not None:
+            mini_temp, maxi_temp = temp_range["Min"], temp_range["Max"]
+    mqtt_values["Min Temp"] = mini_temp
+    mqtt_values["Max Temp"] = maxi_temp
+    mqtt_values["Hourly Means"] = rolling_stats.means(mean_window, short_update_time)
+    for name in standard_aqis: # An index is left out until its window has enough readings
+        mqtt_values.pop(name, None)
+    mqtt_values.update(standard_aqi_values(short_update_time))
+    first_climate_reading_done = True
+    print('Luftdaten Values', luft_values)
+    print('mqtt Values', mqtt_values)
+    # Write to the watchdog file unless there is a comms failure for >= comms_failure_tolerance when both Luftdaten and Adafruit IO are enabled
+    # and the Wi-Fi connection has also been lost. Readings are kept in the outbox during an outage, so a reboot is only used to recover Wi-Fi
+    if comms_failure == False or check_wifi():
+        runtime.submit('Watchdog', write_watchdog_file, 'storage')
+    # Send data to Luftdaten if enabled. Updates aren't sent more often while climate and gas sampling is fast (5 seconds allows for sampling jitter)
+    if enable_luftdaten and short_update_time - luftdaten_queued_time >= short_update_delay - 5:
+        luftdaten_queued_time = short_update_time
+        outbox.put('Luftdaten', luft_values)
+        runtime.submit('Luftdaten Outbox', drain_luftdaten_outbox, 'network', luftdaten_sent)
+    else:
+        print('Waiting for next capture cycle')
+    observe_sample("Climate and Gas", ["Temp", "Hum", "Bar", "Oxi", "Red", "NH3"])
+
+def record_time_series_task():
+    # Snapshot the readings on the event loop, then append them to the time series store on the storage thread
+    if first_climate_reading_done:
+        readings = {reading: own_data[reading][1] for reading in own_data}
+        timestamp = time.time()
+        runtime.submit('Time Series Append', lambda: time_series_store.append(readings, timestamp), 'storage')
+
+def send_within_upload_budget(send, *args):
+    with http_transport.cycle(upload_time_budget), metrics.timer('enviro_upload_seconds', {'function': send.__name__}), profiler.span('HTTP ' + send.__name__):
+        return send(*args)
+
+def metrics_snapshot_task():
+    # Snapshot the readings and calibration state on the event loop, so that metrics scrapes never touch the sensors
+    max_aqi = max_aqi_level_factor(gas_sensors_warm, air_quality_data, air_quality_data_no_gas, own_data)
+    gauges = {"enviro_gas_sensors_warm": [({}, int(gas_sensors_warm))],
+              "enviro_gas_r0_ohms": [({"sensor": "Red"}, red_r0), ({"sensor": "Oxi"}, oxi_r0), ({"sensor": "NH3"}, nh3_r0)],
+              "enviro_gas_calibration_baseline": [({"reading": "Temp"}, gas_calib_temp), ({"reading": "Hum"}, gas_calib_hum),
+                                                  ({"reading": "Bar"}, gas_calib_bar)],
+              "enviro_comms_failure": [({}, int(comms_failure))],
+              "enviro_uptime_seconds": [({}, round(time.time() - start_time, 0))]}
+    if first_climate_reading_done: # Readings are defaults until the first climate reading
+        gauges["enviro_reading"] = [({"reading": reading, "unit": own_data[reading][0]}, own_data[reading][1]) for reading in own_data]
+        gauges["enviro_air_quality_level"] = [({"factor": max_aqi[0]}, max_aqi[1])]
+        gauges["enviro_reading_window"] = []
+        for reading in own_data:
+            for window in rolling_stats.windows:
+                stats = rolling_stats.stats(reading, window, time.time())
+                if stats is not None:
+                    gauges["enviro_reading_window"].extend(({"reading": reading, "window": window, "stat": stat}, stats[stat])
+                                                           for stat in ["Min", "Max", "Mean", "Std"])
+        standard_aqi = standard_aqi_values(time.time())
+        gauges["enviro_standard_aqi"] = [({"index": name, "pollutant": standard_aqi[name][1]}, standard_aqi[name][0]) for name in standard_aqi]
+    intervals = sampling_scheduler.intervals()
+    gauges["enviro_sampling_interval_seconds"] = [({"sensor": sensor}, intervals[sensor]) for sensor in intervals]
+    metrics.set_gauges(gauges)
+
+def write_watchdog_file():
+    with open('<Your Watchdog File Name Here>', 'w') as f:
+        f.write('Enviro Script Alive')
+
+def drain_luftdaten_outbox():
+    # Luftdaten doesn't accept capture times, so readings that are too old to be sent as current readings are discarded
+    return outbox.drain('Luftdaten', lambda luft_values_to_send, created_at: send_within_upload_budget(send_to_luftdaten, luft_values_to_send, id, enable_particle_sensor),
+                        max_items=2, max_age=luftdaten_outbox_max_age)
+
+def drain_aio_outbox():
+    return outbox.drain('Adafruit IO', lambda feed_values, created_at: send_within_upload_budget(send_data_to_aio, feed_values, created_at),
+                        max_items=aio_outbox_batches_per_drain, max_age=aio_outbox_max_age)
+
+def encode_mqtt_values(mqtt_values):
+    if mqtt_delta_encoder is None:
+        return json.dumps(mqtt_values)
+    return mqtt_delta_encoder.encode(mqtt_values)
+
+def drain_mqtt_outbox():
+    return outbox.drain('mqtt', publish_mqtt_message, max_items=10, max_age=mqtt_outbox_max_age)
+
+def publish_mqtt_message(mqtt_message, created_at):
+    if not client.is_connected():
+        return False
+    published = client.publish(mqtt_message["Topic"], mqtt_message["Payload"]).rc == mqtt.MQTT_ERR_SUCCESS
+    metrics.inc('enviro_uploads_total', {'service': 'mqtt', 'result': 'success' if published else 'failure'})
+    return published
+
+def luftdaten_sent(resp):
+    global luft_resp
+    if resp is None: # Nothing sent, because the outbox is empty or backing off after a failed send
+        return
+    luft_resp = resp
+    metrics.inc('enviro_uploads_total', {'service': 'Luftdaten', 'result': 'success' if luft_resp else 'failure'})
+    #logging.info("Luftdaten Response: {}\n".format("ok" if luft_resp else "failed"))
+    if luft_resp:
+        print("Luftdaten update successful. Waiting for next capture cycle")
+    else:
+        print("Luftdaten update unsuccessful. Waiting for next capture cycle")
+
+def copy_display_inputs(name, data, disp_values):
+    # The display thread's copies are updated in place, so that the AQI engine and render cache see the same dicts on every frame
+    if name not in display_inputs:
+        display_inputs[name] = (copy.deepcopy(data), {v: DisplayRingBuffer(disp_history_length) for v in disp_values})
+    data_copy, disp_values_copy = display_inputs[name]
+    for v in data:
+        data_copy[v][1] = data[v][1]
+    for v in disp_values:
+        disp_values_copy[v].copy_from(disp_values[v])
+    return data_copy, disp_values_copy
+
+def update_display_task():
+    # Frames are rendered on the display thread from copies of the readings and display history that are taken here on the
+    # event loop, so that they can't change while a frame is being rendered. The copies aren't touched while a frame is in flight
+    if runtime.running('Display Render'):
+        return
+    display_own_data, display_own_disp_values = copy_display_inputs('Own', own_data, own_disp_values)
+    display_outdoor_data, display_outdoor_disp_values = copy_display_inputs('Outdoor', outdoor_data, outdoor_disp_values)
+    display_values = (start_current_display, current_display_is_own, display_modes, indoor_outdoor_display_duration, display_own_data,
+                      data_in_display_all_aq, display_outdoor_data, outdoor_reading_captured, display_own_disp_values, display_outdoor_disp_values,
+                      delay, last_page, mode, copy.deepcopy(luft_values), copy.deepcopy(mqtt_values), WIDTH, valid_barometer_history, forecast,
+                      barometer_available_time, barometer_change, barometer_trend, icon_forecast, maxi_temp, mini_temp,
+                      air_quality_data, air_quality_data_no_gas, gas_sensors_warm, outdoor_gas_sensors_warm, enable_display, palette)
+    runtime.submit('Display Render', lambda: display_results(*display_values), 'display', display_updated)
+
+def display_updated(display_state):
+    global last_page, mode, start_current_display, current_display_is_own
+    last_page, mode, start_current_display, current_display_is_own = display_state
+
+def log_barometer_task():
+    # Read and update the barometer log if the first climate reading has been done and the last update was >= 20 minutes ago
+    global barometer_available_time, barometer_history, barometer_change, valid_barometer_history, barometer_log_time, forecast
+    global barometer_trend, icon_forecast, domoticz_forecast, aio_forecast
+    if first_climate_reading_done and (time.time() - barometer_log_time) >= 1200:
+        if barometer_log_time == 0: # If this is the first barometer log, record the time that a forecast will be available (3 hours)
+            barometer_available_time = time.time() + 10800
+        barometer_history, barometer_change, valid_barometer_history, barometer_log_time, forecast, barometer_trend, icon_forecast, domoticz_forecast, aio_forecast = log_barometer(own_data['Bar'][1], barometer_history)
+        mqtt_values["Forecast"] = {"Valid": valid_barometer_history, "3 Hour Change": round(barometer_change, 1), "Forecast": forecast.replace("\n", " ")}
+        mqtt_values["Bar"][1] = domoticz_forecast # Add Domoticz Weather Forecast
+        print('Barometer Logged. Waiting for next capture cycle')
+
+def external_updates_task():
+    # Provide external updates and update persistent data log
+    global previous_aio_update_minute, long_update_time, previous_aio_air_quality_level, previous_aio_air_quality_text
+    global previous_aio_forecast_text, previous_aio_forecast
+    run_time = round((time.time() - start_time), 0)
+    if run_time <= startup_stabilisation_time: # Wait until the gas sensors have stabilised before providing external updates or updating the persistent data log
+        return
+    # Send data to Adafruit IO if enabled, set up and the time is now within the configured window and sequence
+    if enable_adafruit_io and aio_format != {}:
         today=datetime.now()
-        if int(today.strftime('%H')) == gas_daily_r0_calibration_hour and gas_daily_r0_calibration_completed == False and gas_sensors_warm and first_climate_reading_done:
-            print("Daily Gas Sensor Calibration. Old R0s. Red R0:", red_r0, "Oxi R0:", oxi_r0, "NH3 R0:", nh3_r0)
-            print("Old Calibration Baseline. Temp:", round(gas_calib_temp, 1), "Hum:", round(gas_calib_hum, 0), "Barometer:", round(gas_calib_bar, 1)) 
-            # Set new calibration baseline using 7 day rolling average
-            gas_calib_temps = gas_calib_temps[1:] + [raw_temp]
-            #print("Calib Temps", gas_calib_temps)
-            gas_calib_temp = round(sum(gas_calib_temps)/float(len(gas_calib_temps)), 1)
-            gas_calib_hums = gas_calib_hums[1:] + [raw_hum]
-            #print("Calib Hums", gas_calib_hums)
-            gas_calib_hum = round(sum(gas_calib_hums)/float(len(gas_calib_hums)), 0)
-            gas_calib_bars = gas_calib_bars[1:] + [raw_barometer]
-            #print("Calib Bars", gas_calib_bars)
-            gas_calib_bar = round(sum(gas_calib_bars)/float(len(gas_calib_bars)), 1)
-            # Update R0s based on new calibration baseline
-            spot_red_r0, spot_oxi_r0, spot_nh3_r0, raw_red_r0, raw_oxi_r0, raw_nh3_r0 = comp_gas(gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_hum, raw_barometer)
-            # Convert R0s to 7 day rolling average
-            reds_r0 = reds_r0[1:] + [spot_red_r0]
-            #print("Reds R0", reds_r0)
-            red_r0 = round(sum(reds_r0)/float(len(reds_r0)), 0)
-            oxis_r0 = oxis_r0[1:] + [spot_oxi_r0]
-            ##print("Oxis R0", oxis_r0)
-            oxi_r0 = round(sum(oxis_r0)/float(len(oxis_r0)), 0)
-            nh3s_r0 = nh3s_r0[1:] + [spot_nh3_r0]
-            #print("NH3s R0", nh3s_r0)
-            nh3_r0 = round(sum(nh3s_r0)/float(len(nh3s_r0)), 0)
-            print('New R0s with compensation. Red R0:', red_r0, 'Oxi R0:', oxi_r0, 'NH3 R0:', nh3_r0)
-            print("New Calibration Baseline. Temp:", round(gas_calib_temp, 1), "Hum:", round(gas_calib_hum, 0), "Barometer:", round(gas_calib_bar, 1))
-            gas_daily_r0_calibration_completed = True
-        if int(today.strftime('%H')) == (gas_daily_r0_calibration_hour + 1) and gas_daily_r0_calibration_completed:
-            gas_daily_r0_calibration_completed = False
-
-        # Only add a delay in the loop if no Luftdaten or Adafruit IO data has been sent
-        if data_sent_to_luftdaten_or_aio == False:
-            time.sleep(0.5)
+        window_minute = int(today.strftime('%M'))
+        window_second = int(today.strftime('%S'))
+        if window_minute % 10 == aio_feed_window and window_second // 15 == aio_feed_sequence and window_minute != previous_aio_update_minute:
+            previous_aio_update_minute = window_minute
+            previous_aio_air_quality_level, previous_aio_air_quality_text, previous_aio_forecast_text, previous_aio_forecast, aio_feed_values = update_aio(mqtt_values, forecast, aio_format, aio_forecast_text_format,
+                                                                                                                                                      aio_forecast_icon_format, aio_air_quality_level_format,
+                                                                                                                                                      aio_air_quality_text_format, own_data, icon_air_quality_levels,
+                                                                                                                                                      aio_forecast, aio_package, gas_sensors_warm, air_quality_data,
+                                                                                                                                                      air_quality_data_no_gas, previous_aio_air_quality_level,
+                                                                                                                                                      previous_aio_air_quality_text, previous_aio_forecast_text,
+                                                                                                                                                      previous_aio_forecast)
+            if aio_feed_values != []:
+                outbox.put('Adafruit IO', aio_feed_values)
+                runtime.submit('Adafruit IO Outbox', drain_aio_outbox, 'network', aio_batch_sent)
+    time_since_long_update = time.time() - long_update_time
+    # Provide other external updates and update persistent data log every 5 minutes (Set by long_update_delay)
+    if time_since_long_update >= long_update_delay:
+        long_update_time = time.time()
+        if (indoor_outdoor_function == 'Indoor' and enable_send_data_to_homemanager):
+            outbox.put('mqtt', {"Topic": indoor_mqtt_topic, "Payload": encode_mqtt_values(mqtt_values)})
+            runtime.submit('mqtt Outbox', drain_mqtt_outbox, 'network')
+        elif (indoor_outdoor_function == 'Outdoor' and (enable_indoor_outdoor_functionality or enable_send_data_to_homemanager)):
+            outbox.put('mqtt', {"Topic": outdoor_mqtt_topic, "Payload": encode_mqtt_values(mqtt_values)})
+            runtime.submit('mqtt Outbox', drain_mqtt_outbox, 'network')
         else:
-            data_sent_to_luftdaten_or_aio = False # Reset data_sent_to_luftdaten_or_aio flag until Luftdaten or Adafruit IO data has been sent again
-            
-except KeyboardInterrupt:
-    if enable_send_data_to_homemanager or enable_receive_data_from_homemanager:
+            pass
+        if enable_climate_and_gas_logging and first_climate_reading_done:
+            environment_log_values = (run_time, copy.deepcopy(own_data), raw_red_rs, raw_oxi_rs, raw_nh3_rs, raw_temp, comp_temp, comp_hum, raw_hum,
+                                      use_external_temp_hum, use_external_barometer, raw_barometer)
+            runtime.submit('Environment Log', lambda: log_climate_and_gas(*environment_log_values), 'storage')
+        # Write to the persistent data log
+        persistent_data_log = build_persistent_data_log()
+        print('Logging Barometer, Forecast, Gas Calibration and Display Data')
+        runtime.submit('Persistent Data Log', lambda encoded_sections=persistent_snapshot.encode(persistent_data_log): write_persistent_data_log(encoded_sections), 'storage')
+        if enable_compensation_calibration:
+            runtime.submit('Compensation Calibration Save', lambda: save_calibration_state(compensation_calibration_file, compensation_calibrators), 'storage')
+        if "Forecast" in mqtt_values:
+            mqtt_values.pop("Forecast") # Remove Forecast after sending it to home manager so that forecast data is only sent when updated
+        if enable_luftdaten or enable_adafruit_io:
+            http_transport.print_stats()
+        if outbox is not None:
+            outbox.print_stats()
+        if enable_send_data_to_homemanager or enable_receive_data_from_homemanager or enable_indoor_outdoor_functionality:
+            mqtt_dispatcher.print_stats()
+        if mqtt_delta_encoder is not None:
+            mqtt_delta_encoder.print_stats()
+        if enable_indoor_outdoor_functionality and indoor_outdoor_function == 'Indoor':
+            outdoor_delta_decoder.print_stats()
+        asset_cache.print_stats()
+        profiler.print_summary()
+        sampling_scheduler.print_stats()
+        if pm_reader is not None:
+            pm_reader.print_stats()
+        rolling_stats.print_stats(time.time())
+        aqi_engine(own_data).print_stats()
+        print_render_stats(render_cache, disp)
+        if time_series_store is not None:
+            time_series_store.print_stats()
+        if environment_log is not None:
+            environment_log.print_stats()
+        print('Waiting for next capture cycle')
+
+def build_persistent_data_log():
+    # Fast-changing scalars, the barometer history, gas calibration lists and display history are separate snapshot sections
+    return {"Scalars": {"Update Time": long_update_time, "Barometer Log Time": barometer_log_time, "Forecast": forecast,
+                       "Barometer Available Time": barometer_available_time, "Valid Barometer History": valid_barometer_history,
+                       "Barometer Change": barometer_change, "Barometer Trend": barometer_trend, "Icon Forecast": icon_forecast,
+                       "Domoticz Forecast": domoticz_forecast, "AIO Forecast": aio_forecast, "Gas Sensors Warm": gas_sensors_warm,
+                       "Gas Temp": gas_calib_temp, "Gas Hum": gas_calib_hum, "Gas Bar": gas_calib_bar, "Red R0": red_r0,
+                       "Oxi R0": oxi_r0, "NH3 R0": nh3_r0, "Maxi Temp": maxi_temp, "Mini Temp": mini_temp, "Last Page": last_page, "Mode": mode},
+           "Barometer History": {"Barometer History": barometer_history},
+           "Gas Calibration": {"Red R0 List": reds_r0, "Oxi R0 List": oxis_r0, "NH3 R0 List": nh3s_r0, "Gas Calib Temp List": gas_calib_temps,
+                               "Gas Calib Hum List": gas_calib_hums, "Gas Calib Bar List": gas_calib_bars},
+           "Display History": {"Own Disp Values": serialize_disp_values(own_disp_values),
+                               "Outdoor Disp Values": serialize_disp_values(outdoor_disp_values)},
+           "Rolling Stats": {"Rolling Stats": rolling_stats.serialize()}}
+
+def write_persistent_data_log(encoded_sections):
+    persistent_snapshot.write(encoded_sections)
+    persistent_snapshot.print_stats()
+
+def aio_batch_sent(resp):
+    global aio_resp
+    if resp is None: # Nothing sent, because the outbox is empty or backing off after a failed send
+        return
+    aio_resp = resp
+    metrics.inc('enviro_uploads_total', {'service': 'Adafruit IO', 'result': 'success' if aio_resp else 'failure'})
+    if aio_resp:
+        print("Adafruit IO feed batch successful. Waiting for next capture cycle")
+    else:
+        print("Adafruit IO feed batch unsuccessful. Waiting for next capture cycle")
+
+def housekeeping_task():
+    global successful_comms_time, comms_failure, outdoor_reading_captured, gas_calib_temp, gas_calib_hum, gas_calib_bar
+    global gas_calib_temps, gas_calib_hums, gas_calib_bars, gas_daily_r0_calibration_completed
+    # Luftdaten and Adafruit IO Communications Check
+    if aio_resp or luft_resp: # Set time when a successful Luftdaten or Adafruit IO response is received, or if either Luftdaten or Adafruit IO is disabled
+        successful_comms_time = time.time()
+    comms_lost = time.time() - successful_comms_time >= comms_failure_tolerance
+    if comms_lost and comms_failure == False:
+        print("Both Lufdaten and Adafruit IO communications have been lost for more than " + str(int(comms_failure_tolerance/60)) + " minutes. System will reboot via watchdog if Wi-Fi is also lost")
+    elif comms_failure and not comms_lost:
+        print("Lufdaten or Adafruit IO communications restored")
+    comms_failure = comms_lost
+    # Outdoor Sensor Comms Check
+    if time.time() - outdoor_reading_captured_time > long_update_delay * 2:
+        outdoor_reading_captured = False # Reset outdoor reading captured flag if comms with the outdoor sensor is lost so that old outdoor data is not displayed
+    # Calibrate gas sensors after warmup
+    if ((time.time() - start_time) > gas_sensors_warmup_time) and gas_sensors_warm == False and first_climate_reading_done:
+        runtime.submit('Gas Warmup Calibration', read_raw_gas, 'sensors', gas_warmup_calibrated)
+    # Calibrate gas sensors daily at time set by gas_daily_r0_calibration_hour,
+    # using average of daily readings over a week if not already done in the current day and if warmup calibration is completed
+    # Compensates for gas sensor drift over time
+    today=datetime.now()
+    if int(today.strftime('%H')) == gas_daily_r0_calibration_hour and gas_daily_r0_calibration_completed == False and gas_sensors_warm and first_climate_reading_done:
+        print("Daily Gas Sensor Calibration. Old R0s. Red R0:", red_r0, "Oxi R0:", oxi_r0, "NH3 R0:", nh3_r0)
+        print("Old Calibration Baseline. Temp:", round(gas_calib_temp, 1), "Hum:", round(gas_calib_hum, 0), "Barometer:", round(gas_calib_bar, 1))
+        # Set new calibration baseline using 7 day rolling average
+        gas_calib_temps = gas_calib_temps[1:] + [raw_temp]
+        #print("Calib Temps", gas_calib_temps)
+        gas_calib_temp = round(sum(gas_calib_temps)/float(len(gas_calib_temps)), 1)
+        gas_calib_hums = gas_calib_hums[1:] + [raw_hum]
+        #print("Calib Hums", gas_calib_hums)
+        gas_calib_hum = round(sum(gas_calib_hums)/float(len(gas_calib_hums)), 0)
+        gas_calib_bars = gas_calib_bars[1:] + [raw_barometer]
+        #print("Calib Bars", gas_calib_bars)
+        gas_calib_bar = round(sum(gas_calib_bars)/float(len(gas_calib_bars)), 1)
+        # Update R0s based on new calibration baseline
+        calibration_values = (gas_calib_temp, gas_calib_hum, gas_calib_bar, raw_temp, raw_hum, raw_barometer)
+        runtime.submit('Gas Daily Calibration', lambda: comp_gas(*calibration_values), 'sensors', gas_daily_calibrated)
+        gas_daily_r0_calibration_completed = True
+    if int(today.strftime('%H')) == (gas_daily_r0_calibration_hour + 1) and gas_daily_r0_calibration_completed:
+        gas_daily_r0_calibration_completed = False
+
+def gas_warmup_calibrated(gas_r0s):
+    global gas_calib_temp, gas_calib_hum, gas_calib_bar, red_r0, oxi_r0, nh3_r0, reds_r0, oxis_r0, nh3s_r0
+    global gas_calib_temps, gas_calib_hums, gas_calib_bars, gas_sensors_warm
+    gas_calib_temp = raw_temp
+    gas_calib_hum = raw_hum
+    gas_calib_bar = raw_barometer
+    red_r0, oxi_r0, nh3_r0 = gas_r0s
+    print("Gas Sensor Calibration after Warmup. Red R0:", red_r0, "Oxi R0:", oxi_r0, "NH3 R0:", nh3_r0)
+    print("Gas Calibration Baseline. Temp:", round(gas_calib_temp, 1), "Hum:", round(gas_calib_hum, 0), "Barometer:", round(gas_calib_bar, 1))
+    reds_r0 = [red_r0] * 7
+    oxis_r0 = [oxi_r0] * 7
+    nh3s_r0 = [nh3_r0] * 7
+    gas_calib_temps = [gas_calib_temp] * 7
+    gas_calib_hums = [gas_calib_hum] * 7
+    gas_calib_bars = [gas_calib_bar] * 7
+    gas_sensors_warm = True
+
+def gas_daily_calibrated(comp_gas_values):
+    global red_r0, oxi_r0, nh3_r0, reds_r0, oxis_r0, nh3s_r0
+    spot_red_r0, spot_oxi_r0, spot_nh3_r0, raw_red_r0, raw_oxi_r0, raw_nh3_r0 = comp_gas_values
+    # Convert R0s to 7 day rolling average
+    reds_r0 = reds_r0[1:] + [spot_red_r0]
+    #print("Reds R0", reds_r0)
+    red_r0 = round(sum(reds_r0)/float(len(reds_r0)), 0)
+    oxis_r0 = oxis_r0[1:] + [spot_oxi_r0]
+    ##print("Oxis R0", oxis_r0)
+    oxi_r0 = round(sum(oxis_r0)/float(len(oxis_r0)), 0)
+    nh3s_r0 = nh3s_r0[1:] + [spot_nh3_r0]
+    #print("NH3s R0", nh3s_r0)
+    nh3_r0 = round(sum(nh3s_r0)/float(len(nh3s_r0)), 0)
+    print('New R0s with compensation. Red R0:', red_r0, 'Oxi R0:', oxi_r0, 'NH3 R0:', nh3_r0)
+    print("New Calibration Baseline. Temp:", round(gas_calib_temp, 1), "Hum:", round(gas_calib_hum, 0), "Barometer:", round(gas_calib_bar, 1))
+
+def start_monitor():
+    # Opens the monitor's files, databases and connections, starts its threads and adds the runtime tasks. It's only called
+    # when the monitor is run as a script, so that importing the monitor (e.g. by the benchmarks) has no side effects
+    global outbox, environment_log, client, time_series_store
+    profiler.install_signal_handler() # Timing summary on kill -USR1 <pid>
+    signal.signal(signal.SIGTERM, lambda received_signal, frame: runtime.stop()) # e.g. systemctl stop or a reboot. Runs stop_monitor
+    logging.info("Raspberry Pi serial: {}".format(get_serial_number()))
+    logging.info("Wi-Fi: {}\n".format("connected" if check_wifi() else "disconnected"))
+    if enable_luftdaten or enable_adafruit_io or mqtt_publishing_enabled:
+        outbox = TelemetryOutbox('<Your Outbox Database File Name Here>')
+    if enable_climate_and_gas_logging:
+        environment_log = EnvironmentLogWriter('<Your environment log file location>', log_format='jsonl', flush_every=environment_log_flush_records,
+                                               flush_interval=environment_log_flush_seconds, fsync=environment_log_fsync,
+                                               max_bytes=5000000, backup_count=5)
+    if enable_time_series_store:
+        time_series_store = TimeSeriesStore('<Your Time Series Directory Here>')
+    if enable_compensation_calibration:
+        load_calibration_state(compensation_calibration_file, compensation_calibrators)
+    restore_persistent_data_log()
+    if pm_reader is not None:
+        pm_reader.start()
+    if enable_send_data_to_homemanager or enable_receive_data_from_homemanager or enable_indoor_outdoor_functionality:
+        client = mqtt.Client(mqtt_client_name)
+        client.on_connect = on_connect
+        client.on_message = mqtt_dispatcher.on_message
+        client.connect(mqtt_broker_name, 1883, 60)
+        client.loop_start()
+    runtime.add_periodic_task(sampling_task_names["Particle"], sampling_scheduler["Particle"].interval, read_pm_task,
+                              on_result=pm_values_read)
+    runtime.add_periodic_task(sampling_task_names["Climate and Gas"], sampling_scheduler["Climate and Gas"].interval, read_climate_task,
+                              executor='sensors', on_result=climate_values_read,
+                              first_delay=max(0, sampling_scheduler["Climate and Gas"].base_interval - (time.time() - short_update_time)))
+    runtime.add_periodic_task('Barometer Log', housekeeping_interval, log_barometer_task)
+    runtime.add_periodic_task('Display', display_update_interval, update_display_task)
+    runtime.add_periodic_task('External Updates', housekeeping_interval, external_updates_task)
+    runtime.add_periodic_task('Housekeeping', housekeeping_interval, housekeeping_task)
+    if time_series_store is not None:
+        runtime.add_periodic_task('Time Series', time_series_sample_interval, record_time_series_task)
+        runtime.add_periodic_task('Time Series Retention', time_series_retention_interval, time_series_store.apply_retention, executor='storage')
+    if environment_log is not None and environment_log.flush_every > 1: # Buffered records are written on time, even if logging pauses
+        runtime.add_periodic_task('Environment Log Flush', environment_log_flush_check_interval, environment_log.flush_expired, executor='storage')
+    # Outbox backlogs are retried at a bounded rate. New payloads are also sent as soon as they're queued
+    if enable_luftdaten:
+        runtime.add_periodic_task('Luftdaten Outbox', outbox_drain_interval, drain_luftdaten_outbox, executor='network', on_result=luftdaten_sent)
+    if enable_adafruit_io and aio_format != {}:
+        runtime.add_periodic_task('Adafruit IO Outbox', outbox_drain_interval, drain_aio_outbox, executor='network', on_result=aio_batch_sent)
+    if enable_metrics_exporter:
+        runtime.add_periodic_task('Metrics Snapshot', metrics_snapshot_interval, metrics_snapshot_task)
+        metrics_server = MetricsServer(metrics, metrics_exporter_port)
+        metrics_server.start()
+    if enable_send_data_to_homemanager or enable_receive_data_from_homemanager or enable_indoor_outdoor_functionality:
+        runtime.add_periodic_task('mqtt Dispatch', mqtt_dispatch_interval, mqtt_dispatcher.dispatch)
+    if mqtt_publishing_enabled:
+        runtime.add_periodic_task('mqtt Outbox', outbox_drain_interval, drain_mqtt_outbox, executor='network')
+
+def stop_monitor():
+    # Stops the monitor's threads and connections and writes its buffered data, after a keyboard interrupt or SIGTERM
+    if client is not None:
         client.loop_stop()
-    print('Keyboard Interrupt')
+    runtime.print_stats()
+    profiler.print_summary()
+    sampling_scheduler.print_stats()
+    if pm_reader is not None:
+        pm_reader.stop()
+        pm_reader.print_stats()
+    http_transport.print_stats()
+    if time_series_store is not None:
+        time_series_store.close()
+    if environment_log is not None:
+        environment_log.close() # Writes the buffered log records
+
+if __name__ == '__main__': # Only start the monitor when run as a script, so that the monitor's functions can be imported
+    start_monitor()
+    try:
+        runtime.run()
+        print('Monitor Stopped')
+    except KeyboardInterrupt:
+        print('Keyboard Interrupt')
+    stop_monitor()
 
 # Acknowledgements
 # Based on code from:
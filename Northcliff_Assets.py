@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Display Asset Cache - Gen
+# Decodes the display icons once at startup and memoises text metrics, so that rendering a frame doesn't read or
+# decode any files and doesn't re-measure strings that have already been measured.
+
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw
+
+
+class AssetCache(object):
+    def __init__(self, icon_directory, mode='RGBA', max_text_metrics=512):
+        self.mode = mode
+        self.max_text_metrics = max_text_metrics # LRU limit for each font's text metrics
+        self.icons = {}
+        self.text_metrics = {} # OrderedDict of text metrics for each font
+        self.lock = threading.Lock() # Text may be measured from more than one thread
+        self.hits = 0
+        self.misses = 0
+        self.measure_draw = ImageDraw.Draw(Image.new(mode, (1, 1))) # Text metrics don't depend on the image being drawn on
+        self.load_icons(icon_directory)
+
+    def load_icons(self, icon_directory):
+        """Decodes every PNG in icon_directory, converted to the display mode and keyed by its name without the extension."""
+        for file_name in sorted(os.listdir(icon_directory)):
+            name, extension = os.path.splitext(file_name)
+            if extension.lower() == '.png':
+                with Image.open(os.path.join(icon_directory, file_name)) as icon:
+                    self.icons[name] = icon.convert(self.mode)
+
+    def icon(self, name):
+        return self.icons[name]
+
+    def _metric(self, font, text, kind, measure):
+        with self.lock: # Misses are also measured under the lock, because the measuring ImageDraw is shared
+            metrics = self.text_metrics.get(font)
+            if metrics is None:
+                metrics = self.text_metrics[font] = OrderedDict()
+            key = (kind, text)
+            size = metrics.get(key)
+            if size is not None:
+                metrics.move_to_end(key)
+                self.hits += 1
+                return size
+            self.misses += 1
+            size = measure()
+            metrics[key] = size
+            if len(metrics) > self.max_text_metrics:
+                metrics.popitem(last=False)
+            return size
+
+    def text_size(self, text, font):
+        """Width and height of text (which may be multi-line) drawn with ImageDraw."""
+        return self._metric(font, text, 'Text', lambda: self._measure_text(text, font))
+
+    def font_size(self, font, text):
+        """Width and height of a single line of text from the font's own metrics."""
+        return self._metric(font, text, 'Font', lambda: self._measure_font(font, text))
+
+    def _measure_text(self, text, font):
+        # Pillow 10 removed textsize and getsize, so fall back to the bounding box methods when they're not available
+        if hasattr(self.measure_draw, 'textsize'):
+            return self.measure_draw.textsize(text, font)
+        left, top, right, bottom = self.measure_draw.multiline_textbbox((0, 0), text, font=font)
+        return right, bottom
+
+    def _measure_font(self, font, text):
+        if hasattr(font, 'getsize'):
+            return font.getsize(text)
+        left, top, right, bottom = font.getbbox(text)
+        return right, bottom
+
+    def print_stats(self):
+        print('Asset Cache Icons:', len(self.icons), 'Text Metric Hits:', self.hits, 'Misses:', self.misses)
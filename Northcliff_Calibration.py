@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Online Compensation Calibration - Gen
+# Refines the temperature and humidity compensation polynomials with recursive least squares (RLS) while external reference
+# sensors are available. Each reference reading is an O(1) update of a fixed-size state, so calibration continues on the
+# device without exporting logs. Guard rails reject implausible readings and any update that moves the compensation too far
+# from the factory polynomial, and the state is saved so that calibration survives restarts.
+
+import json
+import os
+import threading
+
+import numpy
+
+
+class RLSCalibrator(object):
+    """Online fit of y = polynomial(x), starting from the factory coefficients (highest power first).
+       The fit is done in a centred and scaled variable u = (x - centre) / scale, which keeps the cubic's normal equations well conditioned."""
+    def __init__(self, name, factory_coefficients, centre, scale, x_range, y_range, forgetting_factor=0.9995, initial_variance=0.01,
+                 max_residual=5, max_adjustment=3, min_samples=50):
+        self.name = name
+        self.factory_coefficients = numpy.array(factory_coefficients, dtype=float)
+        self.degree = len(factory_coefficients) - 1
+        self.centre = centre
+        self.scale = scale
+        self.x_range = x_range # Plausible raw readings
+        self.y_range = y_range # Plausible reference readings
+        self.forgetting_factor = forgetting_factor # < 1 gradually discounts old samples, so the fit follows sensor drift
+        self.initial_variance = initial_variance # Prior uncertainty of the factory coefficients (in the scaled variable)
+        self.max_residual = max_residual # Samples further than this from the current compensation are rejected as outliers
+        self.max_adjustment = max_adjustment # Updates that move the compensation further than this from the factory polynomial are rejected
+        self.min_samples = min_samples # Accepted samples needed before the calibrated coefficients are used
+        self.check_points = numpy.linspace(x_range[0], x_range[1], 25)
+        self.factory_check_values = numpy.polyval(self.factory_coefficients, self.check_points)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with_u = numpy.poly1d(self.factory_coefficients)(numpy.poly1d([self.scale, self.centre])) # Factory polynomial in terms of u
+        self.theta = numpy.pad(with_u.coeffs, (self.degree + 1 - len(with_u.coeffs), 0))
+        self.covariance = numpy.eye(self.degree + 1) * self.initial_variance
+        self.accepted = 0
+        self.rejected = 0
+
+    def _features(self, x):
+        u = (x - self.centre) / self.scale
+        return numpy.array([u ** power for power in range(self.degree, -1, -1)])
+
+    def coefficients(self):
+        """Coefficients (highest power first) in terms of the raw reading. The factory coefficients until min_samples have been accepted."""
+        with self.lock:
+            if self.accepted < self.min_samples:
+                return self.factory_coefficients.tolist()
+            return self._raw_coefficients(self.theta).tolist()
+
+    def _raw_coefficients(self, theta):
+        with_x = numpy.poly1d(theta)(numpy.poly1d([1 / self.scale, -self.centre / self.scale]))
+        return numpy.pad(with_x.coeffs, (self.degree + 1 - len(with_x.coeffs), 0))
+
+    def compensate(self, x):
+        return float(numpy.polyval(self.coefficients(), x))
+
+    def update(self, x, y):
+        """Adds a raw reading and its reference reading. Returns True if the sample was accepted."""
+        with self.lock:
+            if not (self.x_range[0] <= x <= self.x_range[1] and self.y_range[0] <= y <= self.y_range[1]):
+                self.rejected += 1
+                return False
+            phi = self._features(x)
+            residual = y - phi.dot(self.theta)
+            if abs(residual) > self.max_residual:
+                self.rejected += 1
+                return False
+            p_phi = self.covariance.dot(phi)
+            gain = p_phi / (self.forgetting_factor + phi.dot(p_phi))
+            theta = self.theta + gain * residual
+            covariance = (self.covariance - numpy.outer(gain, p_phi)) / self.forgetting_factor
+            if numpy.max(numpy.abs(numpy.polyval(self._raw_coefficients(theta), self.check_points) - self.factory_check_values)) > self.max_adjustment:
+                self.rejected += 1
+                return False
+            self.theta = theta
+            covariance = (covariance + covariance.T) / 2 # Keeps the covariance symmetric despite rounding
+            # Forgetting inflates the covariance in directions that the readings don't excite (e.g. a narrow temperature range),
+            # which would make the fit unstable, so its trace is limited to the initial trace
+            max_trace = self.initial_variance * (self.degree + 1)
+            if numpy.trace(covariance) > max_trace:
+                covariance *= max_trace / numpy.trace(covariance)
+            self.covariance = covariance
+            self.accepted += 1
+            return True
+
+    def get_state(self):
+        with self.lock:
+            return {"Factory Coefficients": self.factory_coefficients.tolist(), "Theta": self.theta.tolist(),
+                    "Covariance": self.covariance.tolist(), "Accepted": self.accepted, "Rejected": self.rejected}
+
+    def set_state(self, state):
+        # State from different factory coefficients (e.g. after a change of temp_offset or cover) is discarded
+        if state.get("Factory Coefficients") != self.factory_coefficients.tolist():
+            print(self.name, 'calibration state is for different factory coefficients. Starting a new calibration')
+            return
+        with self.lock:
+            self.theta = numpy.array(state["Theta"])
+            self.covariance = numpy.array(state["Covariance"])
+            self.accepted = state["Accepted"]
+            self.rejected = state["Rejected"]
+
+
+def save_calibration_state(file_name, calibrators):
+    # Written to a temporary file and renamed, so that a power cut can't leave a partly written state file
+    state = {name: calibrators[name].get_state() for name in calibrators}
+    with open(file_name + '.tmp', 'w') as f:
+        f.write(json.dumps(state))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(file_name + '.tmp', file_name)
+
+
+def load_calibration_state(file_name, calibrators):
+    try:
+        with open(file_name, 'r') as f:
+            state = json.loads(f.read())
+    except (IOError, ValueError):
+        print('No Compensation Calibration State Available. Using Factory Compensation')
+        return
+    for name in calibrators:
+        if name in state:
+            calibrators[name].set_state(state[name])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Environment Log Writer - Gen
+# Writes the climate and gas log used for regression analysis as a fixed-schema JSON Lines or CSV stream.
+# Every record has the same columns (missing values are left empty), so the file can be loaded directly by
+# pandas.read_json(lines=True) or pandas.read_csv. Records are buffered, flushed and synced according to a configurable
+# policy and the file is rotated when it reaches a size limit.
+
+import csv
+import io
+import json
+import os
+import threading
+import time
+
+environment_log_columns = ['Run Time', 'Raw Temperature', 'Output Temp', 'Real Temperature', 'Raw Humidity', 'Output Humidity',
+                           'Real Humidity', 'Real Bar', 'Output Bar', 'Raw Bar', 'Oxi', 'Red', 'NH3', 'Raw OxiRS', 'Raw RedRS', 'Raw NH3RS']
+environment_log_formats = ['jsonl', 'csv']
+
+
+class EnvironmentLogWriter(object):
+    def __init__(self, path, log_format='jsonl', columns=None, flush_every=1, flush_interval=300, fsync=True, max_bytes=5000000, backup_count=5):
+        if log_format not in environment_log_formats:
+            raise ValueError('Invalid Environment Log Format: ' + str(log_format) + '. Choose one of ' + ', '.join(environment_log_formats))
+        self.path = path
+        self.log_format = log_format
+        self.columns = columns or environment_log_columns
+        self.flush_every = flush_every # Number of records buffered before they're written to the file. 1 writes every record
+        self.flush_interval = flush_interval # Seconds that a record can be buffered before it's written. None doesn't limit the time
+        self.fsync = fsync # Sync each flush to the SD card, so that a power cut can't lose flushed records
+        self.max_bytes = max_bytes # The file is rotated to path.1, path.2, ... when it reaches this size. 0 disables rotation
+        self.backup_count = backup_count
+        self.buffer = []
+        self.buffer_start = None # Time that the oldest buffered record was added
+        self.records = 0
+        self.flushes = 0
+        self.rotations = 0
+        self.lock = threading.Lock()
+
+    def _format(self, record):
+        unknown = set(record) - set(self.columns)
+        if unknown:
+            raise ValueError('Unknown Environment Log Columns: ' + ', '.join(sorted(unknown)))
+        row = [record.get(column) for column in self.columns]
+        if self.log_format == 'jsonl':
+            return json.dumps(dict(zip(self.columns, row))) + '\n'
+        line = io.StringIO()
+        csv.writer(line).writerow(['' if value is None else value for value in row])
+        return line.getvalue()
+
+    def _header(self):
+        if self.log_format != 'csv':
+            return ''
+        line = io.StringIO()
+        csv.writer(line).writerow(self.columns)
+        return line.getvalue()
+
+    def write(self, record):
+        """Adds a record (a dict keyed by column name). Columns that are missing from the record are left empty."""
+        with self.lock:
+            if not self.buffer:
+                self.buffer_start = time.monotonic()
+            self.buffer.append(self._format(record))
+            self.records += 1
+            if len(self.buffer) >= self.flush_every or (self.flush_interval is not None and
+                                                        time.monotonic() - self.buffer_start >= self.flush_interval):
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def flush_expired(self):
+        """Writes the buffered records if the oldest has been buffered for flush_interval, even if no record has been added since."""
+        with self.lock:
+            if self.buffer and self.flush_interval is not None and time.monotonic() - self.buffer_start >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.buffer_start = None
+        self.flushes += 1
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self._rotate()
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, 'a', newline='') as f:
+            if new_file:
+                f.write(self._header())
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _rotate(self):
+        if self.backup_count == 0:
+            os.remove(self.path)
+        else:
+            for number in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(self.path + '.' + str(number)):
+                    os.replace(self.path + '.' + str(number), self.path + '.' + str(number + 1))
+            os.replace(self.path, self.path + '.1')
+        self.rotations += 1
+
+    def close(self):
+        """Writes any buffered records. Called when the monitor shuts down."""
+        self.flush()
+
+    def print_stats(self):
+        print('Environment Log Records:', self.records, 'Buffered:', len(self.buffer), 'Flushes:', self.flushes, 'Rotations:', self.rotations)
+
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Ephemeris Cache - Gen
+# Caches the sunrise and sunset times used to place the sun/moon on the Icon Weather display.
+# They're computed once per local date (for yesterday, today and tomorrow), so a display frame only does a few comparisons.
+
+from datetime import datetime, timedelta
+
+import pytz
+from astral.geocoder import lookup
+from astral.sun import sun
+
+
+class EphemerisCache(object):
+    def __init__(self, db):
+        self.db = db
+        self.key = None # (City Name, Time Zone, Local Date) of the cached window
+        self.time_zone = None
+        self.sunset_yesterday = None
+        self.sunrise_today = None
+        self.sunset_today = None
+        self.sunrise_tomorrow = None
+        self.computations = 0
+
+    def _update(self, city_name, time_zone, today):
+        city = lookup(city_name, self.db)
+        yesterday = today - timedelta(1)
+        tomorrow = today + timedelta(1)
+        # Dates are local dates, so they're calculated in the local time zone rather than astral's UTC default
+        self.sunset_yesterday = sun(city.observer, date=yesterday, tzinfo=self.time_zone)["sunset"]
+        sun_today = sun(city.observer, date=today, tzinfo=self.time_zone)
+        self.sunrise_today = sun_today["sunrise"]
+        self.sunset_today = sun_today["sunset"]
+        self.sunrise_tomorrow = sun(city.observer, date=tomorrow, tzinfo=self.time_zone)["sunrise"]
+        self.key = (city_name, time_zone, today)
+        self.computations += 1
+
+    def sun_moon_time(self, city_name, time_zone):
+        """Calculate the progress through the current sun/moon period (i.e day or night) from the last sunrise or sunset.
+           Returns (progress, period, day, local_dt), with progress and period in seconds."""
+        if self.key is None or self.key[:2] != (city_name, time_zone):
+            self.time_zone = pytz.timezone(time_zone)
+        local_dt = datetime.now(tz=pytz.utc).astimezone(self.time_zone)
+        today = local_dt.date()
+        if self.key != (city_name, time_zone, today): # Recompute when the local date, city or time zone changes
+            self._update(city_name, time_zone, today)
+
+        # Work out lengths of day or night period and progress through period
+        if self.sunrise_today < local_dt < self.sunset_today:
+            day = True
+            period = self.sunset_today - self.sunrise_today
+            progress = local_dt - self.sunrise_today
+        elif local_dt > self.sunset_today:
+            day = False
+            period = self.sunrise_tomorrow - self.sunset_today
+            progress = local_dt - self.sunset_today
+        else:
+            day = False
+            period = self.sunrise_today - self.sunset_yesterday
+            progress = local_dt - self.sunset_yesterday
+        return (progress.total_seconds(), period.total_seconds(), day, local_dt)
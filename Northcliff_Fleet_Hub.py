@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Fleet Hub - Gen
+# A local hub service for a fleet of monitors. It subscribes to the monitors' mqtt topics (the same mqtt_values payloads
+# that outdoor units send to indoor units and Home Manager), keeps each device's latest readings and a short history in
+# compact NumPy arrays, and publishes the neighbourhood air quality level and the min/max/mean of each reading across
+# the fleet on a single aggregate topic.
+# Run with: FLEET_HUB_CONFIG=<path to fleet_hub_config.json> python3 Northcliff_Fleet_Hub.py
+
+import json
+import os
+import threading
+import time
+
+import numpy
+import paho.mqtt.client as mqtt
+from Northcliff_AQI import AQIEngine, air_quality_thresholds, air_quality_levels
+from Northcliff_MQTT_Delta import DeltaDecoder
+
+fleet_metrics = ["P1", "P2.5", "P10", "Oxi", "Red", "NH3", "Temp", "Hum", "Bar", "Lux"]
+gas_metrics = ["Oxi", "Red", "NH3"] # Only used when the device's gas sensors are calibrated
+aqi_metrics = [metric for metric in fleet_metrics if metric in air_quality_thresholds]
+aqi_columns = [fleet_metrics.index(metric) for metric in aqi_metrics]
+# Uses the monitor's own level thresholds, so a device and the hub give a reading the same level
+aqi_engine = AQIEngine({metric: [None, 0, air_quality_thresholds[metric]] for metric in aqi_metrics})
+
+
+def payload_values(mqtt_values):
+    """Extracts fleet_metrics from a monitor's mqtt_values payload as a float32 row. Missing readings are NaN."""
+    values = numpy.full(len(fleet_metrics), numpy.nan, dtype=numpy.float32)
+    gas_calibrated = mqtt_values.get("Gas Calibrated", False)
+    for column, metric in enumerate(fleet_metrics):
+        value = mqtt_values.get(metric)
+        if isinstance(value, list): # Hum and Bar readings have their data in lists
+            value = value[0] if value else None
+        if metric in gas_metrics and not gas_calibrated:
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[column] = value
+    return values
+
+
+class FleetState(object):
+    def __init__(self, history_length=60, capacity=64):
+        self.history_length = history_length # Readings kept for each device
+        self.devices = {} # {device id: row}
+        self.device_ids = []
+        self.lock = threading.Lock()
+        self.updates = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        metrics = len(fleet_metrics)
+        latest = numpy.full((capacity, metrics), numpy.nan, dtype=numpy.float32)
+        history = numpy.full((capacity, self.history_length, metrics), numpy.nan, dtype=numpy.float32)
+        history_position = numpy.zeros(capacity, dtype=numpy.int32)
+        last_seen = numpy.zeros(capacity, dtype=numpy.float64)
+        rows = len(self.device_ids)
+        if rows: # Growing, so copy the existing devices
+            latest[:rows] = self.latest[:rows]
+            history[:rows] = self.history[:rows]
+            history_position[:rows] = self.history_position[:rows]
+            last_seen[:rows] = self.last_seen[:rows]
+        self.latest = latest
+        self.history = history
+        self.history_position = history_position
+        self.last_seen = last_seen
+
+    def _row(self, device_id):
+        row = self.devices.get(device_id)
+        if row is None:
+            row = len(self.device_ids)
+            if row == len(self.latest): # Capacity doubles, so adding devices is amortised O(1)
+                self._allocate(2 * len(self.latest))
+            self.devices[device_id] = row
+            self.device_ids.append(device_id)
+        return row
+
+    def update(self, device_id, mqtt_values, timestamp=None):
+        values = payload_values(mqtt_values)
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            row = self._row(device_id)
+            self.latest[row] = values
+            self.history[row, self.history_position[row]] = values
+            self.history_position[row] = (self.history_position[row] + 1) % self.history_length
+            self.last_seen[row] = timestamp
+            self.updates += 1
+
+    def device_history(self, device_id):
+        """The device's history in chronological order, one column per fleet metric. Readings not yet received are NaN."""
+        with self.lock:
+            row = self.devices[device_id]
+            return numpy.roll(self.history[row], -self.history_position[row], axis=0)
+
+    def aggregate(self, now=None, stale_timeout=None):
+        """Neighbourhood air quality and the min/max/mean of each reading across the devices heard from within stale_timeout."""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            rows = len(self.device_ids)
+            active = numpy.ones(rows, dtype=bool) if stale_timeout is None else self.last_seen[:rows] >= now - stale_timeout
+            latest = self.latest[:rows][active]
+            device_ids = [self.device_ids[row] for row in numpy.flatnonzero(active)]
+        aggregates = {"Devices": rows, "Active Devices": len(device_ids), "Time": round(now, 1)}
+        if len(device_ids) == 0:
+            return aggregates
+        valid = ~numpy.isnan(latest)
+        counts = valid.sum(axis=0)
+        minima = numpy.where(valid, latest, numpy.inf).min(axis=0)
+        maxima = numpy.where(valid, latest, -numpy.inf).max(axis=0)
+        means = numpy.where(valid, latest, 0).sum(axis=0, dtype=numpy.float64) / numpy.maximum(counts, 1)
+        for column, metric in enumerate(fleet_metrics):
+            if counts[column]:
+                aggregates[metric] = {"Min": round(float(minima[column]), 2), "Max": round(float(maxima[column]), 2),
+                                      "Mean": round(float(means[column]), 2), "Count": int(counts[column])}
+        # The neighbourhood level is the level of the fleet's mean readings. The worst device is also reported
+        fleet_means = numpy.where(counts[aqi_columns] > 0, means[aqi_columns], numpy.nan)
+        level, factor_column = aqi_engine.max_levels(fleet_means, aqi_metrics)
+        level = int(level)
+        aggregates["Air Quality Level"] = level
+        aggregates["Air Quality Factor"] = aqi_metrics[int(factor_column)] if level > 0 else 'All'
+        aggregates["Air Quality Text"] = air_quality_levels[level]
+        device_levels = aqi_engine.max_levels(latest[:, aqi_columns], aqi_metrics)[0]
+        worst = int(device_levels.argmax())
+        aggregates["Worst Device"] = device_ids[worst]
+        aggregates["Worst Device Level"] = int(device_levels[worst])
+        return aggregates
+
+
+class FleetHub(object):
+    def __init__(self, device_topics, aggregate_topic, history_length=60, stale_timeout=900):
+        self.device_topics = device_topics # Topics or topic filters (e.g. enviro/+/outdoor) of the monitors. Each topic is a device
+        self.aggregate_topic = aggregate_topic
+        self.stale_timeout = stale_timeout # Devices that haven't been heard from for this long are left out of the aggregates
+        self.state = FleetState(history_length)
+        self.decoders = {} # A delta decoder for each device, so that devices can send full or delta encoded payloads
+        self.client = None
+        self.malformed = 0
+        self.published = 0
+
+    def on_connect(self, client, userdata, flags, rc):
+        print('Fleet Hub Connected with result code', rc)
+        for topic in self.device_topics:
+            client.subscribe(topic)
+
+    def on_message(self, client, userdata, msg):
+        if msg.topic == self.aggregate_topic: # In case a topic filter also matches the aggregate topic
+            return
+        try:
+            parsed_json = json.loads(msg.payload)
+        except (ValueError, UnicodeDecodeError):
+            self.malformed += 1
+            return
+        if not isinstance(parsed_json, dict):
+            self.malformed += 1
+            return
+        decoder = self.decoders.get(msg.topic)
+        if decoder is None:
+            decoder = self.decoders[msg.topic] = DeltaDecoder()
+        values = decoder.decode(parsed_json)
+        if values is not None: # None while waiting for a device's next keyframe
+            self.state.update(msg.topic, values)
+
+    def connect(self, broker_name, client_name, port=1883):
+        self.client = mqtt.Client(client_name)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.connect(broker_name, port, 60)
+        self.client.loop_start()
+
+    def publish_aggregates(self):
+        aggregates = self.state.aggregate(stale_timeout=self.stale_timeout)
+        if self.client is not None:
+            self.client.publish(self.aggregate_topic, json.dumps(aggregates))
+            self.published += 1
+        return aggregates
+
+    def print_stats(self):
+        print('Fleet Hub Devices:', len(self.state.device_ids), 'Updates:', self.state.updates, 'Malformed:', self.malformed,
+              'Sequence Gaps:', sum(decoder.gaps for decoder in self.decoders.values()), 'Aggregates Published:', self.published)
+
+    def stop(self):
+        if self.client is not None:
+            self.client.loop_stop()
+            self.client.disconnect()
+
+
+def retrieve_fleet_hub_config():
+    with open(os.environ.get('FLEET_HUB_CONFIG', '<Your fleet_hub_config.json file location>'), 'r') as f:
+        parsed_config_parameters = json.loads(f.read())
+    print('Retrieved Fleet Hub Config', parsed_config_parameters)
+    return parsed_config_parameters
+
+
+if __name__ == '__main__':
+    from Northcliff_Runtime import MonitorRuntime
+    config = retrieve_fleet_hub_config()
+    hub = FleetHub(config['device_topics'], config['aggregate_topic'], config.get('history_length', 60), config.get('stale_device_timeout', 900))
+    hub.connect(config['mqtt_broker_name'], config['mqtt_client_name'], config.get('mqtt_broker_port', 1883))
+    runtime = MonitorRuntime()
+    runtime.add_periodic_task('Fleet Aggregates', config.get('aggregate_publish_interval', 60), hub.publish_aggregates,
+                              first_delay=config.get('aggregate_publish_interval', 60))
+    runtime.add_periodic_task('Fleet Hub Stats', 300, hub.print_stats, first_delay=300)
+    try:
+        runtime.run()
+    except KeyboardInterrupt:
+        hub.stop()
+        hub.print_stats()
+        runtime.print_stats()
+        print('Keyboard Interrupt')
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Graph Renderer - Gen
+# Renders the graph region of display_graphed_data as one NumPy pixel array, instead of two draw.rectangle calls per reading.
+# Each reading occupies a 2 pixel wide column: a colour band (from the level thresholds) with a 3 pixel high black line point.
+
+import numpy
+
+
+def render_graph(values, valid, thresholds, palette, width, height, top_pos):
+    """Returns a (height, width, 3) uint8 array with a white background and the graph below top_pos.
+       values and valid are the readings and validity mask, oldest first. The band colour is palette[n], where n is the
+       number of thresholds that the reading exceeds. Readings that haven't been received are shown in black."""
+    values = numpy.asarray(values, dtype=numpy.float64)
+    valid = numpy.asarray(valid, dtype=bool)
+    # Scale the readings between 0 and 1 in one pass. Readings that haven't been received count as 0
+    received = values * valid
+    lowest = received.min()
+    span = received.max() - lowest
+    if span != 0:
+        graph_range = (received - lowest) / span
+    else:
+        graph_range = numpy.zeros(len(received))
+    # Map each reading to its palette band
+    band_colours = numpy.asarray(palette, dtype=numpy.uint8)[numpy.searchsorted(thresholds, values, side='left')]
+    band_colours[~valid] = 0
+    line_y = (height - 2) - ((top_pos + 1) + (graph_range * ((height - 2) - (top_pos + 1)))) + (top_pos + 1)
+    line_top = line_y.astype(numpy.int64)
+
+    pixels = numpy.full((height, width, 3), 255, dtype=numpy.uint8)
+    columns = min(width, 2 * len(values) + 1) # The last reading's band is 3 pixels wide
+    column_readings = numpy.minimum(numpy.arange(columns) // 2, len(values) - 1)
+    pixels[top_pos:, :columns] = band_colours[column_readings]
+    rows = numpy.arange(height)[:, numpy.newaxis]
+    column_line_top = line_top[column_readings]
+    line_mask = (rows >= column_line_top) & (rows <= column_line_top + 2)
+    pixels[:, :columns][line_mask] = 0
+    return pixels
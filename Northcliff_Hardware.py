@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Hardware Backends - Gen
+# Provides the sensor and display objects used by Northcliff_AQI_Monitor_Gen.py.
+# The "Enviro+" backend drives the real BME280, LTR559, gas ADC, PMS5003 and ST7735 on a Raspberry Pi.
+# The "Simulated" backend provides deterministic, seeded or scripted stand-ins so that the monitor can be run,
+# profiled and benchmarked on any Linux machine.
+
+import math
+import random
+import time
+from collections import namedtuple
+
+hardware_backends = ["Enviro+", "Simulated"]
+
+
+class Hardware(object): # Holds the sensor and display objects for the selected backend
+    def __init__(self, backend, bme280, ltr559, gas, pms5003, disp, pms5003_errors, serial_number=None):
+        self.backend = backend
+        self.bme280 = bme280
+        self.ltr559 = ltr559
+        self.gas = gas
+        self.pms5003 = pms5003 # None if the particle sensor is disabled
+        self.disp = disp
+        self.pms5003_errors = pms5003_errors # Tuple of exceptions raised by a failed PMS5003 read
+        self.serial_number = serial_number
+
+    def get_serial_number(self):
+        if self.serial_number is not None:
+            return self.serial_number
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line[0:6] == 'Serial':
+                    return line.split(":")[1].strip()
+
+
+def create_hardware(backend, enable_particle_sensor, simulation_seed=0, simulation_script=None, pms5003_frame_interval=0):
+    """Create the sensor and display objects for the selected backend. pms5003_frame_interval only applies to the simulated backend."""
+    if backend == "Enviro+":
+        return create_enviroplus_hardware(enable_particle_sensor)
+    elif backend == "Simulated":
+        return create_simulated_hardware(enable_particle_sensor, simulation_seed, simulation_script, pms5003_frame_interval)
+    else:
+        raise ValueError('Invalid Hardware Backend: ' + str(backend) + '. Choose one of ' + ', '.join(hardware_backends))
+
+
+def create_enviroplus_hardware(enable_particle_sensor):
+    # Driver imports are deferred so that the simulated backend doesn't need them
+    try:
+        from smbus2 import SMBus
+    except ImportError:
+        from smbus import SMBus
+    try:
+        # Transitional fix for breaking change in LTR559
+        from ltr559 import LTR559
+        ltr559 = LTR559()
+    except ImportError:
+        import ltr559
+    import ST7735
+    from enviroplus import gas
+    from bme280 import BME280
+    from pms5003 import PMS5003, ReadTimeoutError, ChecksumMismatchError
+    bus = SMBus(1)
+    # Create a BME280 instance
+    bme280 = BME280(i2c_dev=bus)
+    # Create an LCD instance
+    disp = ST7735.ST7735(
+        port=0,
+        cs=1,
+        dc=9,
+        backlight=12,
+        rotation=270,
+        spi_speed_hz=10000000
+    )
+    # Initialize display
+    disp.begin()
+    pms5003 = None
+    if enable_particle_sensor:
+        # Create a PMS5003 instance
+        pms5003 = PMS5003()
+        time.sleep(1)
+    return Hardware("Enviro+", bme280, ltr559, gas, pms5003, disp, (ReadTimeoutError, ChecksumMismatchError))
+
+
+# Simulated Hardware
+class SimulatedReadTimeoutError(Exception):
+    pass
+
+
+class SimulatedChecksumMismatchError(Exception):
+    pass
+
+
+class SimulatedChannel(object): # Produces a deterministic sequence of readings for one sensor channel
+    def __init__(self, rng, base, amplitude=0, period=100, noise=0, script=None):
+        self.rng = rng
+        self.base = base
+        self.amplitude = amplitude
+        self.period = period
+        self.noise = noise
+        self.script = script # Optional list of readings that are replayed in order and then repeated
+        self.count = 0
+
+    def next(self):
+        if self.script:
+            value = self.script[self.count % len(self.script)]
+        else:
+            value = self.base + self.amplitude * math.sin(2 * math.pi * self.count / self.period)
+            if self.noise:
+                value += self.rng.gauss(0, self.noise)
+        self.count += 1
+        return value
+
+
+class SimulatedBME280(object):
+    def __init__(self, rng, script):
+        self.temperature = SimulatedChannel(rng, 24, 4, 288, 0.1, script.get('Temp'))
+        self.humidity = SimulatedChannel(rng, 55, 10, 288, 0.5, script.get('Hum'))
+        self.pressure = SimulatedChannel(rng, 1012, 3, 1000, 0.05, script.get('Bar'))
+
+    def get_temperature(self):
+        return self.temperature.next()
+
+    def get_humidity(self):
+        return self.humidity.next()
+
+    def get_pressure(self):
+        return self.pressure.next()
+
+
+class SimulatedLTR559(object):
+    def __init__(self, rng, script):
+        self.lux = SimulatedChannel(rng, 400, 350, 288, 5, script.get('Lux'))
+        self.proximity = SimulatedChannel(rng, 0, script=script.get('Proximity')) # Script a value > 1500 to simulate a tap
+
+    def get_lux(self):
+        return max(0, self.lux.next())
+
+    def get_proximity(self):
+        return self.proximity.next()
+
+
+GasReading = namedtuple('GasReading', ['oxidising', 'reducing', 'nh3', 'adc'])
+
+
+class SimulatedGas(object):
+    def __init__(self, rng, script):
+        self.oxidising = SimulatedChannel(rng, 20000, 2000, 500, 100, script.get('Oxi RS'))
+        self.reducing = SimulatedChannel(rng, 300000, 20000, 500, 1000, script.get('Red RS'))
+        self.nh3 = SimulatedChannel(rng, 100000, 10000, 500, 500, script.get('NH3 RS'))
+
+    def read_all(self):
+        return GasReading(self.oxidising.next(), self.reducing.next(), self.nh3.next(), None)
+
+
+class SimulatedPMReading(object):
+    def __init__(self, pm1, pm2_5, pm10):
+        self.values = {1.0: pm1, 2.5: pm2_5, 10: pm10}
+
+    def pm_ug_per_m3(self, size):
+        return self.values[size]
+
+
+class SimulatedPMS5003(object):
+    def __init__(self, rng, script, frame_interval=0):
+        self.pm1 = SimulatedChannel(rng, 4, 3, 200, 0.5, script.get('P1'))
+        self.pm2_5 = SimulatedChannel(rng, 8, 6, 200, 1, script.get('P2.5'))
+        self.pm10 = SimulatedChannel(rng, 12, 9, 200, 1.5, script.get('P10'))
+        self.failures = SimulatedChannel(rng, 0, script=script.get('PMS5003 Failures')) # Script True to simulate a read timeout
+        self.reset_count = 0
+        self.frame_interval = frame_interval # Seconds between frames. read() waits for the next frame, like the real sensor. 0 doesn't wait
+        self.next_frame_time = 0
+
+    def read(self):
+        if self.frame_interval <= 0:
+            return self._frame()
+        delay = self.next_frame_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_frame_time = max(self.next_frame_time, time.monotonic() - self.frame_interval) + self.frame_interval
+        return self._frame()
+
+    def _frame(self):
+        if self.failures.next():
+            raise SimulatedReadTimeoutError('Simulated PMS5003 Read Timeout')
+        return SimulatedPMReading(max(0, round(self.pm1.next())), max(0, round(self.pm2_5.next())), max(0, round(self.pm10.next())))
+
+    def reset(self):
+        self.reset_count += 1
+
+
+class SimulatedST7735(object): # Keeps the last frame instead of pushing it over SPI
+    def __init__(self, width=160, height=80):
+        self.width = width
+        self.height = height
+        self.frame = None
+        self.frame_count = 0
+
+    def begin(self):
+        pass
+
+    def display(self, image):
+        self.frame = image
+        self.frame_count += 1
+
+
+def create_simulated_hardware(enable_particle_sensor, simulation_seed=0, simulation_script=None, pms5003_frame_interval=0):
+    """simulation_script is an optional dict of reading lists, keyed by channel name (e.g. {'P2.5': [5, 80, 150]}).
+       Unscripted channels generate seeded readings that repeat exactly for the same seed. pms5003_frame_interval paces the
+       simulated PMS5003 like the real sensor (1 second). 0 returns frames immediately, e.g. for benchmarks and scripted tests."""
+    rng = random.Random(simulation_seed)
+    script = simulation_script or {}
+    pms5003 = None
+    if enable_particle_sensor:
+        pms5003 = SimulatedPMS5003(rng, script, pms5003_frame_interval)
+    return Hardware("Simulated", SimulatedBME280(rng, script), SimulatedLTR559(rng, script), SimulatedGas(rng, script),
+                    pms5003, SimulatedST7735(), (SimulatedReadTimeoutError, SimulatedChecksumMismatchError),
+                    serial_number='00000000' + format(simulation_seed & 0xffffffff, '08x'))
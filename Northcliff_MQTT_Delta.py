@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor mqtt Delta Encoding - Gen
+# Publishes mqtt_values as a periodic keyframe (every field) followed by deltas that only contain the fields whose values
+# have changed at their configured precision. Every payload has a sequence number, so a subscriber can detect a lost
+# payload and wait for the next keyframe instead of displaying a mix of old and new readings.
+# Keyframe: {"Sequence": 12, "Keyframe": true, "P2.5": 8.0, "Temp": 21.3, ...}
+# Delta:    {"Sequence": 13, "Keyframe": false, "P2.5": 9.0}
+
+import copy
+import json
+
+default_precision = {"P1": 1, "P2.5": 1, "P10": 1, "Temp": 1, "Min Temp": 1, "Max Temp": 1, "Hum": 1, "Bar": 1, "Red": 2,
+                     "Oxi": 2, "NH3": 2, "Lux": 1} # Decimal places of each field. Other fields are sent when they change at all
+sequence_modulus = 2 ** 32 # Sequence numbers wrap around
+
+
+def round_field(value, places):
+    if isinstance(value, bool) or places is None:
+        return value
+    if isinstance(value, (int, float)):
+        return round(value, places)
+    if isinstance(value, list): # Hum and Bar readings have their values in lists with their Domoticz status
+        return [round_field(item, places) for item in value]
+    return value
+
+
+class DeltaEncoder(object):
+    def __init__(self, keyframe_interval=12, precision=None):
+        self.keyframe_interval = keyframe_interval # A keyframe is sent every keyframe_interval payloads
+        self.precision = default_precision if precision is None else precision
+        self.sent_values = {} # Every field's last sent value, at its precision
+        self.sequence = 0
+        self.payloads_since_keyframe = None # None sends a keyframe first
+        self.keyframes = 0
+        self.deltas = 0
+        self.full_bytes = 0 # Length of the full payloads that would have been sent
+        self.sent_bytes = 0
+
+    def encode(self, values):
+        """Returns the next payload's JSON for values (a dict such as mqtt_values). Fields that are missing from values
+           (e.g. Forecast between forecast updates) are treated as unchanged."""
+        rounded = {field: round_field(values[field], self.precision.get(field)) for field in values}
+        keyframe = self.payloads_since_keyframe is None or self.payloads_since_keyframe >= self.keyframe_interval - 1
+        if keyframe:
+            self.sent_values.update(copy.deepcopy(rounded))
+            payload = dict(self.sent_values)
+            self.payloads_since_keyframe = 0
+            self.keyframes += 1
+        else:
+            payload = {field: rounded[field] for field in rounded if self.sent_values.get(field) != rounded[field]}
+            self.sent_values.update(copy.deepcopy(payload))
+            self.payloads_since_keyframe += 1
+            self.deltas += 1
+        payload["Sequence"] = self.sequence
+        payload["Keyframe"] = keyframe
+        self.sequence = (self.sequence + 1) % sequence_modulus
+        payload_json = json.dumps(payload)
+        self.full_bytes += len(json.dumps(values))
+        self.sent_bytes += len(payload_json)
+        return payload_json
+
+    def print_stats(self):
+        saving = 100 * (1 - self.sent_bytes / self.full_bytes) if self.full_bytes else 0
+        print('mqtt Delta Encoding Keyframes:', self.keyframes, 'Deltas:', self.deltas, 'Bytes Sent:', self.sent_bytes,
+              'Full Payload Bytes:', self.full_bytes, 'Saving: {:.0f}%'.format(saving))
+
+
+class DeltaDecoder(object):
+    def __init__(self):
+        self.values = {}
+        self.expected_sequence = None # None waits for a keyframe
+        self.keyframes = 0
+        self.deltas = 0
+        self.gaps = 0 # Lost payloads detected from the sequence numbers
+        self.discarded = 0 # Deltas discarded while waiting for a keyframe
+
+    def decode(self, payload):
+        """Returns the full values after applying payload, or None while waiting for a keyframe.
+           Payloads without a sequence number (from monitors that don't use delta encoding) are returned unchanged."""
+        if "Sequence" not in payload:
+            return payload
+        sequence = payload["Sequence"]
+        fields = {field: payload[field] for field in payload if field != "Sequence" and field != "Keyframe"}
+        if payload.get("Keyframe"):
+            self.values = fields
+            self.keyframes += 1
+        elif self.expected_sequence is None:
+            self.discarded += 1
+            return None
+        elif sequence != self.expected_sequence:
+            print('mqtt Delta Sequence Gap. Expected', self.expected_sequence, 'Received', sequence, '- Waiting for the next keyframe')
+            self.gaps += 1
+            self.discarded += 1
+            self.expected_sequence = None
+            return None
+        else:
+            self.values.update(fields)
+            self.deltas += 1
+        self.expected_sequence = (sequence + 1) % sequence_modulus
+        return dict(self.values)
+
+    def print_stats(self):
+        print('mqtt Delta Decoding Keyframes:', self.keyframes, 'Deltas:', self.deltas, 'Gaps:', self.gaps, 'Discarded:', self.discarded)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor mqtt Topic Dispatch - Gen
+# Routes incoming mqtt messages through a topic table that's built once from the config. Messages on topics without a route
+# are discarded without being decoded, and payloads that can't match a route's sensor filter aren't parsed, so busy Home
+# Manager or Domoticz brokers cost little on paho's network thread. Parsed updates are passed to the consumer through a
+# bounded queue and the handlers run on the consumer's thread when it calls dispatch().
+
+import collections
+import json
+import threading
+
+dispatch_policies = ['coalesce', 'drop_oldest', 'drop_newest']
+
+
+class MQTTRoute(object):
+    def __init__(self, name, handler, match_key=None, match_value=None, policy='coalesce'):
+        if policy not in dispatch_policies:
+            raise ValueError('Invalid mqtt Dispatch Policy: ' + str(policy) + '. Choose one of ' + ', '.join(dispatch_policies))
+        self.name = name
+        self.handler = handler # Called with the parsed payload
+        self.match_key = match_key # Only payloads whose match_key value is match_value are routed (e.g. a Domoticz device's name or idx)
+        self.match_value = match_value
+        self.policy = policy # coalesce keeps only the latest pending update. drop_oldest and drop_newest queue every update
+        self.marker = None # Text that a matching payload must contain, checked before the payload is parsed
+        if isinstance(match_value, str) and match_value.isprintable() and match_value.isascii() and '"' not in match_value and '\\' not in match_value:
+            self.marker = match_value.encode('ascii')
+        elif isinstance(match_value, int) and not isinstance(match_value, bool):
+            self.marker = str(match_value).encode('ascii')
+
+    def matches(self, parsed_json):
+        return self.match_key is None or (isinstance(parsed_json, dict) and parsed_json.get(self.match_key) == self.match_value)
+
+
+class MQTTDispatcher(object):
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue # Limit of the drop_oldest and drop_newest queue
+        self.routes = {} # {topic: [routes]}
+        self.queue = collections.deque()
+        self.coalesced_updates = collections.OrderedDict() # Latest pending update of each coalesce route, keyed by route name
+        self.lock = threading.Lock()
+        self.received = 0
+        self.ignored = 0 # Messages on topics without a route
+        self.unmatched = 0 # Messages that didn't match any of their topic's routes
+        self.malformed = 0
+        self.coalesced = 0 # Pending updates replaced by a later update
+        self.dropped = 0
+        self.handled = 0
+        self.handler_errors = 0
+
+    def add_route(self, topic, route):
+        self.routes.setdefault(topic, []).append(route)
+
+    def topics(self):
+        return list(self.routes)
+
+    def on_message(self, client, userdata, msg):
+        """paho on_message callback. Runs on paho's network thread, so it only filters, parses and queues."""
+        self.received += 1
+        routes = self.routes.get(msg.topic)
+        if routes is None:
+            self.ignored += 1
+            return
+        payload = msg.payload
+        candidates = [route for route in routes if route.marker is None or route.marker in payload]
+        if candidates == []:
+            self.unmatched += 1
+            return
+        try:
+            parsed_json = json.loads(payload)
+        except (ValueError, UnicodeDecodeError):
+            self.malformed += 1
+            return
+        matched = False
+        for route in candidates:
+            if route.matches(parsed_json):
+                matched = True
+                self._queue(route, parsed_json)
+        if not matched:
+            self.unmatched += 1
+
+    def _queue(self, route, parsed_json):
+        with self.lock:
+            if route.policy == 'coalesce':
+                if route.name in self.coalesced_updates:
+                    self.coalesced += 1
+                self.coalesced_updates[route.name] = (route, parsed_json)
+            elif len(self.queue) < self.max_queue:
+                self.queue.append((route, parsed_json))
+            elif route.policy == 'drop_oldest':
+                self.queue.popleft()
+                self.queue.append((route, parsed_json))
+                self.dropped += 1
+            else:
+                self.dropped += 1
+
+    def dispatch(self):
+        """Runs the handlers of the pending updates on the caller's thread. Returns the number of updates handled."""
+        with self.lock:
+            updates = list(self.queue) + list(self.coalesced_updates.values())
+            self.queue.clear()
+            self.coalesced_updates.clear()
+        for route, parsed_json in updates:
+            try:
+                route.handler(parsed_json)
+                self.handled += 1
+            except (KeyError, TypeError, ValueError, IndexError) as e: # Payloads with missing or invalid fields
+                self.handler_errors += 1
+                print('mqtt', route.name, 'Update Error', e)
+        return len(updates)
+
+    def print_stats(self):
+        print('mqtt Messages Received:', self.received, 'Ignored Topics:', self.ignored, 'Unmatched:', self.unmatched,
+              'Malformed:', self.malformed, 'Handled:', self.handled, 'Coalesced:', self.coalesced, 'Dropped:', self.dropped,
+              'Handler Errors:', self.handler_errors)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Metrics Exporter - Gen
+# Exposes the monitor's readings and internal health in the Prometheus text format on an optional HTTP endpoint
+# (http://<monitor>:<port>/metrics). Gauges are served from a snapshot that the monitor replaces periodically, and
+# counters and histograms are updated by the tasks that they measure, so a scrape never touches the sensors.
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+default_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10] # Seconds
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')) for name, value in labels]
+    return '{' + ','.join(name + '="' + value + '"' for name, value in escaped) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # The last count is for values above the largest bucket
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metadata = {} # {name: (type, help)}
+        self.gauges = {} # {name: [(labels, value)]}, replaced as a whole by set_gauges
+        self.counters = {} # {(name, labels): value}
+        self.histograms = {} # {(name, labels): Histogram}
+
+    def describe(self, name, metric_type, help_text):
+        self.metadata[name] = (metric_type, help_text)
+
+    def set_gauges(self, gauges):
+        """Replaces the gauge snapshot. gauges is {name: [(labels dict, value)]}. Values that are None are left out."""
+        snapshot = {name: [(tuple(sorted(labels.items())), value) for labels, value in gauges[name] if value is not None] for name in gauges}
+        with self.lock:
+            self.gauges = snapshot
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None, buckets=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets or default_buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, labels=None):
+        """Observes the time taken by the with block in the name histogram, even if the block raises an exception."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, labels)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            families = {}
+            for name in self.gauges:
+                families.setdefault(name, []).extend((name, labels, value) for labels, value in self.gauges[name])
+            for (name, labels), value in self.counters.items():
+                families.setdefault(name, []).append((name, labels, value))
+            for (name, labels), histogram in self.histograms.items():
+                samples = families.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + [float('inf')], histogram.counts):
+                    cumulative += count
+                    samples.append((name + '_bucket', labels + (('le', format_value(bound)),), cumulative))
+                samples.append((name + '_sum', labels, histogram.total))
+                samples.append((name + '_count', labels, cumulative))
+        for name in sorted(families):
+            if name in self.metadata:
+                metric_type, help_text = self.metadata[name]
+                lines.append('# HELP ' + name + ' ' + help_text)
+                lines.append('# TYPE ' + name + ' ' + metric_type)
+            for sample_name, labels, value in families[name]:
+                lines.append(sample_name + format_labels(labels) + ' ' + format_value(value))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+    def __init__(self, registry, port, address=''):
+        self.registry = registry
+        self.scrapes = 0
+        server = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = server.registry.render().encode('utf-8')
+                server.scrapes += 1
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args): # Scrapes aren't printed
+                pass
+
+        self.httpd = ThreadingHTTPServer((address, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        print('Metrics Exporter Serving on Port', self.httpd.server_address[1])
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
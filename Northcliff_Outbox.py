@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Telemetry Outbox - Gen
+# Crash-safe store-and-forward queue for Luftdaten, Adafruit IO and mqtt payloads.
+# Every payload is written to an SQLite database (in WAL mode) with its capture time before it's sent and is only removed
+# once it has been accepted, so readings survive network outages, restarts and power cuts. A payload that the destination
+# rejects outright (e.g. an invalid value or a missing feed) is removed and counted, so that it can't block the payloads
+# queued behind it.
+
+import json
+import sqlite3
+import threading
+import time
+
+send_rejected = 'Rejected' # Returned by a send function when the destination will never accept the payload, so it isn't retried
+
+
+class TelemetryOutbox(object):
+    def __init__(self, db_path, max_rows=20000, min_retry_delay=10, max_retry_delay=600):
+        self.max_rows = max_rows # The oldest payloads are discarded beyond this limit
+        self.min_retry_delay = min_retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL') # Durable across crashes in WAL mode, without an fsync on every commit
+        self.db.execute('CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, destination TEXT NOT NULL, '
+                        'payload TEXT NOT NULL, created_at REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS outbox_destination ON outbox (destination, id)')
+        self.count = self.db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0] # Kept up to date, so put() doesn't count the rows
+        self.retry_delay = {} # Per destination backoff after a failed send
+        self.retry_time = {}
+        self.sent = {}
+        self.expired = {}
+        self.rejected = {}
+        self.discarded = 0
+
+    def put(self, destination, payload, created_at=None):
+        if created_at is None:
+            created_at = time.time()
+        with self.lock:
+            self.db.execute('INSERT INTO outbox (destination, payload, created_at) VALUES (?, ?, ?)',
+                            (destination, json.dumps(payload), created_at))
+            self.count += 1
+            if self.count > self.max_rows:
+                discarded = self.db.execute('DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY id LIMIT ?)',
+                                            (self.count - self.max_rows,)).rowcount
+                self.count -= discarded
+                self.discarded += discarded
+
+    def drain(self, destination, send, max_items=5, max_age=None):
+        """Sends up to max_items of the destination's oldest payloads, in capture order, with send(payload, created_at).
+           send returns True when the payload has been accepted, False when it should be retried later (e.g. after a
+           connection error, a timeout, throttling or a server error) and send_rejected when the destination will never
+           accept it. Draining stops at the first failure and the destination then backs off exponentially. Rejected
+           payloads, and payloads older than max_age seconds, are discarded unsent.
+           Returns True if payloads were sent or rejected without a failure, False if a send failed and None if nothing
+           was sent (while backing off or with an empty backlog)."""
+        now = time.time()
+        if now < self.retry_time.get(destination, 0):
+            return None
+        with self.lock:
+            rows = self.db.execute('SELECT id, payload, created_at FROM outbox WHERE destination = ? ORDER BY id LIMIT ?',
+                                   (destination, max_items)).fetchall()
+        sent = 0
+        rejected = 0
+        for row_id, payload, created_at in rows:
+            if max_age is not None and now - created_at > max_age:
+                self._delete(row_id)
+                self.expired[destination] = self.expired.get(destination, 0) + 1
+                continue
+            result = send(json.loads(payload), created_at)
+            if result == send_rejected:
+                self._delete(row_id)
+                self.rejected[destination] = self.rejected.get(destination, 0) + 1
+                rejected += 1
+                print(destination, 'rejected a queued payload. Discarding it')
+                continue
+            if not result:
+                self.retry_delay[destination] = min(self.max_retry_delay, self.retry_delay.get(destination, self.min_retry_delay / 2) * 2)
+                self.retry_time[destination] = time.time() + self.retry_delay[destination]
+                print(destination, 'outbox send failed. Retrying in', round(self.retry_delay[destination]), 'seconds with',
+                      self.pending(destination), 'payloads queued')
+                return False
+            self._delete(row_id)
+            self.sent[destination] = self.sent.get(destination, 0) + 1
+            sent += 1
+        self.retry_delay.pop(destination, None)
+        if sent == 0 and rejected == 0:
+            return None
+        return True
+
+    def _delete(self, row_id):
+        with self.lock:
+            self.count -= self.db.execute('DELETE FROM outbox WHERE id = ?', (row_id,)).rowcount
+
+    def pending(self, destination=None):
+        with self.lock:
+            if destination is None:
+                return self.db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+            return self.db.execute('SELECT COUNT(*) FROM outbox WHERE destination = ?', (destination,)).fetchone()[0]
+
+    def print_stats(self):
+        print('Outbox Pending:', self.pending(), 'Sent:', self.sent, 'Expired:', self.expired, 'Rejected:', self.rejected,
+              'Discarded:', self.discarded)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
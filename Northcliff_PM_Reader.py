@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Particle Sensor Reader - Gen
+# Reads PMS5003 frames continuously on a background thread, so that the monitor's particle reads never wait for the
+# sensor's UART. Each frame is added to a short ring of recent frames and their average is published as a new PMSample
+# in the latest slot, which is replaced by a single assignment, so the monitor reads it without a lock. Failed reads reset
+# the sensor and are retried with an increasing backoff, without affecting the rest of the monitor.
+
+import collections
+import logging
+import threading
+import time
+
+
+class PMSample(object): # Average of the latest frames, with the same pm_ug_per_m3 method as a PMS5003 reading
+    __slots__ = ('values', 'time', 'frame_count')
+
+    def __init__(self, values, time, frame_count):
+        self.values = values # {1.0: PM1, 2.5: PM2.5, 10: PM10} in ug/m3
+        self.time = time
+        self.frame_count = frame_count # Frames read before this sample. Changes with each new frame
+
+    def pm_ug_per_m3(self, size):
+        return self.values[size]
+
+
+class PMStreamReader(object):
+    def __init__(self, pms5003, read_errors, average_frames=3, initial_backoff=1, max_backoff=60):
+        self.pms5003 = pms5003
+        self.read_errors = read_errors # Tuple of exceptions raised by a failed PMS5003 read
+        self.frames = collections.deque(maxlen=average_frames) # Only used by the reader thread
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.latest = None # The latest PMSample. None until the first frame has been read
+        self.frame_count = 0
+        self.failures = 0
+        self.resets = 0
+        self.consecutive_failures = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='pms5003', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout=2):
+        self.stopping.set()
+        self.thread.join(timeout)
+
+    def age(self):
+        """Seconds since the latest sample, or None if no frame has been read."""
+        latest = self.latest
+        if latest is None:
+            return None
+        return time.time() - latest.time
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                reading = self.pms5003.read() # Waits for the next frame
+            except self.read_errors:
+                logging.info("Failed to read PMS5003")
+                self._recover()
+            except Exception: # e.g. a serial port error. The reader keeps retrying instead of stopping
+                logging.exception("PMS5003 reader error")
+                self._recover()
+            else:
+                self.consecutive_failures = 0
+                self._publish([reading.pm_ug_per_m3(1.0), reading.pm_ug_per_m3(2.5), reading.pm_ug_per_m3(10)])
+
+    def _publish(self, frame):
+        self.frames.append(frame)
+        self.frame_count += 1
+        averages = [round(sum(values) / len(self.frames)) for values in zip(*self.frames)]
+        self.latest = PMSample({1.0: averages[0], 2.5: averages[1], 10: averages[2]}, time.time(), self.frame_count)
+
+    def _recover(self):
+        # The first failure resets the sensor and retries straight away. Later consecutive failures wait for 1, 2, 4...
+        # seconds (up to max_backoff) before each reset
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures > 1:
+            backoff = min(self.max_backoff, self.initial_backoff * 2 ** (self.consecutive_failures - 2))
+            if self.stopping.wait(backoff):
+                return
+        try:
+            self.pms5003.reset()
+            self.resets += 1
+        except Exception:
+            logging.exception("PMS5003 reset failed")
+
+    def print_stats(self):
+        age = self.age()
+        print('Particle Sensor Frames:', self.frame_count, 'Failures:', self.failures, 'Resets:', self.resets,
+              'Latest Frame Age:', None if age is None else round(age, 1))
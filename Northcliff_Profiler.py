@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Stage Profiler - Gen
+# Named timing spans around the monitor's hot-path stages (sensor reads, display rendering, the display push and uploads).
+# Recording a span is two clock reads and a deque append, so the profiler stays on in production. Percentiles are only
+# calculated when a summary is printed: every 5 minutes with the other statistics, or on demand with kill -USR1 <pid>.
+
+import collections
+import signal
+import threading
+import time
+
+import numpy
+
+
+class SpanStats(object):
+    def __init__(self, window):
+        self.durations = collections.deque(maxlen=window) # The latest durations, used for the rolling percentiles
+        self.count = 0
+        self.max_duration = 0
+        self.lock = threading.Lock() # Spans are recorded from several threads while a summary copies the durations
+
+    def record(self, duration):
+        with self.lock:
+            self.durations.append(duration)
+            self.count += 1
+            if duration > self.max_duration:
+                self.max_duration = duration
+
+    def copy(self):
+        with self.lock:
+            return numpy.array(self.durations), self.count, self.max_duration
+
+
+class Span(object):
+    __slots__ = ('stats', 'start')
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.record(time.perf_counter() - self.start)
+        return False
+
+
+class StageProfiler(object):
+    def __init__(self, window=1024):
+        self.window = window # Durations kept for each span's rolling percentiles
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def _stats(self, name):
+        stats = self.spans.get(name)
+        if stats is None:
+            with self.lock:
+                stats = self.spans.setdefault(name, SpanStats(self.window))
+        return stats
+
+    def span(self, name):
+        """Times a with block as the named span."""
+        return Span(self._stats(name))
+
+    def record(self, name, duration):
+        """Records a duration that was measured elsewhere (e.g. by a runtime or display observer)."""
+        self._stats(name).record(duration)
+
+    def summary(self):
+        """Returns {span name: (count, p50, p95, p99, max)} with the percentiles of each span's rolling window in seconds."""
+        rows = {}
+        with self.lock:
+            names = sorted(self.spans)
+        for name in names:
+            durations, count, max_duration = self.spans[name].copy()
+            if len(durations) == 0:
+                continue
+            p50, p95, p99 = numpy.percentile(durations, [50, 95, 99])
+            rows[name] = (count, p50, p95, p99, max_duration)
+        return rows
+
+    def print_summary(self):
+        rows = self.summary()
+        print('{:<36} {:>8} {:>9} {:>9} {:>9} {:>9}'.format('Stage Timings (ms)', 'Count', 'p50', 'p95', 'p99', 'Max'))
+        for name in rows:
+            count, p50, p95, p99, max_duration = rows[name]
+            print('{:<36} {:>8} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(name[:36], count, p50 * 1000, p95 * 1000, p99 * 1000, max_duration * 1000))
+
+    def install_signal_handler(self, signal_number=None):
+        """Prints a summary when the process receives signal_number (SIGUSR1 by default, where it's available)."""
+        if signal_number is None:
+            signal_number = getattr(signal, 'SIGUSR1', None)
+        if signal_number is None:
+            return
+        signal.signal(signal_number, lambda received_signal, frame: self.print_summary())
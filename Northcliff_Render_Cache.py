@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Render Cache - Gen
+# Render-on-change support for the LCD. Each display mode is only re-rendered when the inputs that it declares have changed,
+# and a frame is only pushed to the display when it differs from the last frame that was pushed.
+
+import hashlib
+import time
+
+
+class RenderCache(object):
+    """Records the inputs of the last rendered frame. A render is needed when a mode's inputs (which include the mode
+       itself) differ from the last rendered inputs."""
+    def __init__(self):
+        self.last_inputs = None
+        self.renders = 0
+        self.skips = 0
+
+    def changed(self, inputs):
+        if inputs == self.last_inputs:
+            self.skips += 1
+            return False
+        self.last_inputs = inputs
+        self.renders += 1
+        return True
+
+    def invalidate(self): # Used when a frame is pushed outside the display modes (e.g. an error message)
+        self.last_inputs = None
+
+
+class DeduplicatingDisplay(object):
+    """Wraps the display so that a frame that's identical to the last frame pushed doesn't go through another SPI transfer."""
+    def __init__(self, disp, push_observer=None):
+        self.disp = disp
+        self.push_observer = push_observer # Called with the duration of each frame push (e.g. to export a push time histogram)
+        self.last_hash = None
+        self.frames_pushed = 0
+        self.frames_skipped = 0
+
+    def begin(self):
+        self.disp.begin()
+
+    def display(self, image):
+        frame_hash = hashlib.blake2b(image.mode.encode() + repr(image.size).encode() + image.tobytes(), digest_size=16).digest()
+        if frame_hash == self.last_hash:
+            self.frames_skipped += 1
+            return
+        self.last_hash = frame_hash
+        start = time.monotonic()
+        self.disp.display(image)
+        if self.push_observer is not None:
+            self.push_observer(time.monotonic() - start)
+        self.frames_pushed += 1
+
+    def __getattr__(self, name): # Other display attributes (e.g. width and height) come from the wrapped display
+        return getattr(self.disp, name)
+
+
+def print_render_stats(render_cache, display):
+    print('Display Renders:', render_cache.renders, 'Unchanged Renders Skipped:', render_cache.skips,
+          'Frames Pushed:', display.frames_pushed, 'Duplicate Frames Skipped:', display.frames_skipped)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Ring Buffer - Gen
+# Fixed-capacity display history for one metric, backed by preallocated NumPy arrays of values and a validity mask.
+
+import base64
+import numpy
+
+
+class DisplayRingBuffer(object):
+    """Keeps the last 'capacity' readings, oldest first.
+       Each reading is written twice (at head and head + capacity), so that the ordered history is always the contiguous
+       slice [head:head + capacity]. That allows O(1) appends with no allocation and zero-copy ordered views."""
+    def __init__(self, capacity, fill_value=1):
+        self.capacity = capacity
+        self._values = numpy.full(2 * capacity, fill_value, dtype=numpy.float64)
+        self._valid = numpy.zeros(2 * capacity, dtype=bool)
+        self._head = 0 # Position of the oldest reading
+        self.appends = 0 # Total readings appended, which also identifies the buffer's contents for render-on-change
+
+    def append(self, value, valid=True):
+        head = self._head
+        self._values[head] = value
+        self._values[head + self.capacity] = value
+        self._valid[head] = valid
+        self._valid[head + self.capacity] = valid
+        self._head = (head + 1) % self.capacity
+        self.appends += 1
+
+    def copy_from(self, other):
+        """Replaces the contents with another buffer's (of the same capacity) without allocating, e.g. to update a copy that's rendered on another thread."""
+        numpy.copyto(self._values, other._values)
+        numpy.copyto(self._valid, other._valid)
+        self._head = other._head
+        self.appends = other.appends
+
+    def values(self):
+        """Read-only view of the readings, oldest first."""
+        view = self._values[self._head:self._head + self.capacity]
+        view.flags.writeable = False
+        return view
+
+    def valid(self):
+        """Read-only view of the validity mask, oldest first. False for readings that haven't been received."""
+        view = self._valid[self._head:self._head + self.capacity]
+        view.flags.writeable = False
+        return view
+
+    def latest(self):
+        return self._values[self._head + self.capacity - 1]
+
+    def __len__(self):
+        return self.capacity
+
+    def __getitem__(self, index): # Provides the legacy [value, flag] format
+        if index < 0:
+            index += self.capacity
+        if not 0 <= index < self.capacity:
+            raise IndexError('DisplayRingBuffer index out of range')
+        position = self._head + index
+        return [float(self._values[position]), int(self._valid[position])]
+
+    def to_list(self):
+        return [[float(value), int(flag)] for value, flag in zip(self.values(), self.valid())]
+
+    def serialize(self):
+        """Compact, JSON compatible form for the persistent data log. Values are stored as base64 float32 and the mask as packed bits."""
+        return {"Capacity": self.capacity,
+                "Values": base64.b64encode(self.values().astype('<f4').tobytes()).decode('ascii'),
+                "Valid": base64.b64encode(numpy.packbits(self.valid()).tobytes()).decode('ascii')}
+
+    @classmethod
+    def from_serialized(cls, serialized, capacity):
+        """Restores a buffer from serialize() output or from the legacy list of [value, flag] pairs.
+           The most recent readings are kept if the stored history doesn't match the capacity."""
+        buffer = cls(capacity)
+        if isinstance(serialized, dict):
+            stored_capacity = serialized["Capacity"]
+            values = numpy.frombuffer(base64.b64decode(serialized["Values"]), dtype='<f4')[:stored_capacity]
+            valid = numpy.unpackbits(numpy.frombuffer(base64.b64decode(serialized["Valid"]), dtype=numpy.uint8))[:stored_capacity]
+        else:
+            values = [reading[0] for reading in serialized]
+            valid = [reading[1] for reading in serialized]
+        for value, flag in zip(values[-capacity:], valid[-capacity:]):
+            buffer.append(float(value), bool(flag))
+        return buffer
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Rolling Statistics - Gen
+# Min, max, mean and standard deviation of each reading over sliding time windows (e.g. the last hour and the last 24 hours).
+# Readings are accumulated into fixed-width buckets, and each window keeps running sums of its buckets' means and mean squares
+# for the mean and variance and monotonic deques of the buckets' minimums and maximums, so an update or a query is O(1)
+# amortised however many readings the window holds. Every bucket has the same weight in the mean and standard deviation,
+# whatever its number of readings, so they're weighted by time and periods when readings are taken more often (e.g. when
+# the sampling scheduler speeds up during poor air quality) don't dominate them. The buckets are serialised into the persistent data log, so the windows survive restarts.
+
+import collections
+import math
+
+default_windows = {"1h": [3600, 60], "24h": [86400, 900]} # {name: [window seconds, bucket width seconds]}
+
+
+class StatsBucket(object): # Readings in one bucket width
+    __slots__ = ('start', 'minimum', 'maximum', 'total', 'total_squares', 'count')
+
+    def __init__(self, start, minimum=None, maximum=None, total=0, total_squares=0, count=0):
+        self.start = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.total = total
+        self.total_squares = total_squares
+        self.count = count
+
+    def add(self, value):
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.total += value
+        self.total_squares += value * value
+        self.count += 1
+
+    def mean(self):
+        return self.total / self.count
+
+    def mean_square(self):
+        return self.total_squares / self.count
+
+    def serialize(self):
+        return [self.start, self.minimum, self.maximum, self.total, self.total_squares, self.count]
+
+
+class RollingWindow(object):
+    def __init__(self, window, resolution):
+        self.window = window # Seconds
+        self.resolution = resolution # Bucket width in seconds. The window slides one bucket at a time
+        self.buckets = collections.deque() # Closed buckets in the window, oldest first
+        self.current = None # The open bucket
+        self.minimums = collections.deque() # Closed buckets with increasing minimums. The first has the window's minimum
+        self.maximums = collections.deque() # Closed buckets with decreasing maximums. The first has the window's maximum
+        self.total = 0 # Running sums of the closed buckets' means and mean squares
+        self.total_squares = 0
+        self.count = 0 # Readings in the closed buckets
+        self.closes_since_resum = 0
+
+    def add(self, value, timestamp):
+        bucket_start = timestamp - timestamp % self.resolution
+        if self.current is not None and bucket_start != self.current.start:
+            self._close()
+        if self.current is None:
+            self.current = StatsBucket(bucket_start)
+        self.current.add(value)
+        self._expire(timestamp)
+
+    def _close(self):
+        bucket = self.current
+        self.current = None
+        self.buckets.append(bucket)
+        self.total += bucket.mean()
+        self.total_squares += bucket.mean_square()
+        self.count += bucket.count
+        while self.minimums and self.minimums[-1].minimum >= bucket.minimum:
+            self.minimums.pop()
+        self.minimums.append(bucket)
+        while self.maximums and self.maximums[-1].maximum <= bucket.maximum:
+            self.maximums.pop()
+        self.maximums.append(bucket)
+        # Subtracting expired buckets accumulates rounding errors, so the sums are recalculated once per window's worth of
+        # buckets, which keeps the cost O(1) amortised
+        self.closes_since_resum += 1
+        if self.closes_since_resum >= len(self.buckets):
+            self.total = sum(bucket.mean() for bucket in self.buckets)
+            self.total_squares = sum(bucket.mean_square() for bucket in self.buckets)
+            self.count = sum(bucket.count for bucket in self.buckets)
+            self.closes_since_resum = 0
+
+    def _expire(self, now):
+        oldest_start = now - self.window
+        if self.current is not None and self.current.start + self.resolution <= oldest_start:
+            self._close()
+        while self.buckets and self.buckets[0].start + self.resolution <= oldest_start:
+            bucket = self.buckets.popleft()
+            self.total -= bucket.mean()
+            self.total_squares -= bucket.mean_square()
+            self.count -= bucket.count
+            if self.minimums[0] is bucket:
+                self.minimums.popleft()
+            if self.maximums[0] is bucket:
+                self.maximums.popleft()
+
+    def stats(self, now):
+        """Returns {"Min", "Max", "Mean", "Std", "Count", "Coverage"} for the readings in the window at now, or None if it has
+           none. The mean and standard deviation weight each bucket equally. Coverage is the fraction of the window's buckets
+           that have readings, e.g. 0.5 twelve hours after start-up in a 24 hour window."""
+        self._expire(now)
+        buckets = len(self.buckets)
+        count = self.count
+        total = self.total
+        total_squares = self.total_squares
+        minimums = [self.minimums[0].minimum] if self.minimums else []
+        maximums = [self.maximums[0].maximum] if self.maximums else []
+        if self.current is not None:
+            buckets += 1
+            count += self.current.count
+            total += self.current.mean()
+            total_squares += self.current.mean_square()
+            minimums.append(self.current.minimum)
+            maximums.append(self.current.maximum)
+        if count == 0:
+            return None
+        mean = total / buckets
+        variance = max(0, total_squares / buckets - mean * mean) # Rounding can make a constant reading's variance slightly negative
+        return {"Min": min(minimums), "Max": max(maximums), "Mean": mean, "Std": math.sqrt(variance), "Count": count,
+                "Coverage": min(1, buckets * self.resolution / self.window)}
+
+    def serialize(self):
+        buckets = [bucket.serialize() for bucket in self.buckets]
+        if self.current is not None:
+            buckets.append(self.current.serialize())
+        return {"Window": self.window, "Resolution": self.resolution, "Buckets": buckets}
+
+    def restore(self, serialized, now):
+        """Replays the serialized buckets. They're ignored if the window or resolution have changed."""
+        if serialized.get("Window") != self.window or serialized.get("Resolution") != self.resolution:
+            return False
+        for bucket in serialized["Buckets"]:
+            if self.current is not None:
+                self._close()
+            self.current = StatsBucket(*bucket)
+        self._expire(now)
+        return True
+
+
+class RollingStats(object):
+    def __init__(self, metrics, windows=None):
+        self.windows = default_windows if windows is None else windows
+        self.metrics = {metric: {name: RollingWindow(self.windows[name][0], self.windows[name][1]) for name in self.windows}
+                        for metric in metrics}
+        self.updates = 0
+
+    def update(self, readings, timestamp):
+        """Adds readings ({metric: value}) to every window. Metrics that aren't tracked are ignored."""
+        for metric in readings:
+            if metric in self.metrics and readings[metric] is not None:
+                for window in self.metrics[metric].values():
+                    window.add(readings[metric], timestamp)
+        self.updates += 1
+
+    def stats(self, metric, window_name, now):
+        """Returns the metric's {"Min", "Max", "Mean", "Std", "Count", "Coverage"} over the named window, or None if it's not available."""
+        if metric not in self.metrics or window_name not in self.windows:
+            return None
+        return self.metrics[metric][window_name].stats(now)
+
+    def means(self, window_name, now, places=2):
+        """Returns {metric: mean} over the named window for the metrics that have readings in it."""
+        means = {}
+        for metric in self.metrics:
+            stats = self.stats(metric, window_name, now)
+            if stats is not None:
+                means[metric] = round(stats["Mean"], places)
+        return means
+
+    def serialize(self):
+        return {metric: {name: self.metrics[metric][name].serialize() for name in self.metrics[metric]} for metric in self.metrics}
+
+    def restore(self, serialized, now):
+        restored = 0
+        for metric in serialized:
+            for name in serialized[metric]:
+                if metric in self.metrics and name in self.metrics[metric]:
+                    restored += self.metrics[metric][name].restore(serialized[metric][name], now)
+        return restored
+
+    def print_stats(self, now):
+        print('{:<10} {:>6} {:>10} {:>10} {:>10} {:>10} {:>8}'.format('Rolling', 'Window', 'Min', 'Max', 'Mean', 'Std', 'Count'))
+        for metric in self.metrics:
+            for name in self.windows:
+                stats = self.stats(metric, name, now)
+                if stats is not None:
+                    print('{:<10} {:>6} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>8}'.format(metric, name, stats["Min"], stats["Max"],
+                                                                                           stats["Mean"], stats["Std"], stats["Count"]))
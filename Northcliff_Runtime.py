@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Runtime - Gen
+# Runs the monitor's jobs (sensor acquisition, display rendering, uploads and persistence) as independent asyncio tasks.
+# Blocking jobs run in named executor threads so that a slow sensor read or a network timeout can't stall the other tasks.
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TaskStats(object): # Timing statistics for one task
+    def __init__(self, name, interval):
+        self.name = name
+        self.interval = interval
+        self.runs = 0
+        self.errors = 0
+        self.skipped = 0 # Runs skipped because the previous run was still in flight
+        self.last_start = None
+        self.last_duration = 0
+        self.max_duration = 0
+        self.max_interval = 0 # Worst-case time between the starts of consecutive runs
+
+    def record_start(self, start):
+        if self.last_start is not None:
+            self.max_interval = max(self.max_interval, start - self.last_start)
+        self.last_start = start
+
+    def record_end(self, start, end, error):
+        self.runs += 1
+        if error:
+            self.errors += 1
+        self.last_duration = end - start
+        self.max_duration = max(self.max_duration, self.last_duration)
+
+
+class PeriodicTask(object):
+    def __init__(self, name, interval, job, executor, on_result, first_delay):
+        self.name = name
+        self.interval = interval # Seconds, or a function that returns the time until the next run
+        self.job = job
+        self.executor = executor # None runs the job on the event loop, so it must not block
+        self.on_result = on_result # Called on the event loop with the job's result
+        self.first_delay = first_delay
+        self.wake = None # Set by run_now to start the next run early
+
+
+class MonitorRuntime(object):
+    def __init__(self, duration_observer=None):
+        self.duration_observer = duration_observer # Called with each task's name and duration (e.g. to export duration histograms)
+        self.tasks = []
+        self.executors = {}
+        self.stats = {}
+        self.in_flight = set()
+        self.loop = None
+        self.stopping = None
+
+    def add_executor(self, name, max_workers=1):
+        """A single worker executor serialises its jobs, which is used to keep each device's driver calls on one thread."""
+        self.executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    def add_periodic_task(self, name, interval, job, executor=None, on_result=None, first_delay=0):
+        self.tasks.append(PeriodicTask(name, interval, job, executor, on_result, first_delay))
+        self.stats[name] = TaskStats(name, interval)
+
+    def submit(self, name, job, executor, on_result=None):
+        """Run a one-off job without waiting for it. Returns False if the previous job with the same name is still running."""
+        if name not in self.stats:
+            self.stats[name] = TaskStats(name, None)
+        if name in self.in_flight:
+            self.stats[name].skipped += 1
+            return False
+        self.in_flight.add(name)
+        self.loop.create_task(self._call(name, job, executor, on_result))
+        return True
+
+    def running(self, name):
+        """True while the named task or job is running."""
+        return name in self.in_flight
+
+    def run_now(self, name):
+        """Starts the named periodic task's next run now, instead of at the end of its current interval
+           (e.g. when an adaptive task's interval has been shortened). Must be called on the event loop."""
+        for task in self.tasks:
+            if task.name == name and task.wake is not None:
+                task.wake.set()
+
+    def stop(self):
+        if self.stopping is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    def run(self):
+        try:
+            asyncio.run(self._main())
+        finally:
+            for executor in self.executors.values():
+                executor.shutdown(wait=False)
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        runners = [asyncio.create_task(self._run_periodic(task)) for task in self.tasks]
+        await self.stopping.wait()
+        for runner in runners:
+            runner.cancel()
+        await asyncio.gather(*runners, return_exceptions=True)
+
+    async def _run_periodic(self, task):
+        task.wake = asyncio.Event()
+        if task.first_delay > 0:
+            try:
+                await asyncio.wait_for(task.wake.wait(), task.first_delay)
+                task.wake.clear()
+            except asyncio.TimeoutError:
+                pass
+        next_run = self.loop.time()
+        while True:
+            if task.name in self.in_flight:
+                self.stats[task.name].skipped += 1
+            else:
+                self.in_flight.add(task.name)
+                await self._call(task.name, task.job, task.executor, task.on_result)
+            # Fixed rate scheduling that doesn't try to catch up on missed runs. An adaptive task's interval is a function
+            # that's called after each run
+            interval = task.interval() if callable(task.interval) else task.interval
+            next_run = max(next_run + interval, self.loop.time())
+            try:
+                await asyncio.wait_for(task.wake.wait(), next_run - self.loop.time())
+                task.wake.clear()
+                next_run = self.loop.time()
+            except asyncio.TimeoutError:
+                pass
+
+    async def _call(self, name, job, executor, on_result):
+        stats = self.stats[name]
+        start = time.monotonic()
+        stats.record_start(start)
+        error = False
+        try:
+            if executor is None:
+                result = job()
+            else:
+                result = await self.loop.run_in_executor(self.executors[executor], job)
+            if on_result is not None:
+                on_result(result)
+        except Exception:
+            error = True
+            logging.exception('Runtime task ' + name + ' failed')
+        finally:
+            self.in_flight.discard(name)
+            end = time.monotonic()
+            stats.record_end(start, end, error)
+            if self.duration_observer is not None:
+                self.duration_observer(name, end - start)
+
+    def print_stats(self):
+        for name in self.stats:
+            stats = self.stats[name]
+            print(name, 'Runs:', stats.runs, 'Errors:', stats.errors, 'Skipped:', stats.skipped,
+                  'Last Duration:', round(stats.last_duration, 3), 'Max Duration:', round(stats.max_duration, 3),
+                  'Max Interval:', round(stats.max_interval, 3))
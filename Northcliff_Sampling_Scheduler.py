@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Sampling Scheduler - Gen
+# Sets each sensor's sampling interval from the "sampling_schedule" in config.json. With adaptive sampling enabled, a sensor
+# is sampled at its min_interval as soon as one of its readings changes by more than its change threshold between samples or
+# the air quality level reaches fast_sampling_aqi_level. Its interval is then lengthened in steps (up to max_interval) after
+# each run of stable samples, so that stable periods use less CPU and sensor time while pollution events are sampled quickly.
+# e.g. "Climate and Gas": {"base_interval": 150, "min_interval": 30, "max_interval": 300, "change_thresholds": {"Temp": 1, "Red": 2}}
+
+default_sampling_schedule = {"Particle": {"base_interval": 0.5, "min_interval": 0.5, "max_interval": 5,
+                                          "change_thresholds": {"P1": 5, "P2.5": 5, "P10": 8}},
+                             "Climate and Gas": {"base_interval": 150, "min_interval": 30, "max_interval": 300,
+                                                 "change_thresholds": {"Temp": 1, "Hum": 5, "Bar": 1, "Oxi": 0.2, "Red": 2, "NH3": 1}}}
+
+
+class AdaptiveSampler(object):
+    def __init__(self, name, base_interval, min_interval=None, max_interval=None, change_thresholds=None, adaptive=True,
+                 fast_sampling_aqi_level=2, stable_samples=5, backoff_factor=1.5):
+        self.name = name
+        self.base_interval = base_interval # The first interval, and the only interval if adaptive sampling is disabled
+        self.min_interval = base_interval if min_interval is None else min_interval
+        self.max_interval = base_interval if max_interval is None else max_interval
+        self.change_thresholds = change_thresholds or {} # {reading: change between samples that starts fast sampling}
+        self.adaptive = adaptive
+        self.fast_sampling_aqi_level = fast_sampling_aqi_level # Air quality level (0 Great to 4 Bad) that starts fast sampling
+        self.stable_samples = stable_samples # Consecutive stable samples before the interval is lengthened
+        self.backoff_factor = backoff_factor
+        self.current_interval = base_interval
+        self.previous_readings = {}
+        self.stable_count = 0
+        self.samples = 0
+        self.speed_ups = 0
+        self.back_offs = 0
+
+    def interval(self):
+        """The time until the next sample. Passed to the runtime as the periodic task's interval."""
+        return self.current_interval
+
+    def observe(self, readings, aqi_level):
+        """Updates the interval after a sample. readings is {reading: value} for the readings taken by the sample.
+           Readings that are missing (e.g. gas readings while the gas sensors warm up) don't affect the interval."""
+        self.samples += 1
+        changed = [reading for reading in readings if reading in self.change_thresholds and reading in self.previous_readings and
+                   abs(readings[reading] - self.previous_readings[reading]) > self.change_thresholds[reading]]
+        self.previous_readings = dict(readings)
+        if not self.adaptive:
+            return self.current_interval
+        if changed or aqi_level >= self.fast_sampling_aqi_level:
+            self.start_fast_sampling(', '.join(changed) if changed else 'Air Quality Level ' + str(aqi_level))
+        else:
+            self.stable_count += 1
+            if self.stable_count >= self.stable_samples and self.current_interval < self.max_interval:
+                self.stable_count = 0
+                self.current_interval = min(self.max_interval, round(self.current_interval * self.backoff_factor, 1))
+                self.back_offs += 1
+        return self.current_interval
+
+    def start_fast_sampling(self, reason):
+        """Sets the min_interval. Returns True if the interval has been shortened."""
+        self.stable_count = 0
+        if not self.adaptive or self.current_interval <= self.min_interval:
+            return False
+        print(self.name, 'Fast Sampling Started by', reason, 'Interval:', self.min_interval)
+        self.current_interval = self.min_interval
+        self.speed_ups += 1
+        return True
+
+
+class SamplingScheduler(object):
+    def __init__(self, schedule=None, adaptive=False, fast_sampling_aqi_level=2):
+        # Sensors that are missing from schedule, and settings that are missing from a sensor's schedule, use the defaults
+        schedule = schedule or {}
+        self.fast_sampling_aqi_level = fast_sampling_aqi_level
+        self.samplers = {}
+        for name in default_sampling_schedule:
+            settings = dict(default_sampling_schedule[name])
+            settings.update(schedule.get(name, {}))
+            self.samplers[name] = AdaptiveSampler(name, settings["base_interval"], settings["min_interval"], settings["max_interval"],
+                                                  settings["change_thresholds"], adaptive, fast_sampling_aqi_level,
+                                                  settings.get("stable_samples", 5), settings.get("backoff_factor", 1.5))
+            if not settings["min_interval"] <= settings["base_interval"] <= settings["max_interval"]:
+                print('Sampling Schedule Warning.', name, 'base_interval should be between its min_interval and max_interval')
+
+    def __getitem__(self, name):
+        return self.samplers[name]
+
+    def observe(self, name, readings, aqi_level):
+        """Updates the named sensor's interval after a sample. An air quality level at or above fast_sampling_aqi_level
+           also starts fast sampling of the other sensors. Returns the names of the other sensors whose intervals have been
+           shortened, so that their next samples can be brought forward."""
+        self.samplers[name].observe(readings, aqi_level)
+        if aqi_level < self.fast_sampling_aqi_level:
+            return []
+        return [other for other in self.samplers if other != name and
+                self.samplers[other].start_fast_sampling(name + ' Air Quality Level ' + str(aqi_level))]
+
+    def intervals(self):
+        return {name: self.samplers[name].current_interval for name in self.samplers}
+
+    def print_stats(self):
+        for name in self.samplers:
+            sampler = self.samplers[name]
+            print(name, 'Sampling Interval:', sampler.current_interval, 'Samples:', sampler.samples, 'Fast Sampling Starts:',
+                  sampler.speed_ups, 'Back Offs:', sampler.back_offs)
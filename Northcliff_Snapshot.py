@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Persistent State Snapshots - Gen
+# Saves the monitor's persistent state as separate sections (e.g. fast-changing scalars, gas calibration lists and display
+# history), each in its own file with a SHA-256 checksum. Only sections whose contents have changed since the last snapshot
+# are rewritten, and every file is written to a temporary file, synced and renamed, so a power cut leaves either the old or
+# the new version of a section, never a partly written one.
+# Each snapshot has a generation number. Changed sections are written to new files that record their generation, then a
+# manifest listing the generation of every section is written last, and only then are the superseded section files removed.
+# A power cut part way through a snapshot therefore leaves the previous manifest, which still points to the previous
+# generation's files, so the sections that are read back always come from the same snapshot.
+
+import hashlib
+import json
+import os
+import threading
+
+
+class SnapshotStore(object):
+    def __init__(self, base_path):
+        self.base_path = base_path # Section files are named <base_path>.<section>.<generation>.json
+        self.manifest_path = base_path + '.manifest.json'
+        self.directory = os.path.dirname(os.path.abspath(base_path))
+        self.manifest = None # {"Generation": the last snapshot's generation, "Sections": {section name: generation of its file}}
+        self.checksums = {} # Checksums of the section contents last written or read
+        self.lock = threading.Lock()
+        self.last_bytes_written = 0
+        self.total_bytes_written = 0
+        self.sections_written = 0
+        self.sections_skipped = 0
+        self.snapshots = 0
+
+    def _path(self, section, generation=None):
+        if generation is None: # Section files written before generations were added
+            return self.base_path + '.' + section.replace(' ', '_') + '.json'
+        return self.base_path + '.' + section.replace(' ', '_') + '.' + str(generation) + '.json'
+
+    def encode(self, sections):
+        """Serializes {section name: JSON compatible data}. Call this where the state is consistent (e.g. on the event loop),
+           then pass the result to write()."""
+        return {section: json.dumps(sections[section], sort_keys=True).encode('utf-8') for section in sections}
+
+    def write(self, encoded_sections):
+        """Writes the sections that have changed since they were last written as a new generation, then the manifest.
+           Returns the number of bytes written."""
+        bytes_written = 0
+        with self.lock:
+            if self.manifest is None:
+                self.manifest = self._read_manifest() or {"Generation": 0, "Sections": {}}
+            generation = self.manifest["Generation"] + 1
+            sections = dict(self.manifest["Sections"])
+            superseded = []
+            for section in encoded_sections:
+                payload = encoded_sections[section]
+                checksum = hashlib.sha256(payload).hexdigest()
+                if self.checksums.get(section) == checksum and section in sections:
+                    self.sections_skipped += 1
+                    continue
+                bytes_written += self._write_file(self._path(section, generation),
+                                                  checksum.encode('ascii') + b' ' + str(generation).encode('ascii') + b'\n' + payload)
+                superseded.append(self._path(section, sections.get(section)))
+                sections[section] = generation
+                self.checksums[section] = checksum
+                self.sections_written += 1
+            if bytes_written:
+                self._sync_directory() # Makes the section renames durable before the manifest refers to them
+                manifest = {"Generation": generation, "Sections": sections}
+                payload = json.dumps(manifest, sort_keys=True).encode('utf-8')
+                bytes_written += self._write_file(self.manifest_path, hashlib.sha256(payload).hexdigest().encode('ascii') + b'\n' + payload)
+                self._sync_directory()
+                self.manifest = manifest
+                for path in superseded:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            self.last_bytes_written = bytes_written
+            self.total_bytes_written += bytes_written
+            self.snapshots += 1
+        return bytes_written
+
+    def _write_file(self, path, contents):
+        with open(path + '.tmp', 'wb') as f:
+            f.write(contents)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        return len(contents)
+
+    def _sync_directory(self):
+        try:
+            directory = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(directory)
+        except OSError:
+            pass
+        finally:
+            os.close(directory)
+
+    def _read_file(self, path):
+        # Returns the header fields and payload of a checksummed file, or None if it's missing or fails its checksum
+        try:
+            with open(path, 'rb') as f:
+                header, payload = f.read().split(b'\n', 1)
+        except (IOError, ValueError):
+            return None
+        fields = header.split(b' ')
+        if hashlib.sha256(payload).hexdigest().encode('ascii') != fields[0]:
+            return None
+        return fields, payload
+
+    def _read_manifest(self):
+        contents = self._read_file(self.manifest_path)
+        if contents is None:
+            return None
+        try:
+            return json.loads(contents[1].decode('utf-8'))
+        except ValueError:
+            return None
+
+    def read(self, sections):
+        """Returns the merged data of the named sections of the last complete snapshot whose files exist and pass their
+           checksum. A missing or corrupt section, or one from a different generation to the manifest's, is reported and left out."""
+        data = {}
+        with self.lock:
+            if os.path.exists(self.manifest_path):
+                self.manifest = self._read_manifest()
+                if self.manifest is None:
+                    print('Persistent Data Snapshot Manifest Failed Checksum. Ignoring the Snapshot')
+                    return data
+                generations = self.manifest["Sections"]
+            else: # A snapshot written before generations were added has no manifest
+                generations = None
+            for section in sections:
+                if generations is not None and section not in generations:
+                    print('Persistent Data Snapshot', section, 'Section Not Available')
+                    continue
+                generation = None if generations is None else generations[section]
+                contents = self._read_file(self._path(section, generation))
+                if contents is None:
+                    print('Persistent Data Snapshot', section, 'Section Not Available or Failed Checksum. Ignoring it')
+                    continue
+                fields, payload = contents
+                if generation is not None and fields[1:] != [str(generation).encode('ascii')]:
+                    print('Persistent Data Snapshot', section, 'Section Is From a Different Generation. Ignoring it')
+                    continue
+                data.update(json.loads(payload.decode('utf-8')))
+                if generation is not None:
+                    self.checksums[section] = fields[0].decode('ascii')
+        return data
+
+    def print_stats(self):
+        print('Persistent Data Snapshot Generation:', self.manifest["Generation"] if self.manifest is not None else 0,
+              'Bytes Written:', self.last_bytes_written, 'Total:', self.total_bytes_written,
+              'Sections Written:', self.sections_written, 'Skipped (Unchanged):', self.sections_skipped)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor Time Series Store - Gen
+# On-device history of the monitor's readings. Each metric has an append-only file of fixed-width records for each tier:
+# raw readings and 1-minute and 1-hour rollups with min/max/mean. Files are memory-mapped for reads, so a range query is two
+# binary searches and a slice, even over months of data. Each tier has its own retention period.
+
+import os
+import threading
+import time
+
+import numpy
+
+record_dtype = numpy.dtype([('Time', '<f8'), ('Min', '<f4'), ('Max', '<f4'), ('Mean', '<f4'), ('Count', '<u4')])
+tier_widths = {"raw": 0, "1m": 60, "1h": 3600} # Rollup bucket width in seconds for each tier
+default_retention = {"raw": 7 * 86400, "1m": 90 * 86400, "1h": None} # Seconds of history kept in each tier. None keeps everything
+
+
+class RollupBucket(object): # Accumulates the raw readings for one rollup period
+    def __init__(self, start):
+        self.start = start
+        self.minimum = None
+        self.maximum = None
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.total += value
+        self.count += 1
+
+    def record(self):
+        return (self.start, self.minimum, self.maximum, self.total / self.count, self.count)
+
+
+class TimeSeriesStore(object):
+    def __init__(self, directory, retention=None):
+        self.directory = directory
+        self.retention = dict(default_retention)
+        if retention is not None:
+            self.retention.update(retention)
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.files = {} # Open append handles, keyed by (metric, tier)
+        self.last_time = {} # Time of each metric's last raw reading
+        self.buckets = {} # Open rollup buckets, keyed by (metric, tier)
+        self.rejected = 0 # Readings that weren't later than the metric's last reading (e.g. after a clock step)
+
+    def _path(self, metric, tier):
+        return os.path.join(self.directory, metric + '.' + tier + '.ts')
+
+    def _file(self, metric, tier):
+        key = (metric, tier)
+        if key not in self.files:
+            self.files[key] = open(self._path(metric, tier), 'ab')
+        return self.files[key]
+
+    def _map(self, metric, tier):
+        """Read-only memory map of a tier's records. A partly written record at the end of the file is ignored."""
+        path = self._path(metric, tier)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        count = size // record_dtype.itemsize
+        if count == 0:
+            return numpy.zeros(0, dtype=record_dtype)
+        return numpy.memmap(path, dtype=record_dtype, mode='r', shape=(count,))
+
+    def _open_metric(self, metric):
+        # Picks up the metric's last reading time and, after a restart, rolls up the raw readings that arrived after each
+        # tier's last rollup. The latest period is left open for new readings
+        raw = self._map(metric, 'raw')
+        self.last_time[metric] = float(raw['Time'][-1]) if len(raw) else 0
+        for tier in tier_widths:
+            width = tier_widths[tier]
+            if width == 0 or len(raw) == 0:
+                continue
+            rollups = self._map(metric, tier)
+            rolled_up_until = float(rollups['Time'][-1]) + width if len(rollups) else -1
+            pending = raw[numpy.searchsorted(raw['Time'], rolled_up_until, side='left'):]
+            bucket = None
+            for timestamp, value in zip(pending['Time'], pending['Mean']):
+                start = float(timestamp) - float(timestamp) % width
+                if bucket is not None and bucket.start != start:
+                    self._file(metric, tier).write(numpy.array([bucket.record()], dtype=record_dtype).tobytes())
+                    bucket = None
+                if bucket is None:
+                    bucket = RollupBucket(start)
+                bucket.add(float(value))
+            if bucket is not None:
+                self.buckets[(metric, tier)] = bucket
+
+    def append(self, readings, timestamp=None):
+        """Appends a dict of {metric: value} readings taken at timestamp (default now). Readings that are None are skipped."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            for metric in readings:
+                value = readings[metric]
+                if value is None:
+                    continue
+                if metric not in self.last_time:
+                    self._open_metric(metric)
+                if timestamp <= self.last_time[metric]:
+                    self.rejected += 1
+                    continue
+                self.last_time[metric] = timestamp
+                value = float(value)
+                self._file(metric, 'raw').write(numpy.array([(timestamp, value, value, value, 1)], dtype=record_dtype).tobytes())
+                for tier in tier_widths:
+                    if tier_widths[tier]:
+                        self._roll_up(metric, tier, timestamp, value)
+            for handle in self.files.values():
+                handle.flush()
+
+    def _roll_up(self, metric, tier, timestamp, value):
+        start = timestamp - timestamp % tier_widths[tier]
+        bucket = self.buckets.get((metric, tier))
+        if bucket is not None and bucket.start != start: # The reading starts a new period, so the previous period is complete
+            self._file(metric, tier).write(numpy.array([bucket.record()], dtype=record_dtype).tobytes())
+            bucket = None
+        if bucket is None:
+            bucket = self.buckets[(metric, tier)] = RollupBucket(start)
+        bucket.add(value)
+
+    def query(self, metric, start=None, end=None, tier="raw"):
+        """Returns the metric's records with start <= Time < end as a read-only structured array with
+           Time, Min, Max, Mean and Count fields. Rollup records are timestamped with the start of their period."""
+        records = self._map(metric, tier)
+        first = 0 if start is None else numpy.searchsorted(records['Time'], start, side='left')
+        last = len(records) if end is None else numpy.searchsorted(records['Time'], end, side='left')
+        return records[first:last]
+
+    def metrics(self):
+        return sorted(set(file_name.rsplit('.', 2)[0] for file_name in os.listdir(self.directory) if file_name.endswith('.ts')))
+
+    def apply_retention(self, now=None):
+        """Removes each tier's records that are older than its retention period. Files are rewritten and atomically replaced,
+           so a crash during retention leaves either the old or the new file."""
+        if now is None:
+            now = time.time()
+        removed = 0
+        with self.lock:
+            for metric in self.metrics():
+                for tier in tier_widths:
+                    if self.retention[tier] is None:
+                        continue
+                    records = self._map(metric, tier)
+                    first = numpy.searchsorted(records['Time'], now - self.retention[tier], side='left')
+                    if first == 0:
+                        continue
+                    kept = numpy.array(records[first:])
+                    del records
+                    handle = self.files.pop((metric, tier), None)
+                    if handle is not None:
+                        handle.close()
+                    path = self._path(metric, tier)
+                    with open(path + '.tmp', 'wb') as f:
+                        f.write(kept.tobytes())
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(path + '.tmp', path)
+                    removed += first
+        return removed
+
+    def print_stats(self):
+        sizes = 0
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.ts'):
+                sizes += os.path.getsize(os.path.join(self.directory, file_name))
+        print('Time Series Store Metrics:', len(self.metrics()), 'Size:', round(sizes / 1024), 'kB', 'Rejected Readings:', self.rejected)
+
+    def close(self):
+        with self.lock:
+            for handle in self.files.values():
+                handle.close()
+            self.files = {}
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#Northcliff Environment Monitor HTTP Transport - Gen
+# Shared HTTP transport for Luftdaten and Adafruit IO requests.
+# Keeps one persistent keep-alive session per host (so TCP and TLS handshakes are only made when a connection is opened),
+# caches its own DNS lookups (without affecting the rest of the process), limits the number of concurrent requests per host and can limit the total time taken by an upload cycle.
+
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+
+class DnsCache(object):
+    """Caches the addresses of the hosts used by the transport's connections. Only the transport's connections use it, so
+       other lookups in the process (e.g. mqtt) aren't affected. A stale entry is used if a lookup fails, so a DNS outage
+       doesn't stop uploads to a known host."""
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def addresses(self, host, port):
+        """The host's IP addresses, in getaddrinfo's order."""
+        key = (host, port)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        try:
+            addresses = []
+            for family, socket_type, protocol, canonical_name, address in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+                if address[0] not in addresses:
+                    addresses.append(address[0])
+        except socket.gaierror:
+            if entry is not None:
+                return entry[1]
+            raise
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+
+def cached_dns_pool_class(pool_class, connection_class, dns_cache):
+    """A urllib3 connection pool class whose connections connect to the dns_cache's addresses for their host. The host
+       name is still used for the Host header, TLS SNI and certificate checks."""
+    class CachedDnsConnection(connection_class):
+        def _new_conn(self):
+            host = self._dns_host
+            addresses = dns_cache.addresses(host, self.port)
+            try:
+                for address in addresses[:-1]: # Like create_connection, each address is tried in turn
+                    self._dns_host = address
+                    try:
+                        return super()._new_conn()
+                    except (NewConnectionError, ConnectTimeoutError):
+                        pass
+                self._dns_host = addresses[-1]
+                return super()._new_conn()
+            finally:
+                self._dns_host = host
+
+    class CachedDnsConnectionPool(pool_class):
+        ConnectionCls = CachedDnsConnection
+
+    return CachedDnsConnectionPool
+
+
+class CachedDnsAdapter(HTTPAdapter):
+    def __init__(self, dns_cache, **kwargs):
+        self.dns_cache = dns_cache # Set before HTTPAdapter.__init__, which calls init_poolmanager
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        if self.dns_cache is not None:
+            self.poolmanager.pool_classes_by_scheme = {"http": cached_dns_pool_class(HTTPConnectionPool, HTTPConnection, self.dns_cache),
+                                                       "https": cached_dns_pool_class(HTTPSConnectionPool, HTTPSConnection, self.dns_cache)}
+
+
+class HostStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+    def record(self, latency, error):
+        self.requests += 1
+        if error:
+            self.errors += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+
+class HttpTransport(object):
+    def __init__(self, max_connections_per_host=2, dns_ttl=300, default_timeout=5):
+        self.max_connections_per_host = max_connections_per_host
+        self.default_timeout = default_timeout
+        self.sessions = {}
+        self.host_limits = {}
+        self.host_stats = {}
+        self.lock = threading.Lock()
+        self.local = threading.local() # Holds each thread's upload cycle deadline
+        self.dns_cache = DnsCache(dns_ttl) if dns_ttl > 0 else None
+
+    def _host(self, host):
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = CachedDnsAdapter(self.dns_cache, pool_connections=1, pool_maxsize=self.max_connections_per_host)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self.sessions[host] = session
+                self.host_limits[host] = threading.BoundedSemaphore(self.max_connections_per_host)
+                self.host_stats[host] = HostStats()
+            return self.sessions[host], self.host_limits[host], self.host_stats[host]
+
+    @contextmanager
+    def cycle(self, time_budget):
+        """Limits the total time taken by the requests made by this thread inside the with block."""
+        self.local.deadline = time.monotonic() + time_budget
+        try:
+            yield
+        finally:
+            self.local.deadline = None
+
+    def _remaining_time(self):
+        deadline = getattr(self.local, 'deadline', None)
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.exceptions.Timeout('Upload cycle time budget exhausted')
+        return remaining
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """Same arguments, return value and exceptions as requests.request."""
+        if timeout is None:
+            timeout = self.default_timeout
+        session, limit, stats = self._host(urlsplit(url).hostname)
+        remaining = self._remaining_time()
+        if not limit.acquire(timeout=remaining):
+            raise requests.exceptions.Timeout('Upload cycle time budget exhausted waiting for a connection')
+        try:
+            remaining = self._remaining_time()
+            if remaining is not None:
+                timeout = min(timeout, remaining)
+            start = time.monotonic()
+            error = True
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+                error = False
+                return response
+            finally:
+                stats.record(time.monotonic() - start, error)
+        finally:
+            limit.release()
+
+    def get_stats(self):
+        """Request counts, latencies and connection reuse rate for each host."""
+        stats = {}
+        with self.lock:
+            hosts = list(self.sessions)
+        for host in hosts:
+            host_stats = self.host_stats[host]
+            connections = 0
+            pooled_requests = 0
+            for adapter in set(self.sessions[host].adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        connections += pool.num_connections
+                        pooled_requests += pool.num_requests
+            stats[host] = {"Requests": host_stats.requests, "Errors": host_stats.errors, "Connections": connections,
+                           "Reuse Rate": round(1 - connections / pooled_requests, 3) if pooled_requests else 0,
+                           "Mean Latency": round(host_stats.total_latency / host_stats.requests, 3) if host_stats.requests else 0,
+                           "Max Latency": round(host_stats.max_latency, 3)}
+        return stats
+
+    def print_stats(self):
+        stats = self.get_stats()
+        for host in stats:
+            print('HTTP Transport', host, stats[host])
+        if self.dns_cache is not None:
+            print('HTTP Transport DNS Cache Hits:', self.dns_cache.hits, 'Misses:', self.dns_cache.misses)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
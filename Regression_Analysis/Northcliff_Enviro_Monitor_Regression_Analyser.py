@@ -1,80 +1,196 @@
+import argparse
+import html
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import PolynomialFeatures
 from sklearn.metrics import r2_score
 
+# Interactive by default. --batch fits every pair in a process pool, saves the plots with the Agg backend and writes
+# regression_summary.json and regression_report.html for each log, so that a fleet's logs can be re-analysed by a script. e.g.
+# python3 Northcliff_Enviro_Monitor_Regression_Analyser.py --batch --output-dir reports unit1/environment_log_data.jsonl unit2/environment_log_data.jsonl
+parser = argparse.ArgumentParser(description='Northcliff Enviro Monitor Regression Analyser')
+parser.add_argument('log_files', nargs='*', default=['environment_log_data.jsonl'], help='Environment log files (JSON Lines, CSV or legacy .json)')
+parser.add_argument('--batch', action='store_true', help='Run without displaying plots and write JSON and HTML reports')
+parser.add_argument('--output-dir', default='regression_reports', help='Batch mode report directory')
+parser.add_argument('--workers', type=int, default=None, help='Batch mode worker processes (default: one per CPU)')
+
+import matplotlib
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import seaborn as sns
+
 def lin_regplot(X, y, model):
     plt.scatter(X, y, c='steelblue', edgecolor='white', s=70)
     plt.plot(X, model.predict(X), color='black', lw=2)
     return None
 
-df = pd.read_json('environment_log_data.json')
+def load_environment_log(file_name, backup_count=5):
+    # Reads the monitor's JSON Lines or CSV environment log, including its rotated files (oldest first).
+    # A .json file is read as a legacy log that has been converted to a JSON array
+    if file_name.endswith('.json'):
+        return pd.read_json(file_name)
+    files = [file_name + '.' + str(number) for number in range(backup_count, 0, -1) if os.path.exists(file_name + '.' + str(number))]
+    files.append(file_name)
+    if file_name.endswith('.csv'):
+        frames = [pd.read_csv(f) for f in files]
+    else:
+        frames = [pd.read_json(f, lines=True) for f in files]
+    return pd.concat(frames, ignore_index=True)
 
 regression_pairs = {'Temp and Hum Performance': [['Output Temp', 'Real Temperature', 0], ['Output Humidity', 'Real Humidity', 0], ['Raw Temperature', 'Real Temperature', 0], ['Raw Humidity', 'Real Humidity', 0], ['Raw Bar', 'Output Bar', 0]],
                     'Gas Sensor Performance': [['Raw Temperature', 'Raw RedRS', 23], ['Raw Humidity', 'Raw RedRS', 50], ['Raw Bar', 'Raw RedRS', 1013],
                                                ['Raw Temperature', 'Raw OxiRS', 23], ['Raw Humidity', 'Raw OxiRS', 50], ['Raw Bar', 'Raw OxiRS', 1013],
                                                ['Raw Temperature', 'Raw NH3RS', 23], ['Raw Humidity', 'Raw NH3RS', 50], ['Raw Bar', 'Raw NH3RS', 1013]]}
-regression_summary = {performance_type:{} for performance_type in regression_pairs}
-print(regression_summary)
-
-for performance_type in regression_pairs:
-    for pair in range(len(regression_pairs[performance_type])):
-        X = df[[regression_pairs[performance_type][pair][0]]].values - regression_pairs[performance_type][pair][2]
-        y = df[[regression_pairs[performance_type][pair][1]]].values
-        regr = LinearRegression()
-        quadratic = PolynomialFeatures(degree=2)
-        cubic = PolynomialFeatures(degree=3)
-        X_quad = quadratic.fit_transform(X)
-        X_cubic = cubic.fit_transform(X)
-        X_fit = np.arange(X.min(), X.max(), 1) [:, np.newaxis]
-        regr = regr.fit(X, y)
-        y_lin_fit = regr.predict(X_fit)
-        linear_r2 = r2_score(y, regr.predict(X))
-        print('')
-        print(regression_pairs[performance_type][pair][0] + ' and ' + regression_pairs[performance_type][pair][1])
-        print('Slope: %.4f' % regr.coef_[0])
-        print('Intercept: %.4f' % regr.intercept_)
-        print('R2: %.2f' % linear_r2)
-        regression_summary[performance_type][regression_pairs[performance_type][pair][0] + ' ' + regression_pairs[performance_type][pair][1]] = {'Slope': regr.coef_[0], 'Intercept': regr.intercept_, 'R2': linear_r2}
-        regr = regr.fit(X_quad, y)
-        y_quad_fit = regr.predict(quadratic.fit_transform(X_fit))
-        reg_label = "Inliers coef:%s - b:%0.4f" % \
-                    (np.array2string(regr.coef_,
-                                     formatter={'float_kind': lambda fk: "%.4f" % fk}),
-                    regr.intercept_)
-        print('Quad Fit', reg_label)
-        quadratic_r2 = r2_score(y, regr.predict(X_quad))
-        print('R2: %.2f' % quadratic_r2)
-        regr = regr.fit(X_cubic, y)
-        y_cubic_fit = regr.predict(cubic.fit_transform(X_fit))
-        reg_label = "Inliers coef:%s - b:%0.5f" % \
-                    (np.array2string(regr.coef_,
-                                     formatter={'float_kind': lambda fk: "%.5f" % fk}),
-                    regr.intercept_)
-        print('Cubic Fit', reg_label)
-        cubic_r2 = r2_score(y, regr.predict(X_cubic))
-        print('R2: %.2f' % cubic_r2)
-        plt.scatter(X, y, label='training points', color='lightgray')
-        plt.plot(X_fit, y_lin_fit, label='linear (d=1), $R^2=%.2f$' % linear_r2, color='blue', lw=2, linestyle=':')
-        plt.plot(X_fit, y_quad_fit, label='quadratic (d=2), $R^2=%.2f$' % quadratic_r2, color='red', lw=2, linestyle='-')
-        plt.plot(X_fit, y_cubic_fit, label='cubic (d=3), $R^2=%.2f$' % cubic_r2, color='green', lw=2, linestyle='--') 
-        plt.xlabel(regression_pairs[performance_type][pair][0])
-        plt.ylabel(regression_pairs[performance_type][pair][1])
-        plt.legend(loc='lower right')
-        plt.show()
-
-for pt in regression_summary:
+
+def fit_pair(X, y):
+    # Fits linear, quadratic and cubic models. Returns the coefficients, R2 values and fitted curves
+    regr = LinearRegression()
+    quadratic = PolynomialFeatures(degree=2)
+    cubic = PolynomialFeatures(degree=3)
+    X_quad = quadratic.fit_transform(X)
+    X_cubic = cubic.fit_transform(X)
+    X_fit = np.arange(X.min(), X.max(), 1) [:, np.newaxis]
+    if len(X_fit) < 2: # The range is less than 1 (e.g. a constant column), so the curves are drawn between its ends
+        X_fit = np.array([X.min(), X.max()], dtype=float) [:, np.newaxis]
+    regr = regr.fit(X, y)
+    fit = {'Slope': float(regr.coef_[0][0]), 'Intercept': float(regr.intercept_[0]), 'R2': float(r2_score(y, regr.predict(X))),
+           'X Fit': X_fit, 'Linear Fit': regr.predict(X_fit)}
+    regr = regr.fit(X_quad, y)
+    fit['Quadratic Coefficients'] = regr.coef_[0].tolist()
+    fit['Quadratic Intercept'] = float(regr.intercept_[0])
+    fit['Quadratic R2'] = float(r2_score(y, regr.predict(X_quad)))
+    fit['Quadratic Fit'] = regr.predict(quadratic.fit_transform(X_fit))
+    regr = regr.fit(X_cubic, y)
+    fit['Cubic Coefficients'] = regr.coef_[0].tolist()
+    fit['Cubic Intercept'] = float(regr.intercept_[0])
+    fit['Cubic R2'] = float(r2_score(y, regr.predict(X_cubic)))
+    fit['Cubic Fit'] = regr.predict(cubic.fit_transform(X_fit))
+    return fit
+
+def print_fit(x_name, y_name, fit):
     print('')
-    print(pt, 'Summary')
-    for pair in (regression_summary[pt]):
-        print(pair, regression_summary[pt][pair])
+    print(x_name + ' and ' + y_name)
+    print('Slope: %.4f' % fit['Slope'])
+    print('Intercept: %.4f' % fit['Intercept'])
+    print('R2: %.2f' % fit['R2'])
+    print('Quad Fit', "Inliers coef:%s - b:%0.4f" % (np.array2string(np.array(fit['Quadratic Coefficients']), formatter={'float_kind': lambda fk: "%.4f" % fk}),
+                                                     fit['Quadratic Intercept']))
+    print('R2: %.2f' % fit['Quadratic R2'])
+    print('Cubic Fit', "Inliers coef:%s - b:%0.5f" % (np.array2string(np.array(fit['Cubic Coefficients']), formatter={'float_kind': lambda fk: "%.5f" % fk}),
+                                                      fit['Cubic Intercept']))
+    print('R2: %.2f' % fit['Cubic R2'])
 
+def plot_fit(ax, X, y, x_name, y_name, fit):
+    ax.scatter(X, y, label='training points', color='lightgray')
+    ax.plot(fit['X Fit'], fit['Linear Fit'], label='linear (d=1), $R^2=%.2f$' % fit['R2'], color='blue', lw=2, linestyle=':')
+    ax.plot(fit['X Fit'], fit['Quadratic Fit'], label='quadratic (d=2), $R^2=%.2f$' % fit['Quadratic R2'], color='red', lw=2, linestyle='-')
+    ax.plot(fit['X Fit'], fit['Cubic Fit'], label='cubic (d=3), $R^2=%.2f$' % fit['Cubic R2'], color='green', lw=2, linestyle='--')
+    ax.set_xlabel(x_name)
+    ax.set_ylabel(y_name)
+    ax.legend(loc='lower right')
 
-# Acknowledgement: Thanks to https://www.packtpub.com/au/data/python-machine-learning-third-edition
+def pair_data(df, x_name, y_name, offset):
+    pair_df = df[[x_name, y_name]].dropna() # Columns are empty when a sensor wasn't in use
+    return pair_df[[x_name]].values - offset, pair_df[[y_name]].values
+
+def summary_entry(fit):
+    return {key: fit[key] for key in fit if 'Fit' not in key}
+
+def batch_fit_pair(X, y, x_name, y_name, plot_file):
+    # Runs in a worker process. Fits one pair and saves its plot with an Agg canvas, whatever pyplot's backend is
+    fit = fit_pair(X, y)
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    plot_fit(figure.add_subplot(), X, y, x_name, y_name, fit)
+    figure.savefig(plot_file)
+    entry = summary_entry(fit)
+    entry['Samples'] = len(y)
+    entry['Plot'] = os.path.basename(plot_file)
+    return entry
 
+def write_html_report(report_file, log_file, summary):
+    rows = []
+    for performance_type in summary:
+        rows.append('<h2>' + html.escape(performance_type) + '</h2>')
+        for pair in summary[performance_type]:
+            entry = summary[performance_type][pair]
+            if 'Error' in entry:
+                rows.append('<h3>' + html.escape(pair) + '</h3><p>' + html.escape(entry['Error']) + '</p>')
+                continue
+            rows.append('<h3>' + html.escape(pair) + '</h3><p>Samples: %d, Slope: %.4f, Intercept: %.4f, Linear R2: %.2f, Quadratic R2: %.2f, Cubic R2: %.2f</p>'
+                        % (entry['Samples'], entry['Slope'], entry['Intercept'], entry['R2'], entry['Quadratic R2'], entry['Cubic R2']))
+            rows.append('<img src="' + html.escape(entry['Plot']) + '">')
+    with open(report_file, 'w') as f:
+        f.write('<html><head><title>Regression Analysis</title></head><body><h1>Regression Analysis: ' + html.escape(log_file) + '</h1>\n'
+                + '\n'.join(rows) + '\n</body></html>\n')
 
+def run_batch(log_files, output_dir, workers):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for log_file in log_files:
+            try:
+                df = load_environment_log(log_file)
+            except (IOError, ValueError) as error: # One unreadable log doesn't stop the other logs' reports
+                print('Unable to read', log_file, error)
+                continue
+            # Each log gets its own report directory, named after the log's path, when several logs are analysed
+            report_name = os.path.splitext(os.path.normpath(log_file))[0].strip(os.sep).replace(os.sep, '_')
+            report_dir = os.path.join(output_dir, report_name) if len(log_files) > 1 else output_dir
+            os.makedirs(report_dir, exist_ok=True)
+            summary = {performance_type:{} for performance_type in regression_pairs}
+            futures = {}
+            for performance_type in regression_pairs:
+                for x_name, y_name, offset in regression_pairs[performance_type]:
+                    X, y = pair_data(df, x_name, y_name, offset)
+                    if len(y) < 2:
+                        summary[performance_type][x_name + ' ' + y_name] = {'Error': 'Insufficient data'}
+                        continue
+                    plot_file = os.path.join(report_dir, (x_name + ' ' + y_name).replace(' ', '_') + '.png')
+                    futures[(performance_type, x_name + ' ' + y_name)] = executor.submit(batch_fit_pair, X, y, x_name, y_name, plot_file)
+            for performance_type, pair in futures:
+                try:
+                    summary[performance_type][pair] = futures[(performance_type, pair)].result()
+                except Exception as error: # A pair that can't be fitted is reported, like a pair with insufficient data
+                    print('Unable to fit', pair, 'in', log_file, error)
+                    summary[performance_type][pair] = {'Error': type(error).__name__ + ': ' + str(error)}
+            with open(os.path.join(report_dir, 'regression_summary.json'), 'w') as f:
+                json.dump({'Log File': log_file, 'Summary': summary}, f, indent=2)
+            write_html_report(os.path.join(report_dir, 'regression_report.html'), log_file, summary)
+            print('Regression report written to', report_dir)
 
+def run_interactive(log_file):
+    df = load_environment_log(log_file)
+    regression_summary = {performance_type:{} for performance_type in regression_pairs}
+    print(regression_summary)
+    for performance_type in regression_pairs:
+        for x_name, y_name, offset in regression_pairs[performance_type]:
+            X, y = pair_data(df, x_name, y_name, offset)
+            if len(y) < 2:
+                print('No data for', x_name, 'and', y_name)
+                continue
+            fit = fit_pair(X, y)
+            print_fit(x_name, y_name, fit)
+            regression_summary[performance_type][x_name + ' ' + y_name] = {'Slope': fit['Slope'], 'Intercept': fit['Intercept'], 'R2': fit['R2']}
+            plot_fit(plt.gca(), X, y, x_name, y_name, fit)
+            plt.show()
+    for pt in regression_summary:
+        print('')
+        print(pt, 'Summary')
+        for pair in (regression_summary[pt]):
+            print(pair, regression_summary[pt][pair])
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.batch:
+        matplotlib.use('Agg') # Renders plots to files without a display
+        run_batch(args.log_files, args.output_dir, args.workers)
+    else:
+        for log_file in args.log_files:
+            run_interactive(log_file)
 
+
+# Acknowledgement: Thanks to https://www.packtpub.com/au/data/python-machine-learning-third-edition